@@ -16,6 +16,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_rf_timeseries_1D
+from popeye.profiling import PROFILE
 
 class AuditoryModel(PopulationModel):
     
@@ -47,7 +48,7 @@ class AuditoryModel(PopulationModel):
         # invoke the base class
         PopulationModel.__init__(self, stimulus, hrf_model, normalizer)
     
-    def generate_ballpark_prediction(self, center_freq, sigma):
+    def generate_ballpark_prediction(self, center_freq, sigma, unscaled=False):
 
         r"""
         Generate a prediction for the 1D Gaussian model.
@@ -79,14 +80,18 @@ class AuditoryModel(PopulationModel):
         mask = np.ones_like(rf).astype('uint8')
         
         # extract the response
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_1D(self.stimulus.spectrogram, rf, mask)
         
         # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf())[0:len(response)]
+        model = utils.convolve_hrf(response, self.hrf())
         
         # units
         model = self.normalizer(model)
         
+        if unscaled:
+            return model
+        
         # regress out mean and amplitude
         beta, baseline = self.regress(model, self.data)
         
@@ -133,10 +138,11 @@ class AuditoryModel(PopulationModel):
         mask = np.ones_like(rf).astype('uint8')
         
         # extract the response
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_1D(self.stimulus.spectrogram, rf, mask)
         
         # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf())[0:len(response)]
+        model = utils.convolve_hrf(response, self.hrf())
         
         # units
         model = self.normalizer(model)
@@ -152,6 +158,73 @@ class AuditoryModel(PopulationModel):
             model *= beta
             
             return model
+    
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""
+        Generate predictions for many 1D Gaussian auditory pRF models at once.
+        
+        The receptive fields are stacked and applied to the spectrogram with
+        one matrix product, see `generate_predictions`.
+        
+        Paramaters
+        ----------
+        
+        parameters : ndarray
+            A (num_predictions x 4) array of `center_freq`, `sigma`, `beta`
+            and `baseline`.
+        
+        """
+        
+        center_freq, sigma, beta, baseline = parameters.T
+        
+        # receptive fields
+        freqs = 10**self.stimulus.freqs[np.newaxis]
+        rfs = np.exp(-((freqs-10**center_freq[:,np.newaxis])**2)/(2*(10**sigma[:,np.newaxis])**2))
+        rfs /= (10**sigma[:,np.newaxis]*np.sqrt(2*np.pi))
+        
+        # extract the responses
+        responses = np.dot(rfs, self.stimulus.spectrogram)
+        
+        # convolve them with the stimulus
+        models = utils.convolve_hrf(responses, self.hrf())
+        
+        return self.scale_predictions(models, beta, baseline, unscaled)
+    
+    def generate_prediction_jacobian(self, center_freq, sigma, beta, baseline):
+        
+        r"""
+        The prediction of `generate_prediction` and its analytic Jacobian.
+        
+        Both `center_freq` and `sigma` are in log10 units, so their
+        derivatives carry a factor of ln(10).
+        
+        """
+        
+        # receptive field
+        freqs = 10**self.stimulus.freqs
+        center = 10**center_freq
+        width = 10**sigma
+        rf = np.exp(-((freqs-center)**2)/(2*width**2))
+        rf /= (width*np.sqrt(2*np.pi))
+        
+        # its derivatives
+        rfs = [rf,
+               rf * (freqs-center) / width**2 * center * np.log(10),
+               rf * ((freqs-center)**2 / width**2 - 1) * np.log(10)]
+        
+        # evaluate entire RF
+        mask = np.ones_like(rf).astype('uint8')
+        
+        # extract each response and convolve it with the HRF
+        hrf = self.hrf()
+        models = []
+        for r in rfs:
+            PROFILE.count('kernel')
+            response = generate_rf_timeseries_1D(self.stimulus.spectrogram, r, mask)
+            models.append(utils.convolve_hrf(response, hrf))
+        
+        return self.scale_jacobian(models[0], models[1:], beta, baseline)
         
 class AuditoryFit(PopulationFit):
     
@@ -16,6 +16,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_rf_timeseries_1D
+from popeye.profiling import PROFILE
 
 class AuditoryModel(PopulationModel):
     
@@ -86,11 +87,12 @@ class AuditoryModel(PopulationModel):
         mask = np.ones_like(rf).astype('uint8')
         
         # extract the response
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_1D(self.stimulus.spectrogram, rf, mask)
         
         # convolve it with the stimulus
-        hrf = self.hrf_model(hrf_delay, self.stimulus.tr_length)
-        model = fftconvolve(response, hrf)[0:len(response)]
+        hrf = self.hrf(hrf_delay)
+        model = utils.convolve_hrf(response, hrf)
         
         # units
         model = (model - np.mean(model)) / np.mean(model)
@@ -143,11 +145,12 @@ class AuditoryModel(PopulationModel):
         mask = np.ones_like(rf).astype('uint8')
         
         # extract the response
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_1D(self.stimulus.spectrogram, rf, mask)
         
         # convolve it with the stimulus
-        hrf = self.hrf_model(hrf_delay, self.stimulus.tr_length)
-        model = fftconvolve(response, hrf)[0:len(response)]
+        hrf = self.hrf(hrf_delay)
+        model = utils.convolve_hrf(response, hrf)
         
         # units
         model = (model - np.mean(model)) / np.mean(model)
@@ -5,11 +5,14 @@ Base-classes for poulation encoding models and fits.
 
 """
 from popeye.onetime import auto_attr
-import time, ctypes, itertools
+import os, time, ctypes, itertools, copy
 import pickle
 import sharedmem
 from scipy.stats import linregress
+from scipy.ndimage import correlate1d
 import popeye.utilities as utils
+from popeye.profiling import PROFILE
+from popeye.spinach import generate_og_sparse_receptive_field
 import numpy as np
 import numexpr as ne
 
@@ -49,6 +52,48 @@ class PopulationModel(object):
     
     r""" Base class for all pRF models."""
     
+    # the radius, in sigmas, of a sparse receptive field
+    sparse_support = 5.0
+    
+    # the spacing, in seconds, of the kernels a free HRF delay is interpolated between
+    hrf_resolution = 0.01
+    
+    # predict from the HRF-convolved stimulus, see `hrf_response`
+    hrf_basis = False
+    
+    # apply Gaussian receptive fields as a row and a column profile, see `spatial_response`
+    separable = False
+    
+    # read the grid of `generate_ballpark_grid` off a scale-space of the stimulus,
+    # see `generate_scale_space_grid`
+    scale_space_grid = False
+    
+    # compute the spatial response of each grid (x, y, sigma) once, and fan it out
+    # over the rest of the grid, see `generate_fanned_grid`
+    fanned_grid = False
+    
+    # 'powell', 'projected', 'mixture' or 'least_squares', see `PopulationFit.gradient_descent`
+    finisher = 'powell'
+    
+    # the position among the parameters of a weight that mixes the two regressors of
+    # `generate_mp_regressors`, which the 'mixture' finisher solves in closed form
+    weight_index = None
+    
+    # solve that weight in closed form in the grid-search too, see `popeye.utilities.mixture_grid_search`
+    mixture_grid = False
+    
+    # the scale factors of the stimulus the finisher refines at, coarsest first,
+    # before its final polish at native resolution
+    pyramid = ()
+    
+    # the iterations of that polish, None for no limit
+    polish_iterations = None
+    
+    # the model reads the native stimulus only through `VisualStimulus.project`,
+    # so that a 'packed' stimulus never has to be unpacked. a model that does not
+    # refuses a 'packed' stimulus
+    packed_stimulus = False
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change, cached_model_path=None, nuisance=None):
         
         r"""Base class for all pRF models.
@@ -81,16 +126,139 @@ class PopulationModel(object):
         self.nuisance = nuisance
         self.cached_model_path = cached_model_path
         
-        # set up cached model if specified
-        if self.cached_model_path is not None: # pragma: no cover
+        # set up cached model if specified. a pickled cache is loaded into
+        # shared memory before any workers are forked. a cache written with
+        # `cache_model(..., path=...)` is memory-mapped on first use instead,
+        # once the HRF it is checked against has been set.
+        if self.cached_model_path is not None and not utils.is_cached_model(self.cached_model_path): # pragma: no cover
             self.resurrect_cached_model
         
+        # a 'packed' stimulus would have to be unpacked at full size for a model that
+        # reads it directly, taking more memory than the 'native' layout. the coarse
+        # stimulus is small, and is unpacked into shared memory now, before any workers
+        # are forked, so that they don't each unpack their own copy.
+        if getattr(self.stimulus, 'layout', None) == 'packed':
+            if not self.packed_stimulus:
+                raise ValueError("%s reads the stimulus directly, use the 'native' layout." %(type(self).__name__))
+            self.stimulus.stim_arr0
+        
     def generate_ballpark_prediction(self): # pragma: no cover
         raise NotImplementedError("Each pRF model must implement its own ballpark prediction!") 
     
     def generate_prediction(self): # pragma: no cover
         raise NotImplementedError("Each pRF model must implement its own prediction!")
     
+    def generate_prediction_jacobian(self): # pragma: no cover
+        raise NotImplementedError("This pRF model has no analytic Jacobian, use the 'powell' finisher!")
+    
+    def generate_mp_regressors(self): # pragma: no cover
+        raise NotImplementedError("This pRF model has no mixing weight, see `weight_index`!")
+    
+    def ballpark_prediction_block(self, responses, parameters): # pragma: no cover
+        raise NotImplementedError("This pRF model has no ballpark predictions from spatial responses!")
+    
+    def generate_predictions(self, parameters, unscaled=False, chunk_size=256):
+        
+        r"""The prediction of every row of a parameter matrix.
+        
+        The rows are predicted `chunk_size` at a time by
+        `generate_prediction_block`, which models override to build all the
+        receptive fields of a chunk as one stack, project them onto the
+        stimulus with one matrix product and convolve them with the HRF with
+        one FFT.
+        
+        Paramaters
+        ----------
+        
+        parameters : ndarray
+            A (num_predictions x num_parameters) array, each row laid out as
+            the arguments of `generate_prediction`.
+        
+        unscaled : bool
+            Return the normalized predictions, without `beta` and `baseline`.
+        
+        chunk_size : int
+            The number of rows predicted at once, which bounds the memory
+            held by the stack of receptive fields.
+        
+        Returns
+        -------
+        
+        predictions : ndarray
+            A (num_predictions x time) array.
+        
+        """
+        
+        parameters = np.atleast_2d(np.asarray(parameters, dtype='double'))
+        
+        blocks = [self.generate_prediction_block(parameters[start:start+chunk_size], unscaled)
+                  for start in range(0, parameters.shape[0], chunk_size)]
+        
+        return np.concatenate(blocks)
+    
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""Predicts a chunk of rows for `generate_predictions`, one at a time unless overridden."""
+        
+        return np.array([self.generate_prediction(*p, unscaled=unscaled) for p in parameters])
+    
+    def scale_jacobian(self, model, derivatives, beta, baseline, normalizer=None):
+        
+        r"""Turns derivatives of a raw model time-series into those of the prediction.
+        
+        Models predict `beta * (normalizer(model) + baseline)`, where `model`
+        is the HRF-convolved response of the receptive field. Given the
+        derivatives of `model` with respect to each receptive field
+        parameter, this returns the prediction and its Jacobian with respect
+        to those parameters followed by `beta` and `baseline`. The
+        normalizer is only O(time), so its derivative is taken as a central
+        difference along each direction.
+        
+        Paramaters
+        ----------
+        
+        model : ndarray
+            The HRF-convolved response, before normalization.
+        
+        derivatives : list
+            The derivative of `model` with respect to each parameter.
+        
+        beta, baseline : float
+            The amplitude and offset of the prediction.
+        
+        normalizer : callable
+            Defaults to `self.normalizer`.
+        
+        Returns
+        -------
+        
+        prediction : ndarray
+            The prediction, as `generate_prediction` would return it.
+        
+        jacobian : ndarray
+            The (time x parameters) Jacobian of the prediction.
+        
+        """
+        
+        if normalizer is None:
+            normalizer = self.normalizer
+        
+        normalized = normalizer(model)
+        
+        columns = []
+        for derivative in derivatives:
+            scale = np.max(np.abs(derivative))
+            if scale == 0:
+                columns.append(np.zeros_like(normalized))
+                continue
+            h = 1e-6 * np.max(np.abs(model)) / scale
+            columns.append(beta * (normalizer(model + h*derivative) - normalizer(model - h*derivative)) / (2*h))
+        
+        columns.append(normalized + baseline)
+        columns.append(np.repeat(beta, len(normalized)))
+        
+        return beta * (normalized + baseline), np.column_stack(columns)
+    
     def regress(self, X, y):
         slope, intercept = linregress(X, y)[0:2]
         if hasattr(self, 'bounded_amplitude') and self.bounded_amplitude:
@@ -120,22 +288,351 @@ class PopulationModel(object):
             
         return mask
     
-    def hrf(self):
-        if hasattr(self, 'hrf_delay'): # pragma: no cover
-            return self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
+    def rf_support(self):
+        
+        r"""The radius, in units of sigma, of a sparse receptive field.
+        
+        This follows `mask_size` when it is set, so that the sparse receptive
+        field covers the same pixels as `distance_mask`. Otherwise it reaches
+        out to `sparse_support` sigmas, beyond which a Gaussian is negligible.
+        
+        """
+        
+        if hasattr(self, 'mask_size'): # pragma: no cover
+            return np.sqrt(self.mask_size)
+        else:
+            return self.sparse_support
+    
+    def sparse_receptive_field(self, x, y, sigma):
+        
+        r"""The Gaussian receptive field of `generate_prediction`, limited to its support.
+        
+        Rather than a screen-sized receptive field and mask, this returns the
+        flat index and the weight of just the pixels the receptive field
+        covers, which `popeye.spinach.generate_sparse_rf_timeseries` gathers
+        from the stimulus.
+        
+        Returns
+        -------
+        
+        pixels : ndarray
+            The flat index of each covered pixel of `stimulus.deg_x`.
+        
+        weights : ndarray
+            The normalized receptive field at each of those pixels.
+        
+        """
+        
+        pixels, weights = generate_og_sparse_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y,
+                                                             self.rf_support())
+        weights /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2
+        
+        return pixels, weights
+    
+    def separable_receptive_field(self, x, y, sigma):
+        
+        r"""The Gaussian receptive field of `sparse_receptive_field`, as two 1D profiles.
+        
+        On the rectilinear grid of `stimulus.deg_x` and `stimulus.deg_y`, a
+        circular Gaussian is the outer product of a profile down the rows and
+        a profile across the columns. Each profile is limited to the pixels
+        within `rf_support()` sigmas of the center, so the receptive field
+        covers a square rather than the disc of `sparse_receptive_field`.
+        The normalization is carried by the column profile.
+        
+        Returns
+        -------
+        
+        row0 : int
+            The first row the receptive field covers.
+        
+        row_weights : ndarray
+            The profile down the rows from `row0`.
+        
+        col0 : int
+            The first column the receptive field covers.
+        
+        col_weights : ndarray
+            The profile across the columns from `col0`.
+        
+        """
+        
+        deg_x = self.stimulus.deg_x[0,:]
+        deg_y = self.stimulus.deg_y[:,0]
+        support = self.rf_support() * sigma
+        
+        # the rows and columns within the support, contiguous on a monotonic grid
+        rows = np.flatnonzero(np.abs(deg_y - y) <= support)
+        cols = np.flatnonzero(np.abs(deg_x - x) <= support)
+        if len(rows) == 0 or len(cols) == 0:
+            return 0, np.zeros(0), 0, np.zeros(0)
+        
+        row_weights = np.exp(-(deg_y[rows] - y)**2 / (2 * sigma**2))
+        col_weights = np.exp(-(deg_x[cols] - x)**2 / (2 * sigma**2))
+        col_weights /= (2 * np.pi * sigma**2) * 1/np.diff(deg_x[0:2])**2
+        
+        return rows[0], row_weights, cols[0], col_weights
+    
+    def spatial_response(self, x, y, sigma, hrf=None):
+        
+        r"""The stimulus seen through the Gaussian receptive field at `x`, `y` and `sigma`.
+        
+        If `separable` is set, the receptive field is applied as the two
+        profiles of `separable_receptive_field` by
+        `VisualStimulus.project_separable`. Otherwise it is the receptive
+        field of `sparse_receptive_field`. If `hrf` is given, the response is
+        convolved with it, as in `hrf_response`.
+        
+        """
+        
+        if not self.separable:
+            
+            pixels, weights = self.sparse_receptive_field(x, y, sigma)
+            
+            if hrf is None:
+                return self.stimulus.project(weights, pixels)
+            elif self.hrf_basis:
+                return self.stimulus.project_convolved(weights, hrf, pixels)
+            
+            return utils.convolve_hrf(self.stimulus.project(weights, pixels), hrf)
+        
+        row0, row_weights, col0, col_weights = self.separable_receptive_field(x, y, sigma)
+        
+        if hrf is None:
+            return self.stimulus.project_separable(row_weights, col_weights, row0, col0)
+        elif self.hrf_basis:
+            return self.stimulus.project_separable(row_weights, col_weights, row0, col0, hrf=hrf)
+        
+        return utils.convolve_hrf(self.stimulus.project_separable(row_weights, col_weights, row0, col0), hrf)
+    
+    def at_scale(self, scale_factor):
+        
+        r"""A copy of this model that predicts from the stimulus resampled by `scale_factor`.
+        
+        The resampled stimulus comes from `VisualStimulus.resampled`, which
+        keeps it, so every copy at the same scale shares it. Resample the
+        stimulus before forking any workers for it to be shared with them.
+        
+        """
+        
+        model = copy.copy(self)
+        model.stimulus = self.stimulus.resampled(scale_factor)
+        
+        return model
+    
+    def hrf(self, hrf_delay=None):
+        
+        r"""The HRF of this model, from the cache of `popeye.utilities.hrf_kernel`.
+        
+        Without `hrf_delay` this is the HRF of the fixed `self.hrf_delay`.
+        Models that estimate the delay pass it in, and get an HRF
+        interpolated between kernels `hrf_resolution` seconds apart.
+        
+        """
+        
+        if hrf_delay is not None:
+            return utils.hrf_kernel(self.hrf_model, hrf_delay, self.stimulus.tr_length, self.hrf_resolution)
+        elif hasattr(self, 'hrf_delay'): # pragma: no cover
+            return utils.hrf_kernel(self.hrf_model, self.hrf_delay, self.stimulus.tr_length)
         else: # pragma: no cover
             raise NotImplementedError("You must set the HRF delay to generate the HRF")
     
-    def cache_model(self, grids, ncpus=1, Ns=None, verbose=False):
+    def hrf_response(self, weights, pixels=None, downsampled=False):
+        
+        r"""The stimulus seen through a linear receptive field, convolved with the HRF.
+        
+        `weights` and `pixels` are as in `VisualStimulus.project`. If
+        `hrf_basis` is set, the weights are applied to the stimulus convolved
+        with `self.hrf()` once up front, see `VisualStimulus.convolved`, so
+        there is no FFT per prediction. Otherwise the response is convolved
+        afterwards. Both give the same time-series.
+        
+        """
+        
+        hrf = self.hrf()
+        
+        if self.hrf_basis:
+            return self.stimulus.project_convolved(weights, hrf, pixels, downsampled)
+        
+        response = self.stimulus.project(weights, pixels, downsampled)
+        return utils.convolve_hrf(response, hrf)
+    
+    def hrf_responses(self, rfs, hrf=None, downsampled=False):
+        
+        r"""Like `hrf_response`, for a stack of receptive fields at once.
+        
+        The stack is projected with one matrix product, see
+        `VisualStimulus.project`, and convolved with one FFT, see
+        `popeye.utilities.convolve_hrf`. `hrf` defaults to `self.hrf()` and
+        may also hold one HRF per receptive field.
+        
+        """
+        
+        if hrf is None:
+            hrf = self.hrf()
+            if self.hrf_basis:
+                return self.stimulus.project_convolved(rfs, hrf, downsampled=downsampled)
+        
+        responses = self.stimulus.project(rfs, downsampled=downsampled)
+        return utils.convolve_hrf(responses, hrf)
+    
+    def pixel_distances(self, x, y, downsampled=False):
+        
+        r"""The squared distance of every pixel from each of the centers `x` and `y`.
+        
+        Returns a (len(x) x rows x columns) stack.
+        
+        """
         
-        # get parameter space
-        if isinstance(grids[0], SliceType):
-            params = [list(np.arange(g.start,g.stop,g.step)) for g in grids]
+        if downsampled:
+            deg_x, deg_y = self.stimulus.deg_x0, self.stimulus.deg_y0
         else:
-            params = [list(np.linspace(g[0],g[1],Ns)) for g in grids]
+            deg_x, deg_y = self.stimulus.deg_x, self.stimulus.deg_y
+        
+        x = np.asarray(x, dtype='double')[:,np.newaxis,np.newaxis]
+        y = np.asarray(y, dtype='double')[:,np.newaxis,np.newaxis]
+        
+        return (deg_x[np.newaxis] - x)**2 + (deg_y[np.newaxis] - y)**2
+    
+    def gaussian_receptive_fields(self, x, y, sigma, support=None, downsampled=False):
+        
+        r"""A stack of the receptive fields of `sparse_receptive_field`, one per center.
+        
+        Each receptive field is zero beyond `support` sigmas, which defaults
+        to `rf_support()`, and is normalized the same way as
+        `sparse_receptive_field`. Pass `support=np.inf` for receptive fields
+        covering the whole display.
+        
+        """
+        
+        if support is None:
+            support = self.rf_support()
+        
+        if downsampled:
+            deg_x = self.stimulus.deg_x0
+        else:
+            deg_x = self.stimulus.deg_x
+        
+        d = self.pixel_distances(x, y, downsampled)
+        sigma = np.asarray(sigma, dtype='double')[:,np.newaxis,np.newaxis]
+        
+        rfs = np.exp(-d/(2*sigma**2))
+        rfs[d > (support*sigma)**2] = 0
+        rfs /= (2 * np.pi * sigma**2) * 1/np.diff(deg_x[0,0:2])**2
+        
+        return rfs
+    
+    def nearest_pixels(self, x, y, downsampled=True):
+        
+        r"""The row and column of the pixel nearest to each of the centers `x` and `y`.
+        
+        Returns the rows and columns, and the `x` and `y` of those pixels.
+        
+        """
+        
+        if downsampled:
+            deg_x, deg_y = self.stimulus.deg_x0[0,:], self.stimulus.deg_y0[:,0]
+        else:
+            deg_x, deg_y = self.stimulus.deg_x[0,:], self.stimulus.deg_y[:,0]
+        
+        cols = np.argmin(np.abs(deg_x[np.newaxis] - np.asarray(x)[:,np.newaxis]), 1)
+        rows = np.argmin(np.abs(deg_y[np.newaxis] - np.asarray(y)[:,np.newaxis]), 1)
+        
+        return rows, cols, deg_x[cols], deg_y[rows]
+    
+    def scale_space(self, sigma, downsampled=True):
+        
+        r"""The stimulus filtered by a Gaussian receptive field of width `sigma`.
+        
+        Each pixel of the result is the response of the receptive field of
+        `separable_receptive_field` centered on that pixel. A row pass and a
+        column pass over every frame therefore give the response of every
+        center at once.
+        
+        Returns
+        -------
+        
+        stack : ndarray
+            The (rows x columns x time) filtered stimulus.
+        
+        """
+        
+        if downsampled:
+            deg_x, stim_arr = self.stimulus.deg_x0, self.stimulus.stim_arr0
+        else:
+            deg_x, stim_arr = self.stimulus.deg_x, self.stimulus.stim_arr
+        
+        # the profile, out to the support
+        dx = np.abs(np.diff(deg_x[0,0:2]))[0]
+        radius = int(np.floor(self.rf_support() * sigma / dx))
+        kernel = np.exp(-(np.arange(-radius, radius+1) * dx)**2 / (2 * sigma**2))
+        
+        # down the rows, then across the columns
+        with PROFILE.timer('scale_space'):
+            stack = correlate1d(np.asarray(stim_arr, dtype='double'), kernel, axis=0, mode='constant')
+            stack = correlate1d(stack, kernel, axis=1, mode='constant')
+        
+        return stack / ((2 * np.pi * sigma**2) * 1/dx**2)
+    
+    def scale_predictions(self, models, beta, baseline, unscaled=False, normalizer=None):
+        
+        r"""Normalizes each row of `models` and scales it by its `beta` and `baseline`.
+        
+        This is the end of `generate_prediction` for a stack of time-series.
+        `normalizer` defaults to `self.normalizer`, and is applied row by row.
+        
+        """
+        
+        if normalizer is None:
+            normalizer = self.normalizer
+        
+        models = np.array([normalizer(model) for model in models])
+        
+        if unscaled:
+            return models
+        
+        return beta[:,np.newaxis] * (models + baseline[:,np.newaxis])
+    
+    def cache_header(self, grids=None, Ns=None):
+        
+        r"""Describes what a cached model of this `PopulationModel` depends on.
+        
+        The header records the stimulus, the HRF and the normalizer, as well as
+        the grid the cache was built from. A cached model whose stimulus, HRF or
+        normalizer differ from those of the model that loads it is stale.
+        
+        """
+        
+        # the hrf kernel can only be generated once the delay is known
+        if hasattr(self, 'hrf_delay'):
+            kernel = utils.fingerprint(self.hrf())
+        else:
+            kernel = None
+        
+        header = {'model': self.__class__.__name__,
+                  'stimulus': self.stimulus.fingerprint,
+                  'hrf': {'model': getattr(self.hrf_model, '__name__', repr(self.hrf_model)),
+                          'tr_length': float(self.stimulus.tr_length),
+                          'kernel': kernel},
+                  'normalizer': getattr(self.normalizer, '__name__', repr(self.normalizer))}
+        
+        if grids is not None:
+            header['grids'] = utils.grid_spec(grids, Ns)
+        
+        return header
+    
+    def cache_model(self, grids, ncpus=1, Ns=None, verbose=False, path=None):
+        
+        r"""Generates the prediction for every point of a brute-force grid.
+        
+        If `path` is given, the predictions are also written to disk with
+        `popeye.utilities.save_cached_model`, and can be used by passing
+        `cached_model_path=path` to the model.
+        
+        """
         
         # make combos
-        combos = np.array([c for c in itertools.product(*params)])
+        combos = utils.grid_parameters(grids, Ns)
         # const = np.vstack((np.ones(combos.shape[0]),np.zeros(combos.shape[0]))).T
         # combos = np.concatenate((combos,const,1))
         
@@ -157,11 +654,183 @@ class PopulationModel(object):
         # clean up
         models = [m for m in models if not np.isnan(np.sum(m[0]))]
         
+        # write it out
+        if path is not None:
+            utils.save_cached_model(path,
+                                    np.array([m[0] for m in models]),
+                                    np.array([m[1] for m in models]),
+                                    self.cache_header(grids, Ns))
+        
         # turn into array
         return models
     
+    def generate_ballpark_grid(self, grids, Ns=None, ncpus=1):
+        
+        r"""Generates the unscaled ballpark prediction for every grid point.
+        
+        The predictions only depend on the stimulus and the grid, not on the
+        data, so they are computed once and can then be scored against any
+        number of voxels with `popeye.utilities.batch_brute_force_search`.
+        The model must support `generate_ballpark_prediction(..., unscaled=True)`,
+        unless `scale_space_grid` or `fanned_grid` is set, see
+        `generate_scale_space_grid` and `generate_fanned_grid`.
+        
+        Paramaters
+        ----------
+        
+        grids : tuple
+            The brute-force search space, as passed to `PopulationFit`.
+        
+        Ns : int
+            Number of samples per dimension. Ignored when `grids` holds
+            slice objects.
+        
+        ncpus : int
+            The number of CPUs used to compute the predictions.
+        
+        Returns
+        -------
+        
+        predictions : ndarray
+            A shared array with one unscaled prediction per grid point.
+        
+        parameters : ndarray
+            The grid point that produced each row of `predictions`.
+        
+        """
+        
+        if self.scale_space_grid:
+            return self.generate_scale_space_grid(grids, Ns)
+        elif self.fanned_grid:
+            return self.generate_fanned_grid(grids, Ns)
+        
+        # grid points
+        parameters = utils.grid_parameters(grids, Ns)
+        
+        def mini_predictor(combo): # pragma: no cover
+            return self.generate_ballpark_prediction(*combo, unscaled=True)
+        
+        # compute predictions
+        if ncpus > 1: # pragma: no cover
+            with sharedmem.Pool(np=ncpus) as pool:
+                predictions = pool.map(mini_predictor, parameters)
+        else:
+            predictions = [mini_predictor(combo) for combo in parameters]
+        
+        # share them with the workers
+        predictions = utils.generate_shared_array(np.array(predictions), np.double)
+        parameters = utils.generate_shared_array(parameters, np.double)
+        
+        return predictions, parameters
+    
+    def generate_scale_space_grid(self, grids, Ns=None):
+        
+        r"""Like `generate_ballpark_grid`, with the receptive fields read off a scale-space.
+        
+        The first three dimensions of `grids` are the `x`, `y` and `sigma` of
+        a Gaussian receptive field. The downsampled stimulus is filtered once
+        per `sigma` with `scale_space`. The response at any center is then
+        one pixel of the filtered stimulus, so dense grids of centers cost
+        little more than coarse ones. Each center is moved to its nearest
+        pixel, and the returned `parameters` hold the moved centers. The
+        model turns the responses into unscaled predictions with
+        `ballpark_prediction_block`.
+        
+        """
+        
+        # grid points, on the pixels
+        parameters = utils.grid_parameters(grids, Ns)
+        parameters[:,0:2] = np.array(self.nearest_pixels(parameters[:,0], parameters[:,1])[2:]).T
+        parameters = utils.unique_rows(parameters)[0]
+        rows, cols = self.nearest_pixels(parameters[:,0], parameters[:,1])[0:2]
+        
+        # one filtered stimulus per sigma
+        predictions = np.zeros((parameters.shape[0], self.stimulus.run_length))
+        for sigma in np.unique(parameters[:,2]):
+            idx = np.flatnonzero(parameters[:,2] == sigma)
+            stack = self.scale_space(sigma)
+            predictions[idx] = self.ballpark_prediction_block(stack[rows[idx], cols[idx]], parameters[idx])
+        
+        # share them with the workers
+        predictions = utils.generate_shared_array(predictions, np.double)
+        parameters = utils.generate_shared_array(parameters, np.double)
+        
+        return predictions, parameters
+    
+    def generate_fanned_grid(self, grids, Ns=None, chunk_size=256):
+        
+        r"""Like `generate_ballpark_grid`, with each spatial response computed once.
+        
+        The first three dimensions of `grids` are the `x`, `y` and `sigma` of
+        a Gaussian receptive field, and the ballpark depends on the rest, such
+        as the exponent of a compressive model, only through that
+        receptive field's response. The receptive field covers the whole
+        display, or the pixels within `mask_size` if the model sets it, as in
+        `distance_mask_coarse`. Each (x, y, sigma) is projected onto the
+        downsampled stimulus once, `chunk_size` of them per matrix product,
+        and its response is fanned out over the rest of the grid by
+        `ballpark_prediction_block`. The cost of the projections does not
+        grow with the samples of the other dimensions.
+        
+        """
+        
+        # grid points, and the spatial grid they share
+        parameters = utils.grid_parameters(grids, Ns)
+        spatial, inverse = utils.unique_rows(parameters[:,0:3])
+        
+        predictions = np.zeros((parameters.shape[0], self.stimulus.run_length))
+        for start in range(0, spatial.shape[0], chunk_size):
+            
+            # the spatial responses, over the whole display like the ballpark
+            x, y, sigma = spatial[start:start+chunk_size].T
+            rfs = self.gaussian_receptive_fields(x, y, sigma, support=np.inf, downsampled=True)
+            
+            # within the mask of `distance_mask_coarse`, if the ballpark has one
+            if hasattr(self, 'mask_size'):
+                rfs[self.pixel_distances(x, y, True) >= self.mask_size*sigma[:,np.newaxis,np.newaxis]**2] = 0
+            
+            responses = self.stimulus.project(rfs, downsampled=True)
+            
+            # fanned out
+            idx = np.flatnonzero((inverse >= start) & (inverse < start+chunk_size))
+            predictions[idx] = self.ballpark_prediction_block(responses[inverse[idx]-start], parameters[idx])
+        
+        # share them with the workers
+        predictions = utils.generate_shared_array(predictions, np.double)
+        parameters = utils.generate_shared_array(parameters, np.double)
+        
+        return predictions, parameters
+    
+    def ballpark_grid(self, grids, Ns=None):
+        
+        r"""`generate_ballpark_grid`, computed once per grid and kept."""
+        
+        if not hasattr(self, 'ballpark_grids'):
+            self.ballpark_grids = {}
+        
+        key = repr(utils.grid_spec(grids, Ns))
+        if key not in self.ballpark_grids:
+            self.ballpark_grids[key] = self.generate_ballpark_grid(grids, Ns)
+        
+        return self.ballpark_grids[key]
+    
     @auto_attr
     def resurrect_cached_model(self):
+        
+        if utils.is_cached_model(self.cached_model_path):
+            
+            # zero-copy
+            timeseries, parameters, header = utils.load_cached_model(self.cached_model_path)
+            
+            # refuse a stale cache
+            current = self.cache_header()
+            stale = [key for key in ('stimulus', 'hrf', 'normalizer') if header.get(key) != current[key]]
+            if stale:
+                raise ValueError("The cached model at %s is stale, its %s changed since it was cached."
+                                 %(self.cached_model_path, ' and '.join(stale)))
+            
+            return timeseries, parameters
+        
         dat = pickle.load(open(self.cached_model_path, 'rb'))
         timeseries = utils.generate_shared_array(np.array([d[0] for d in dat]), np.double)
         parameters = utils.generate_shared_array(np.array([d[1] for d in dat]), np.double)
@@ -174,6 +843,17 @@ class PopulationModel(object):
     @auto_attr
     def cached_model_parameters(self): # pragma: no cover
         return self.resurrect_cached_model[1]
+    
+    @auto_attr
+    def cached_model_norms(self):
+        
+        r"""The squared norm of each cached time-series, used by `best_cached_model_parameters`."""
+        
+        path = os.path.join(self.cached_model_path, 'norms.npy')
+        if utils.is_cached_model(self.cached_model_path) and os.path.isfile(path):
+            return np.load(path, mmap_mode='r')
+        else:
+            return utils.squared_norms(self.cached_model_timeseries)
         
         
 class PopulationFit(object):
@@ -276,39 +956,66 @@ class PopulationFit(object):
         
         # automatic fitting
         if self.auto_fit: # pragma: no cover
-            
-            # start
-            self.start = time.time()
-            
-            # fit
+            self.run()
+    
+    def run(self):
+        
+        r"""Runs the ballpark and final fitting procedures for this voxel.
+        
+        This is what `auto_fit` invokes on instantiation. It can also be
+        called on a fit created with `auto_fit=False`, for instance after a
+        `ballpark` has been assigned from a batch grid-search such as
+        `popeye.utilities.batch_brute_force_search`.
+        
+        """
+        
+        # start
+        self.start = time.time()
+        snapshot = PROFILE.snapshot()
+        
+        # fit
+        with PROFILE.stage('grid'):
             self.ballpark
+        with PROFILE.stage('finish'):
             self.estimate
-            self.overloaded_estimate
-            
-            # finish
-            self.finish = time.time()
-            
-            # performance
-            self.rss
-            self.rsquared
-            
-            # flush if not testing
-            if not hasattr(self.model, 'store_search_space'): # pragma: no cover
-                self.gradient_descent = [None]*6
-                self.brute_force = [None,]*4
-            
-            # print
-            if self.verbose: # pragma: no cover
-                print(self.msg)
+        self.overloaded_estimate
+        
+        # finish
+        self.finish = time.time()
+        
+        # what the stages of this voxel counted and timed, see `popeye.profiling`
+        self.profile = PROFILE.since(snapshot)
+        
+        # performance
+        self.rss
+        self.rsquared
+        
+        # keep the convergence info before it is flushed
+        self.result
+        
+        # flush if not testing
+        if not hasattr(self.model, 'store_search_space'): # pragma: no cover
+            self.gradient_descent = [None]*6
+            self.brute_force = [None,]*4
+        
+        # print
+        if self.verbose: # pragma: no cover
+            print(self.msg)
+    
     
+    @auto_attr
+    def result(self):
+        
+        r"""A lean `PopulationFitResult` holding only the outcome of this fit."""
+        
+        return PopulationFitResult(self)
     
     @auto_attr
-    def best_cached_model_parameters(self): # pragma: no cover
-        a = self.model.cached_model_timeseries
-        b = self.data
-        rss = ne.evaluate('sum((a-b)**2,axis=1)')
-        idx = np.argmin(rss)
-        return self.model.cached_model_parameters[idx]
+    def best_cached_model_parameters(self):
+        idx, rss = utils.cached_model_search(self.data,
+                                             self.model.cached_model_timeseries,
+                                             self.model.cached_model_norms)
+        return np.array(self.model.cached_model_parameters[idx[0,0]])
     
     # the brute search
     @auto_attr
@@ -322,12 +1029,43 @@ class PopulationFit(object):
                                         self.very_verbose)
     
     @auto_attr
-    def ballpark(self):
+    def grid_estimate(self):
         
-        if self.model.cached_model_path is not None: # pragma: no cover
+        if self.model.cached_model_path is not None:
             return self.best_cached_model_parameters
+        elif self.model.mixture_grid:
+            return self.mixture_grid_estimate
+        elif self.model.scale_space_grid or self.model.fanned_grid:
+            return self.batch_grid_estimate
         else:
-            return np.append(self.brute_force[0],(self.slope,self.intercept))
+            return self.brute_force[0]
+    
+    @auto_attr
+    def mixture_grid_estimate(self):
+        
+        # the regressors of the downsampled stimulus, like the ballpark
+        def regressor_function(*parameters):
+            return self.model.generate_mp_regressors(*parameters, downsampled=True)
+        
+        bounded_amplitude = getattr(self.model, 'bounded_amplitude', False)
+        return utils.mixture_grid_search(self.data, regressor_function, self.grids, self.bounds,
+                                         self.model.weight_index, self.Ns, bounded_amplitude,
+                                         self.very_verbose)[0]
+    
+    @auto_attr
+    def batch_grid_estimate(self):
+        
+        # the grid is computed once, and shared by every fit of the model
+        predictions, parameters = self.model.ballpark_grid(self.grids, self.Ns)
+        bounded_amplitude = getattr(self.model, 'bounded_amplitude', False)
+        ballparks, rss = utils.batch_brute_force_search(self.data, predictions, parameters,
+                                                        bounded_amplitude, bounds=self.bounds)
+        
+        return ballparks[0,0:-2]
+    
+    @auto_attr
+    def ballpark(self):
+        return np.append(self.grid_estimate,(self.slope,self.intercept))
     
     # the gradient search
     @auto_attr
@@ -336,12 +1074,56 @@ class PopulationFit(object):
         if self.very_verbose: # pragma: no cover
             print('The gridfit solution was %s, starting gradient descent ...' %(self.ballpark))
         
+        # without a pyramid, straight to native resolution
+        if not self.model.pyramid:
+            return self.refine(self.model, self.ballpark)
+        
+        # refine at each level of the pyramid, coarsest first
+        seed = self.ballpark
+        for scale_factor in self.model.pyramid:
+            seed = self.refine(self.model.at_scale(scale_factor), seed)[0]
+        
+        # and polish at native resolution
+        return self.refine(self.model, seed, self.model.polish_iterations)
+    
+    def refine(self, model, seed, maxiter=None):
+        
+        r"""Runs the finisher of `model` from `seed`, see `PopulationModel.finisher`.
+        
+        Returns the output of `popeye.utilities.gradient_descent_search`, or
+        the same layout from `popeye.utilities.least_squares_search`.
+        
+        """
+        
+        if model.finisher == 'least_squares':
+            return utils.least_squares_search(self.data,
+                                              model.generate_prediction_jacobian,
+                                              seed,
+                                              self.bounds,
+                                              self.very_verbose,
+                                              maxiter)
+        
+        # with 'mixture', powell doesn't search the mixing weight either
+        if model.finisher == 'mixture':
+            return utils.mixture_search(self.data,
+                                        model.generate_mp_regressors,
+                                        model.generate_prediction,
+                                        seed,
+                                        self.bounds,
+                                        model.weight_index,
+                                        self.very_verbose,
+                                        maxiter,
+                                        getattr(model, 'bounded_amplitude', False))
+        
+        # with 'projected', powell searches only the nonlinear parameters
         return utils.gradient_descent_search(self.data,
                                              utils.error_function,
-                                             self.model.generate_prediction,
-                                             self.ballpark,
+                                             model.generate_prediction,
+                                             seed,
                                              self.bounds,
-                                             self.very_verbose)
+                                             self.very_verbose,
+                                             model.finisher == 'projected',
+                                             maxiter)
     @auto_attr
     def overloaded_estimate(self): # pragma: no cover
         
@@ -369,7 +1151,7 @@ class PopulationFit(object):
     
     @auto_attr
     def ballpark_prediction(self):
-        return self.model.generate_prediction(*np.append(self.brute_force[0],(1,0)), unscaled=True)
+        return self.model.generate_prediction(*np.append(self.grid_estimate,(1,0)), unscaled=True)
     
     @auto_attr
     def scaled_ballpark_prediction(self):
@@ -422,6 +1204,86 @@ class PopulationFit(object):
                   np.round(self.estimate,4)))
         return txt
             
+class PopulationFitResult(object):
+    
+    r"""The outcome of a `PopulationFit`, without the arrays it was computed from."""
+    
+    __slots__ = ('Fit', 'voxel_index', 'estimate', 'overloaded_estimate',
+                 'rsquared', 'rss', 'start', 'finish',
+                 'iterations', 'funcalls', 'warnflag', 'profile')
+    
+    def __init__(self, fit):
+        
+        r"""A lean record of a fitted voxel.
+        
+        A `PopulationFit` caches its data, predictions and search output, all
+        of which have to be pickled when it is returned from a worker. The
+        result keeps only what is needed to build the parameter maps, and
+        can be passed to `popeye.utilities.recast_estimation_results` in
+        place of the fit. Use `to_fit` to get a full fit back.
+        
+        Paramaters
+        ----------
+        
+        fit : `PopulationFit` class instance
+            A fit whose estimate has been computed.
+        
+        """
+        
+        self.Fit = fit.__class__
+        self.voxel_index = fit.voxel_index
+        self.estimate = np.array(fit.estimate)
+        if fit.overloaded_estimate is not None:
+            self.overloaded_estimate = np.array(fit.overloaded_estimate)
+        else:
+            self.overloaded_estimate = None
+        self.rsquared = fit.rsquared
+        self.rss = fit.rss
+        self.start = getattr(fit, 'start', None)
+        self.finish = getattr(fit, 'finish', None)
+        self.profile = getattr(fit, 'profile', None)
+        
+        # the powell output, when the fit ran one
+        output = fit.__dict__.get('gradient_descent')
+        if output is not None and len(output) >= 6 and output[3] is not None:
+            self.iterations, self.funcalls, self.warnflag = output[3:6]
+        else:
+            self.iterations, self.funcalls, self.warnflag = None, None, None
+    
+    @property
+    def duration(self):
+        
+        r"""The time in seconds the fit took, if it was timed."""
+        
+        if self.start is None or self.finish is None:
+            return None
+        return self.finish - self.start
+    
+    @property
+    def converged(self):
+        
+        r"""False if the gradient-descent stopped before converging."""
+        
+        return self.warnflag is None or self.warnflag == 0
+    
+    def to_fit(self, model, data, grids, bounds, Ns=None, verbose=0):
+        
+        r"""Rebuilds the full fit, without refitting.
+        
+        The fit is created with `auto_fit=False` and its estimate is set to
+        the stored one, so that the prediction and any derived attributes
+        are recomputed on demand from `data`.
+        
+        """
+        
+        fit = self.Fit(model, data, grids, bounds, voxel_index=self.voxel_index,
+                       Ns=Ns, auto_fit=False, verbose=verbose)
+        fit.estimate = self.estimate
+        if self.start is not None:
+            fit.start = self.start
+            fit.finish = self.finish
+        return fit
+    
 class StimulusModel(object):
 
     def __init__(self, stim_arr, dtype=ctypes.c_int16, tr_length=1.0):
@@ -454,3 +1316,11 @@ class StimulusModel(object):
         self.dtype = dtype
         self.stim_arr = utils.generate_shared_array(stim_arr, self.dtype)
         self.tr_length = tr_length
+    
+    @auto_attr
+    def fingerprint(self):
+        
+        r"""A hash of the stimulus, used to tell whether a cached model is stale."""
+        
+        settings = np.array([self.tr_length, getattr(self, 'scale_factor', 1.0)], dtype='double')
+        return utils.fingerprint(self.stim_arr, settings)
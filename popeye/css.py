@@ -14,7 +14,7 @@ import nibabel
 from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
-from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries_nomask
+from popeye.spinach import generate_og_receptive_field
 
 class CompressiveSpatialSummationModel(PopulationModel):
     
@@ -23,6 +23,9 @@ class CompressiveSpatialSummationModel(PopulationModel):
     
     """
     
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, cached_model_path=None, nuisance=None):
         
         r"""
@@ -47,10 +50,10 @@ class CompressiveSpatialSummationModel(PopulationModel):
         
         """
         
-        PopulationModel.__init__(self, stimulus, hrf_model, cached_model_path, nuisance)
+        PopulationModel.__init__(self, stimulus, hrf_model, cached_model_path=cached_model_path, nuisance=nuisance)
         
     # main method for deriving model time-series
-    def generate_ballpark_prediction(self, x, y, sigma, n):
+    def generate_ballpark_prediction(self, x, y, sigma, n, unscaled=False):
         
         # generate the RF
         rf = generate_og_receptive_field(x, y, sigma,self.stimulus.deg_x0, self.stimulus.deg_y0)
@@ -58,21 +61,26 @@ class CompressiveSpatialSummationModel(PopulationModel):
         # normalize by the integral
         rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
         
-        # extract the stimulus time-series
-        response = generate_rf_timeseries_nomask(self.stimulus.stim_arr0, rf)
-        
-        # compression
-        response **= n
-        
-        # convolve with the HRF
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
-        
-        # convolve it with the stimulus
-        model = fftconvolve(response, hrf)[0:len(response)]
+        # without compression the model is linear in the stimulus
+        if n == 1 and self.hrf_basis:
+            model = self.hrf_response(rf, downsampled=True)
+        else:
+            
+            # extract the stimulus time-series
+            response = self.stimulus.project(rf, downsampled=True)
+            
+            # compression
+            response **= n
+            
+            # convolve it with the HRF
+            model = utils.convolve_hrf(response, self.hrf())
         
         # units
         model = (model - np.mean(model)) / np.mean(model)
         
+        if unscaled:
+            return model
+        
         # regress out mean and linear
         p = linregress(model, self.data)
         
@@ -87,23 +95,36 @@ class CompressiveSpatialSummationModel(PopulationModel):
     # main method for deriving model time-series
     def generate_prediction(self, x, y, sigma, n, beta, baseline, unscaled=False):
         
-        # generate the RF
-        rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
-        
-        # normalize by the integral
-        rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
-        
-        # extract the stimulus time-series
-        response = generate_rf_timeseries_nomask(self.stimulus.stim_arr, rf)
-        
-        # compression
-        response **= n
-        
-        # convolve with the HRF
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
+        # the RF as two profiles, see `spatial_response`
+        if self.separable:
+            
+            # without compression the model is linear in the stimulus
+            if n == 1:
+                model = self.spatial_response(x, y, sigma, self.hrf())
+            else:
+                model = utils.convolve_hrf(self.spatial_response(x, y, sigma)**n, self.hrf())
         
-        # convolve it with the stimulus
-        model = fftconvolve(response, hrf)[0:len(response)]
+        else:
+            
+            # generate the RF
+            rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
+            
+            # normalize by the integral
+            rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
+            
+            # without compression the model is linear in the stimulus
+            if n == 1 and self.hrf_basis:
+                model = self.hrf_response(rf)
+            else:
+                
+                # extract the stimulus time-series
+                response = self.stimulus.project(rf)
+                
+                # compression
+                response **= n
+                
+                # convolve it with the HRF
+                model = utils.convolve_hrf(response, self.hrf())
         
         # convert units
         model = (model - np.mean(model)) / np.mean(model)
@@ -119,6 +140,82 @@ class CompressiveSpatialSummationModel(PopulationModel):
             model *= beta
             
             return model
+    
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""Predict many CSS models at once, see `generate_predictions`."""
+        
+        x, y, sigma, n, beta, baseline = parameters.T
+        
+        # the stack of RFs, over the whole display
+        rfs = self.gaussian_receptive_fields(x, y, sigma, support=np.inf)
+        
+        # extract the stimulus time-series
+        responses = self.stimulus.project(rfs)
+        
+        # compression
+        responses **= n[:,np.newaxis]
+        
+        # convolve them with the HRF
+        models = utils.convolve_hrf(responses, self.hrf())
+        
+        # convert units
+        return self.scale_predictions(models, beta, baseline, unscaled,
+                                      lambda m: (m - np.mean(m)) / np.mean(m))
+    
+    def generate_prediction_jacobian(self, x, y, sigma, n, beta, baseline):
+        
+        r"""The prediction of `generate_prediction` and its analytic Jacobian."""
+        
+        # generate the RF
+        rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
+        rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
+        dx = self.stimulus.deg_x - x
+        dy = self.stimulus.deg_y - y
+        
+        # the response and the response to the derivatives of the RF
+        rfs = np.array([rf,
+                        rf * dx / sigma**2,
+                        rf * dy / sigma**2,
+                        rf * ((dx**2 + dy**2) / sigma**3 - 2 / sigma)])
+        responses = self.stimulus.project(rfs)
+        response = responses[0]
+        
+        # compression, by the chain rule
+        compressed = response**n
+        slope = n * response**(n-1)
+        derivatives = [slope * r for r in responses[1:]]
+        derivatives.append(compressed * np.log(np.where(response > 0, response, 1)))
+        
+        # convolve them with the HRF
+        hrf = self.hrf()
+        model = utils.convolve_hrf(compressed, hrf)
+        derivatives = [utils.convolve_hrf(d, hrf) for d in derivatives]
+        
+        return self.scale_jacobian(model, derivatives, beta, baseline,
+                                   lambda m: (m - np.mean(m)) / np.mean(m))
+    
+    def ballpark_prediction_block(self, responses, parameters):
+        
+        r"""
+        The unscaled ballpark predictions of a grid, from the spatial response
+        at each grid point. Points that share an (x, y, sigma) share their
+        spatial response, which is raised to each of their exponents, see
+        `generate_fanned_grid` and `generate_scale_space_grid`.
+        
+        """
+        
+        x, y, sigma, n = parameters.T
+        
+        # compression
+        responses = responses**n[:,np.newaxis]
+        
+        # convolve them with the HRF
+        models = utils.convolve_hrf(responses, self.hrf())
+        
+        # convert units
+        return self.scale_predictions(models, None, None, unscaled=True,
+                                      normalizer=lambda m: (m - np.mean(m)) / np.mean(m))
         
 class CompressiveSpatialSummationFit(PopulationFit):
     
@@ -14,6 +14,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries_nomask
+from popeye.profiling import PROFILE
 
 class CompressiveSpatialSummationModel(PopulationModel):
     
@@ -59,16 +60,17 @@ class CompressiveSpatialSummationModel(PopulationModel):
         rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
         
         # extract the stimulus time-series
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_nomask(self.stimulus.stim_arr0, rf)
         
         # compression
         response **= self.n()
         
         # convolve with the HRF
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
+        hrf = self.hrf()
         
         # convolve it with the stimulus
-        model = fftconvolve(response, hrf)[0:len(response)]
+        model = utils.convolve_hrf(response, hrf)
         
         # convert units
         model = (model - np.mean(model)) / np.mean(model)
@@ -88,16 +90,17 @@ class CompressiveSpatialSummationModel(PopulationModel):
         rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
         
         # extract the stimulus time-series
+        PROFILE.count('kernel')
         response = generate_rf_timeseries_nomask(self.stimulus.stim_arr, rf)
         
         # compression
         response **= self.n()
         
         # convolve with the HRF
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
+        hrf = self.hrf()
         
         # convolve it with the stimulus
-        model = fftconvolve(response, hrf)[0:len(response)]
+        model = utils.convolve_hrf(response, hrf)
         
         # convert units
         model = (model - np.mean(model)) / np.mean(model)
@@ -18,7 +18,7 @@ import numexpr as ne
 from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
-from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries
+from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries, generate_og_sparse_receptive_field
 
 class DifferenceOfGaussiansModel(PopulationModel):
     
@@ -27,6 +27,12 @@ class DifferenceOfGaussiansModel(PopulationModel):
     
     """
     
+    # solve the volume ratio of the ballpark in closed form, see `linear_grid_search`
+    linear_grid = False
+    
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change, cached_model_path=None, nuisance=None):
         
         r"""
@@ -51,34 +57,32 @@ class DifferenceOfGaussiansModel(PopulationModel):
         using fMRI. Journal of Vision 12(3):10,1-15.
         
         """
-        PopulationModel.__init__(self, stimulus, hrf_model, normalizer)
+        PopulationModel.__init__(self, stimulus, hrf_model, normalizer, cached_model_path, nuisance)
         
         
-    def generate_ballpark_prediction(self, x, y, sigma, sigma_ratio, volume_ratio):
+    def generate_ballpark_prediction(self, x, y, sigma, sigma_ratio, volume_ratio, unscaled=False):
         
         # extract the center response
         rf_center = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x0, self.stimulus.deg_y0)
         
         # extract surround response
         rf_surround = generate_og_receptive_field(x, y, sigma*sigma_ratio, 
-                                                  self.stimulus.deg_x0, self.stimulus.deg_x0) * 1/sigma_ratio**2
+                                                  self.stimulus.deg_x0, self.stimulus.deg_y0) * 1/sigma_ratio**2
         
         # difference
         rf = ne.evaluate('rf_center - sqrt(volume_ratio)*rf_surround')
         
-        # extract the response
-        mask = self.distance_mask(x, y, sigma*sigma_ratio)
-        response = generate_rf_timeseries(self.stimulus.stim_arr0, rf, mask)
-        
-        # generate the hrf
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
-        
-        # convolve it
-        model = fftconvolve(response, hrf)[0:len(response)]
+        # extract the response and convolve it with the HRF, masked on the downsampled
+        # display the ballpark is evaluated on rather than on the full-size one
+        mask = self.distance_mask_coarse(x, y, sigma*sigma_ratio)
+        model = self.hrf_response(rf * mask, downsampled=True)
         
         # units
         model = self.normalizer(model)
         
+        if unscaled:
+            return model
+        
         # regress out mean and linear
         beta, baseline = self.regress(model, self.data)
         
@@ -92,25 +96,21 @@ class DifferenceOfGaussiansModel(PopulationModel):
         
     def generate_prediction(self, x, y, sigma, sigma_ratio, volume_ratio, beta, baseline, unscaled=False):
         
-        # extract the center response
-        rf_center = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
+        # the pixels covered by the wider of the two gaussians
+        pixels = generate_og_sparse_receptive_field(x, y, max(sigma, sigma*sigma_ratio),
+                                                    self.stimulus.deg_x, self.stimulus.deg_y,
+                                                    self.rf_support())[0]
+        d = (self.stimulus.deg_x.ravel()[pixels]-x)**2 + (self.stimulus.deg_y.ravel()[pixels]-y)**2
         
-        # extract surround response
-        rf_surround = generate_og_receptive_field(x, y, sigma*sigma_ratio, 
-                                                  self.stimulus.deg_x, self.stimulus.deg_y) * 1/sigma_ratio**2
+        # extract the center and surround
+        rf_center = np.exp(-d/(2*sigma**2))
+        rf_surround = np.exp(-d/(2*(sigma*sigma_ratio)**2)) * 1/sigma_ratio**2
         
         # difference
         rf = ne.evaluate('rf_center - sqrt(volume_ratio)*rf_surround')
         
-        # extract the response
-        mask = self.distance_mask(x, y, sigma*sigma_ratio)
-        response = generate_rf_timeseries(self.stimulus.stim_arr, rf, mask)
-        
-        # generate the hrf
-        hrf = self.hrf_model(self.hrf_delay, self.stimulus.tr_length)
-        
-        # convolve it
-        model = fftconvolve(response, hrf)[0:len(response)]
+        # extract the response and convolve it with the HRF
+        model = self.hrf_response(rf, pixels)
         
         # units
         model = self.normalizer(model)
@@ -127,6 +127,215 @@ class DifferenceOfGaussiansModel(PopulationModel):
             
             return model
             
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""Predict many difference of Gaussians models at once, see `generate_predictions`."""
+        
+        x, y, sigma, sigma_ratio, volume_ratio, beta, baseline = parameters.T
+        sigma_surround = (sigma*sigma_ratio)[:,np.newaxis,np.newaxis]
+        volume_ratio = volume_ratio[:,np.newaxis,np.newaxis]
+        sigma_ratio = sigma_ratio[:,np.newaxis,np.newaxis]
+        
+        # the pixels covered by the wider of the two gaussians
+        d = self.pixel_distances(x, y)
+        support = self.rf_support() * np.maximum(sigma[:,np.newaxis,np.newaxis], sigma_surround)
+        
+        # extract the center and surround
+        rf_center = np.exp(-d/(2*sigma[:,np.newaxis,np.newaxis]**2))
+        rf_surround = np.exp(-d/(2*sigma_surround**2)) * 1/sigma_ratio**2
+        
+        # difference
+        rfs = ne.evaluate('rf_center - sqrt(volume_ratio)*rf_surround')
+        rfs[d > support**2] = 0
+        
+        # extract the responses and convolve them with the HRF
+        models = self.hrf_responses(rfs)
+        
+        return self.scale_predictions(models, beta, baseline, unscaled)
+    
+    def generate_prediction_jacobian(self, x, y, sigma, sigma_ratio, volume_ratio, beta, baseline):
+        
+        r"""The prediction of `generate_prediction` and its analytic Jacobian."""
+        
+        # the pixels covered by the wider of the two gaussians
+        pixels = generate_og_sparse_receptive_field(x, y, max(sigma, sigma*sigma_ratio),
+                                                    self.stimulus.deg_x, self.stimulus.deg_y,
+                                                    self.rf_support())[0]
+        dx = self.stimulus.deg_x.ravel()[pixels]-x
+        dy = self.stimulus.deg_y.ravel()[pixels]-y
+        d = dx**2 + dy**2
+        
+        # the center and surround
+        sigma_surround = sigma*sigma_ratio
+        rf_center = np.exp(-d/(2*sigma**2))
+        rf_surround = np.exp(-d/(2*sigma_surround**2)) * 1/sigma_ratio**2
+        amp = np.sqrt(volume_ratio)
+        
+        # the difference and its derivatives
+        rfs = [rf_center - amp*rf_surround,
+               rf_center*dx/sigma**2 - amp*rf_surround*dx/sigma_surround**2,
+               rf_center*dy/sigma**2 - amp*rf_surround*dy/sigma_surround**2,
+               rf_center*d/sigma**3 - amp*rf_surround*d/(sigma*sigma_surround**2),
+               -amp*rf_surround*(d/(sigma**2*sigma_ratio**3) - 2/sigma_ratio),
+               -rf_surround/(2*amp)]
+        
+        # extract each response and convolve it with the HRF
+        models = [self.hrf_response(rf, pixels) for rf in rfs]
+        
+        return self.scale_jacobian(models[0], models[1:], beta, baseline)
+    
+    def gaussian_bank(self, grids, Ns=None, chunk_size=256):
+        
+        r"""
+        The Gaussian responses the ballpark of a difference of Gaussians grid
+        is made of.
+        
+        The center of the ballpark receptive field is the Gaussian of width
+        `sigma`, and the surround that of width `sigma*sigma_ratio` divided by
+        `sigma_ratio**2`. Both are therefore the same multiple of the
+        normalized Gaussian of `PopulationModel.gaussian_receptive_fields`,
+        and the normalizer absorbs that multiple. The bank holds the
+        HRF-convolved response of the downsampled stimulus through every
+        normalized Gaussian the first four dimensions of `grids` call for,
+        within the mask of `distance_mask_coarse` when `mask_size` is set.
+        It is computed once per grid and kept, along with the cross-products
+        of each grid point's center and surround, which do not depend on the
+        data.
+        
+        Returns
+        -------
+        
+        bank : ndarray
+            The demeaned response of each Gaussian, one per row.
+        
+        parameters : ndarray
+            The `x`, `y`, `sigma` and `sigma_ratio` of each grid point.
+        
+        center, surround : ndarray
+            The row of `bank` of the center and the surround of each grid point.
+        
+        products : ndarray
+            The center-center, surround-surround and center-surround products
+            of each grid point.
+        
+        """
+        
+        if not hasattr(self, 'gaussian_banks'):
+            self.gaussian_banks = {}
+        
+        key = repr((utils.grid_spec(grids, Ns), getattr(self, 'mask_size', None)))
+        if key not in self.gaussian_banks:
+            
+            # the grid, without the volume ratio
+            parameters = utils.grid_parameters(grids[0:4], Ns)
+            x, y, sigma, sigma_ratio = parameters.T
+            
+            # the ballpark cuts both off at the `mask_size` of the surround, if it is set
+            if hasattr(self, 'mask_size'):
+                reach = sigma*sigma_ratio
+            else:
+                reach = np.zeros_like(sigma)
+            
+            # the centers and surrounds share their gaussians
+            gaussians = np.vstack((np.array([x, y, sigma, reach]).T, np.array([x, y, sigma*sigma_ratio, reach]).T))
+            gaussians, inverse = utils.unique_rows(gaussians)
+            
+            # a chunk of them at a time, over the whole display or its mask like the ballpark
+            bank = np.zeros((gaussians.shape[0], self.stimulus.run_length))
+            for start in range(0, gaussians.shape[0], chunk_size):
+                gx, gy, width, reach = gaussians[start:start+chunk_size].T
+                rfs = self.gaussian_receptive_fields(gx, gy, width, support=np.inf, downsampled=True)
+                if hasattr(self, 'mask_size'):
+                    rfs[self.pixel_distances(gx, gy, True) >= self.mask_size*reach[:,np.newaxis,np.newaxis]**2] = 0
+                bank[start:start+chunk_size] = self.hrf_responses(rfs, downsampled=True)
+            
+            # demeaned, and crossed
+            bank -= np.mean(bank, -1)[:,np.newaxis]
+            center, surround = inverse[0:len(parameters)], inverse[len(parameters):]
+            products = np.array([np.sum(bank[center]**2, -1),
+                                 np.sum(bank[surround]**2, -1),
+                                 np.sum(bank[center]*bank[surround], -1)])
+            
+            self.gaussian_banks[key] = (bank, parameters, center, surround, products)
+        
+        return self.gaussian_banks[key]
+    
+    def linear_grid_search(self, data, grids, Ns=None, bounds=None):
+        
+        r"""
+        The best point of the ballpark grid, with the volume ratio solved in
+        closed form.
+        
+        Before the normalizer, the ballpark is the center response less
+        `sqrt(volume_ratio)` times the surround response, see `gaussian_bank`.
+        The normalizer only rescales and offsets it, so the best fit of each
+        (x, y, sigma, sigma_ratio) to `data` is a least-squares fit of the
+        center and surround responses, with two regressors and an intercept.
+        The volume ratio is held to the range of the last dimension of
+        `grids`, which is otherwise not sampled.
+        
+        Grid points outside `bounds`, if given, are not considered, just as
+        `popeye.utilities.error_function` rejects them in the brute-force
+        search, and the volume ratio is held within its bound as well.
+        
+        Returns
+        -------
+        
+        estimate : ndarray
+            The `x`, `y`, `sigma`, `sigma_ratio` and `volume_ratio` of the best
+            grid point.
+        
+        rss : float
+            Its residual sum of squares.
+        
+        """
+        
+        bank, parameters, center, surround, products = self.gaussian_bank(grids, Ns)
+        
+        # the range of the amplitude of the surround
+        volume_ratio = utils.grid_parameters(grids[4:5], Ns)[:,0]
+        vr_min, vr_max = np.min(volume_ratio), np.max(volume_ratio)
+        if bounds is not None:
+            if bounds[4][0]:
+                vr_min = max(vr_min, bounds[4][0])
+            if bounds[4][1]:
+                vr_max = min(vr_max, bounds[4][1])
+        amp_min, amp_max = np.sqrt(vr_min), np.sqrt(vr_max)
+        
+        # the cross-products with the demeaned data
+        d = data - np.mean(data)
+        dd = np.dot(d, d)
+        rd = np.dot(bank, d)
+        cc, ss, cs = products
+        cd, sd = rd[center], rd[surround]
+        
+        # the unconstrained fit, center*w1 + surround*w2, up to their determinant
+        w1 = ss*cd - cs*sd
+        w2 = cc*sd - cs*cd
+        amp = -w2 / np.where(w1 != 0, w1, np.inf)
+        
+        # the best amplitude within range is the unconstrained one or a limit of it
+        rss = np.zeros((len(parameters), 3))
+        amps = np.array([np.clip(amp, amp_min, amp_max),
+                         np.repeat(amp_min, len(amp)),
+                         np.repeat(amp_max, len(amp))]).T
+        for i in range(3):
+            mm = cc - 2*amps[:,i]*cs + amps[:,i]**2*ss
+            md = cd - amps[:,i]*sd
+            rss[:,i] = dd - md**2 / np.where(mm > 0, mm, np.inf)
+            if hasattr(self, 'bounded_amplitude') and self.bounded_amplitude:
+                rss[md <= 0, i] = dd
+        
+        # the points that error_function would reject
+        if bounds is not None:
+            rss[~utils.within_bounds(parameters, bounds[0:4])] = np.inf
+        
+        # the best grid point
+        best = np.argmin(rss.ravel())
+        idx, i = np.unravel_index(best, rss.shape)
+        
+        return np.append(parameters[idx], amps[idx,i]**2), rss[idx,i]
+    
     # DoG receptive field
     def receptive_field(self, x, y, sigma, sigma_ratio, volume_ratio):
             rf_center = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
@@ -211,6 +420,14 @@ class DifferenceOfGaussiansFit(PopulationFit):
     def overloaded_estimate(self):
        return [self.theta, self.rho, self.sigma, self.sigma_ratio, self.volume_ratio, self.beta, self.baseline] 
     
+    @auto_attr
+    def grid_estimate(self):
+        
+        if self.model.linear_grid:
+            return self.model.linear_grid_search(self.data, self.grids, self.Ns, self.bounds)[0]
+        
+        return PopulationFit.grid_estimate(self)
+    
     @auto_attr
     def x0(self):
         return self.ballpark[0]
@@ -13,7 +13,7 @@ import nibabel
 from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
-from popeye.spinach import generate_gabor_receptive_field, generate_rf_timeseries
+from popeye.spinach import generate_gabor_receptive_field
 
 class GaborModel(PopulationModel):
     
@@ -22,6 +22,9 @@ class GaborModel(PopulationModel):
     
     """
     
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model):
         
         # this is a weird notation
@@ -45,10 +48,10 @@ class GaborModel(PopulationModel):
                                             self.stimulus.deg_y0)
         
         # extract the stimulus time-series
-        response = generate_rf_timeseries(self.stimulus.stim_arr0, rf, mask)
+        response = self.stimulus.project(rf * mask, downsampled=True)
         
         # convolve with the HRF
-        hrf = self.hrf_model(0, self.stimulus.tr_length)
+        hrf = utils.hrf_kernel(self.hrf_model, 0, self.stimulus.tr_length)
         
         # convolve it with the stimulus
         model = fftconvolve(response, hrf, 'same')
@@ -56,31 +59,50 @@ class GaborModel(PopulationModel):
         return model
     
     
-    def generate_prediction(self, x, y, sigma, theta, phi, cpd):
+    def generate_receptive_field(self, x, y, sigma, theta, phi, cpd):
         
         # make sure theta and phi are 0-2*pi
         theta = np.mod(theta, 2*np.pi)
         phi = np.mod(theta, 2*np.pi)
         
-        # create mask for speed
-        distance = (self.stimulus.deg_x - x)**2 + (self.stimulus.deg_y - y)**2
-        mask = np.zeros_like(distance, dtype='uint8')
-        mask[distance < (5*sigma)**2] = 1
-        
         # generate the RF
         rf = generate_gabor_receptive_field(x, y, sigma, theta, phi, cpd,
                                             self.stimulus.deg_x, self.stimulus.deg_y)
         
+        # limit it to 5 sigmas
+        distance = (self.stimulus.deg_x - x)**2 + (self.stimulus.deg_y - y)**2
+        rf[distance >= (5*sigma)**2] = 0
+        
+        return rf
+    
+    def generate_prediction(self, x, y, sigma, theta, phi, cpd):
+        
+        # generate the RF
+        rf = self.generate_receptive_field(x, y, sigma, theta, phi, cpd)
+        
         # extract the stimulus time-series
-        response = generate_rf_timeseries(self.stimulus.stim_arr, rf, mask)
+        response = self.stimulus.project(rf)
         
         # convolve with the HRF
-        hrf = self.hrf_model(0, self.stimulus.tr_length)
+        hrf = utils.hrf_kernel(self.hrf_model, 0, self.stimulus.tr_length)
         
         # convolve it with the stimulus
         model = fftconvolve(response, hrf, 'same')
         
         return model
+    
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        # the Gabor is never scaled, so `unscaled` has no effect
+        rfs = np.array([self.generate_receptive_field(*p) for p in parameters])
+        
+        # extract the stimulus time-series with one matrix product
+        responses = self.stimulus.project(rfs)
+        
+        # convolve with the HRF
+        hrf = utils.hrf_kernel(self.hrf_model, 0, self.stimulus.tr_length)
+        
+        return fftconvolve(responses, hrf[np.newaxis], 'same', axes=-1)
             
 class GaborFit(PopulationFit):
     
@@ -18,6 +18,9 @@ from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries
 
 class GaussianModel(PopulationModel):
     
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change, cached_model_path=None, nuisance=None):
         
         r"""A 2D Gaussian population receptive field model [1]_.
@@ -42,10 +45,10 @@ class GaussianModel(PopulationModel):
         
         """
         
-        PopulationModel.__init__(self, stimulus, hrf_model, normalizer)
+        PopulationModel.__init__(self, stimulus, hrf_model, normalizer, cached_model_path, nuisance)
         
     # main method for deriving model time-series
-    def generate_ballpark_prediction(self, x, y, sigma):
+    def generate_ballpark_prediction(self, x, y, sigma, unscaled=False):
         
         r"""
         Predict signal for the Gaussian Model using the downsampled stimulus.
@@ -71,15 +74,15 @@ class GaussianModel(PopulationModel):
         rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x0, self.stimulus.deg_y0)
         rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2
                 
-        # extract the stimulus time-series
-        response = generate_rf_timeseries(self.stimulus.stim_arr0, rf, mask)
-        
-        # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf())[0:len(response)]
+        # extract the stimulus time-series and convolve it with the HRF
+        model = self.hrf_response(rf * mask, downsampled=True)
         
         # units
         model = self.normalizer(model)
         
+        if unscaled:
+            return model
+        
         # regress out mean and amplitude
         beta, baseline = self.regress(model, self.data)
         
@@ -116,18 +119,8 @@ class GaussianModel(PopulationModel):
         
         """
         
-        # mask for speed
-        mask = self.distance_mask(x, y, sigma)
-        
-        # generate the RF
-        rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
-        rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2
-        
-        # extract the stimulus time-series
-        response = generate_rf_timeseries(self.stimulus.stim_arr, rf, mask)
-        
-        # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf())[0:len(response)]
+        # extract the stimulus time-series through the RF and convolve it with the HRF
+        model = self.spatial_response(x, y, sigma, self.hrf())
         
         # units
         model = self.normalizer(model)
@@ -144,6 +137,90 @@ class GaussianModel(PopulationModel):
             
             return model
     
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""
+        Predict signal for many Gaussian Models at once, see `generate_predictions`.
+        
+        Parameters
+        __________
+        parameters : ndarray
+            A (num_predictions x 5) array of `x`, `y`, `sigma`, `beta` and `baseline`.
+        
+        """
+        
+        x, y, sigma, beta, baseline = parameters.T
+        
+        # the stack of RFs
+        rfs = self.gaussian_receptive_fields(x, y, sigma)
+        
+        # extract the stimulus time-series and convolve them with the HRF
+        models = self.hrf_responses(rfs)
+        
+        return self.scale_predictions(models, beta, baseline, unscaled)
+    
+    def ballpark_prediction_block(self, responses, parameters):
+        
+        r"""
+        The unscaled ballpark predictions of a grid, from the spatial response
+        at each grid point, see `generate_scale_space_grid`.
+        
+        Parameters
+        __________
+        responses : ndarray
+            The response of the downsampled stimulus at each grid point.
+        
+        parameters : ndarray
+            A (num_predictions x 3) array of `x`, `y` and `sigma`.
+        
+        """
+        
+        # convolve them with the HRF
+        models = utils.convolve_hrf(responses, self.hrf())
+        
+        # units
+        return self.scale_predictions(models, None, None, unscaled=True)
+    
+    def generate_prediction_jacobian(self, x, y, sigma, beta, baseline):
+        
+        r"""
+        Predict signal for the Gaussian Model, along with its derivatives.
+        
+        The derivative of the Gaussian with respect to `x`, `y` and `sigma`
+        is the Gaussian times a closed-form weight, so each column of the
+        Jacobian is one more weighted sum of the stimulus.
+        
+        Parameters
+        __________
+        x, y, sigma, beta, baseline : float
+            As in `generate_prediction`.
+        
+        Returns
+        _______
+        prediction : ndarray
+            The prediction, as returned by `generate_prediction`.
+        
+        jacobian : ndarray
+            The derivative of the prediction with respect to each parameter.
+        
+        """
+        
+        # the RF and its distance from the center
+        pixels, weights = self.sparse_receptive_field(x, y, sigma)
+        dx = self.stimulus.deg_x.ravel()[pixels] - x
+        dy = self.stimulus.deg_y.ravel()[pixels] - y
+        
+        # its derivatives
+        rfs = [weights,
+               weights * dx / sigma**2,
+               weights * dy / sigma**2,
+               weights * ((dx**2 + dy**2) / sigma**3 - 2 / sigma)]
+        
+        # extract each stimulus time-series and convolve it with the HRF
+        models = [self.hrf_response(rf, pixels) for rf in rfs]
+        
+        return self.scale_jacobian(models[0], models[1:], beta, baseline)
+    
     def generate_receptive_field(self, x, y, sigma):
         
         r"""
@@ -15,9 +15,13 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries
+from popeye.profiling import PROFILE
 
 class GaussianModel(PopulationModel):
     
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change):
         
         r"""A 2D Gaussian population receptive field model [1]_,[2]_.
@@ -80,11 +84,12 @@ class GaussianModel(PopulationModel):
         rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2
                 
         # extract the stimulus time-series
+        PROFILE.count('kernel')
         response = generate_rf_timeseries(self.stimulus.stim_arr0, rf, mask)
         
         # convolve it with the stimulus
-        hrf = self.hrf_model(hrf_delay, self.stimulus.tr_length)
-        model = fftconvolve(response, hrf)[0:len(response)]
+        hrf = self.hrf(hrf_delay)
+        model = utils.convolve_hrf(response, hrf)
         
         # units
         model = self.normalizer(model)
@@ -131,19 +136,12 @@ class GaussianModel(PopulationModel):
         """
         
         
-        # mask for speed
-        mask = self.distance_mask(x, y, sigma)
-        
-        # generate the RF
-        rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
-        rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2
-        
-        # extract the stimulus time-series
-        response = generate_rf_timeseries(self.stimulus.stim_arr, rf, mask)
+        # extract the stimulus time-series through the RF
+        response = self.spatial_response(x, y, sigma)
         
         # convolve it with the stimulus
-        hrf = self.hrf_model(hrf_delay, self.stimulus.tr_length)
-        model = fftconvolve(response, hrf)[0:len(response)]
+        hrf = self.hrf(hrf_delay)
+        model = utils.convolve_hrf(response, hrf)
         
         # units
         model = self.normalizer(model)
@@ -159,6 +157,30 @@ class GaussianModel(PopulationModel):
     
             return model
 
+    def generate_prediction_block(self, parameters, unscaled=False):
+        
+        r"""
+        Predict signal for many Gaussian Models at once, see `generate_predictions`.
+        
+        Parameters
+        __________
+        parameters : ndarray
+            A (num_predictions x 6) array of `x`, `y`, `sigma`, `hrf_delay`,
+            `beta` and `baseline`.
+        
+        """
+        
+        x, y, sigma, hrf_delay, beta, baseline = parameters.T
+        
+        # the stack of RFs
+        rfs = self.gaussian_receptive_fields(x, y, sigma)
+        
+        # each convolved with its own HRF
+        hrfs = [self.hrf(delay) for delay in hrf_delay]
+        models = self.hrf_responses(rfs, hrfs)
+        
+        return self.scale_predictions(models, beta, baseline, unscaled)
+    
     def generate_receptive_field(self, x, y, sigma):
         
         r"""
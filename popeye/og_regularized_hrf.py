@@ -15,6 +15,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_og_receptive_field, generate_rf_timeseries
+from popeye.profiling import PROFILE
 
 class GaussianModel(PopulationModel):
     
@@ -72,10 +73,11 @@ class GaussianModel(PopulationModel):
         rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2
                 
         # extract the stimulus time-series
+        PROFILE.count('kernel')
         response = generate_rf_timeseries(self.stimulus.stim_arr0, rf, mask)
         
         # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf())[0:len(response)]
+        model = utils.convolve_hrf(response, self.hrf())
         
         # units
         model = (model-np.mean(model)) / np.mean(model)
@@ -119,10 +121,11 @@ class GaussianModel(PopulationModel):
         rf /= (2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2
         
         # extract the stimulus time-series
+        PROFILE.count('kernel')
         response = generate_rf_timeseries(self.stimulus.stim_arr, rf, mask)
         
         # convolve it with the stimulus
-        model = fftconvolve(response, self.hrf_delay())[0:len(response)]
+        model = utils.convolve_hrf(response, self.hrf_delay())
         
         # units
         model = (model-np.mean(model)) / np.mean(model)
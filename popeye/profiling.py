@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+""" Timers and counters for finding where the time of a fit goes """
+
+from __future__ import division
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+class Profile(object):
+    
+    r"""Running totals of named counters and timers.
+    
+    There is one per process, `PROFILE`. The stages of
+    `popeye.base.PopulationFit.run` and the hot spots they call into, such
+    as the objective function, the HRF convolution and the projection onto
+    the stimulus, add to it. A fit keeps the difference between the totals
+    before and after it ran as its `profile`, so the numbers are collected
+    per voxel, in whichever worker fit it.
+    
+    Timers are inclusive. The 'finish' timer includes the time of every
+    'convolve' it called, for instance.
+    
+    The stages of a fit are timed with `stage`. Whatever is counted or timed
+    within a stage also goes to its own total under the stage's name, such
+    as 'grid.objective' and 'finish.objective' besides 'objective'.
+    
+    """
+    
+    def __init__(self):
+        
+        self.enabled = True
+        self.counts = {}
+        self.seconds = {}
+        self.stages = []
+    
+    def names(self, name):
+        
+        r"""The totals `name` adds to, its own and that of the current stage."""
+        
+        if self.stages:
+            return [name, self.stages[-1] + '.' + name]
+        return [name]
+    
+    def count(self, name, n=1):
+        
+        r"""Adds `n` to the counter `name`."""
+        
+        if self.enabled:
+            for key in self.names(name):
+                self.counts[key] = self.counts.get(key, 0) + n
+    
+    @contextmanager
+    def timer(self, name):
+        
+        r"""Times the enclosed block, and counts it, under `name`."""
+        
+        if not self.enabled:
+            yield
+            return
+        
+        keys = self.names(name)
+        tic = time.time()
+        try:
+            yield
+        finally:
+            toc = time.time()
+            for key in keys:
+                self.seconds[key] = self.seconds.get(key, 0.0) + toc - tic
+                self.counts[key] = self.counts.get(key, 0) + 1
+    
+    @contextmanager
+    def stage(self, name):
+        
+        r"""Times the enclosed block like `timer`, as the stage `name`.
+        
+        What is counted or timed within it also goes to 'name.' followed by
+        the name of the counter or timer.
+        
+        """
+        
+        with self.timer(name):
+            self.stages.append(name)
+            try:
+                yield
+            finally:
+                self.stages.pop()
+    
+    def snapshot(self):
+        
+        r"""The current totals, to be passed to `since`."""
+        
+        return dict(self.counts), dict(self.seconds)
+    
+    def since(self, snapshot):
+        
+        r"""What was counted and timed since `snapshot` was taken.
+        
+        Returns
+        -------
+        
+        profile : dict
+            The number of calls of each counter, and the seconds of each
+            timer under its name suffixed with '_time'.
+        
+        """
+        
+        counts, seconds = snapshot
+        
+        profile = {}
+        for name, n in self.counts.items():
+            if n != counts.get(name, 0):
+                profile[name] = n - counts.get(name, 0)
+        for name, s in self.seconds.items():
+            if s != seconds.get(name, 0.0):
+                profile[name + '_time'] = s - seconds.get(name, 0.0)
+        
+        return profile
+    
+    def reset(self):
+        
+        self.counts = {}
+        self.seconds = {}
+        self.stages = []
+
+# the profile of this process
+PROFILE = Profile()
+
+def aggregate_profiles(fits):
+    
+    r"""Aggregates the per-voxel `profile` of many fits.
+    
+    Paramaters
+    ----------
+    
+    fits : list
+        `PopulationFit` objects or `PopulationFitResult` records, such as
+        those returned by `popeye.utilities.batch_fit`.
+    
+    Returns
+    -------
+    
+    summary : dict
+        For each counter and timer, a dict of its 'total', 'mean' and 'max'
+        across the voxels and the 'voxel_index' of that max.
+    
+    """
+    
+    fits = [fit for fit in fits if getattr(fit, 'profile', None) is not None]
+    names = sorted(set([name for fit in fits for name in fit.profile]))
+    
+    summary = {}
+    for name in names:
+        values = np.array([fit.profile.get(name, 0) for fit in fits], dtype='double')
+        worst = int(np.argmax(values))
+        summary[name] = {'total': np.sum(values),
+                         'mean': np.mean(values),
+                         'max': values[worst],
+                         'voxel_index': fits[worst].voxel_index}
+    
+    return summary
+
+def summarize_profiles(fits):
+    
+    r"""A table of `aggregate_profiles`, one counter or timer per row."""
+    
+    summary = aggregate_profiles(fits)
+    
+    rows = ['%-28s %14s %14s %14s  %s' %('', 'TOTAL', 'MEAN', 'MAX', 'VOXEL')]
+    for name in sorted(summary):
+        stats = summary[name]
+        rows.append('%-28s %14.4f %14.4f %14.4f  %s'
+                    %(name, stats['total'], stats['mean'], stats['max'], stats['voxel_index']))
+    
+    return '\n'.join(rows)
@@ -19,6 +19,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_2dcos_receptive_field, generate_mp_timeseries, generate_rf_timeseries
+from popeye.profiling import PROFILE
 
 class SpatioTemporalModel(PopulationModel):
     
@@ -27,6 +28,9 @@ class SpatioTemporalModel(PopulationModel):
     
     """
     
+    # `weight` mixes the regressors of `generate_mp_regressors`
+    weight_index = 3
+    
     def __init__(self, stimulus, hrf_model):
         
         """
@@ -79,16 +83,18 @@ class SpatioTemporalModel(PopulationModel):
         mask = np.uint8(spatial_rf>0)
         
         # spatial_response
+        PROFILE.count('kernel')
         spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr0, spatial_rf, mask)
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf())[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf())
         
         # units
         model = (model - np.mean(model)) / np.mean(model)
@@ -144,16 +150,18 @@ class SpatioTemporalModel(PopulationModel):
         mask = np.uint8(spatial_rf>0)
         
         # spatial response
+        PROFILE.count('kernel')
         spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr, spatial_rf, mask)
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts 
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf())[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf())
         
         # units
         model = (model - np.mean(model)) / np.mean(model)
@@ -170,6 +178,57 @@ class SpatioTemporalModel(PopulationModel):
             
             return model
     
+    def generate_mp_regressors(self, x, y, sigma, downsampled=False):
+        
+        r"""
+        The magnocellular and parvocellular responses, each convolved with the
+        HRF. The unscaled prediction is the normalized `(1-weight)*m +
+        weight*p` of the two, so the 'mixture' finisher and `mixture_grid`
+        solve `weight` in closed form, see `popeye.utilities.mixture_weight`.
+        
+        Parameters
+        __________
+        x : float
+            Horizontal location of the 2D cosine RF.
+        
+        y: float 
+            Vertical location of the 2D cosine RF.
+        
+        sigma: float
+            Dipsersion of the 2D cosine RF.
+        
+        downsampled : bool
+            Use the downsampled stimulus, like `generate_ballpark_prediction`.
+        
+        """
+        
+        if downsampled:
+            deg_x, deg_y, stim_arr = self.stimulus.deg_x0, self.stimulus.deg_y0, self.stimulus.stim_arr0
+        else:
+            deg_x, deg_y, stim_arr = self.stimulus.deg_x, self.stimulus.deg_y, self.stimulus.stim_arr
+        
+        # generate the RF
+        spatial_rf = generate_2dcos_receptive_field(x, y, sigma, self.power, deg_x, deg_y)
+        
+        # normalize by volume
+        spatial_rf /= (trapz(trapz(spatial_rf)) * 1/np.diff(deg_x[0,0:2])**2)
+        
+        # make mask
+        mask = np.uint8(spatial_rf>0)
+        
+        # spatial response
+        PROFILE.count('kernel')
+        spatial_ts = generate_rf_timeseries(stim_arr, spatial_rf, mask)
+        
+        # temporal response
+        PROFILE.count('kernel')
+        m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
+        
+        # convolve both with HRF
+        m_model, p_model = utils.convolve_hrf(np.array([m_ts, p_ts]), self.hrf())
+        
+        return m_model, p_model
+    
     @auto_attr
     def p(self):
         
@@ -18,6 +18,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_og_receptive_field, generate_mp_timeseries, generate_rf_timeseries
+from popeye.profiling import PROFILE
 
 # Python 3 compatibility:
 try:
@@ -33,6 +34,12 @@ class SpatioTemporalModel(PopulationModel):
     
     """
     
+    # `weight` mixes the regressors of `generate_mp_regressors`
+    weight_index = 4
+    
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change):
         
         """
@@ -62,19 +69,21 @@ class SpatioTemporalModel(PopulationModel):
         spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
         
         # spatial_response
+        PROFILE.count('kernel')
         spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr0, spatial_rf, mask)
         
         # compression
         spatial_ts **= n
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf())[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf())
         
         # units
         # model = (model - np.mean(model)) / np.mean(model)
@@ -91,30 +100,58 @@ class SpatioTemporalModel(PopulationModel):
         
         return model
         
-    # for the final solution, we use spatiotemporal
-    def generate_prediction(self, x, y, sigma, n, weight, beta, baseline, unscaled=False):
+    def ballpark_prediction_block(self, responses, parameters):
         
-        # mask for speed
-        mask = self.distance_mask(x, y, sigma)
+        r"""
+        The unscaled ballpark predictions of a grid, from the spatial response
+        at each grid point, see `generate_fanned_grid`.
         
-        # generate the RF
-        spatial_rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
-        spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
+        Parameters
+        __________
+        responses : ndarray
+            The response of the downsampled stimulus at each grid point.
+        
+        parameters : ndarray
+            A (num_predictions x 5) array of `x`, `y`, `sigma`, `n` and `weight`.
+        
+        """
+        
+        x, y, sigma, n, weight = parameters.T
+        
+        # compression
+        spatial_ts = responses**n[:,np.newaxis]
+        
+        # temporal responses, mixed
+        mp_ts = np.zeros_like(spatial_ts)
+        for i in range(len(spatial_ts)):
+            PROFILE.count('kernel')
+            m_ts, p_ts = generate_mp_timeseries(spatial_ts[i], self.m_amp, self.p_amp, self.stimulus.flicker_vec)
+            mp_ts[i] = (1-weight[i]) * m_ts + weight[i] * p_ts
+        
+        # convolve with HRF
+        models = utils.convolve_hrf(mp_ts, self.hrf())
+        
+        # units
+        return self.scale_predictions(models, None, None, unscaled=True)
+        
+    # for the final solution, we use spatiotemporal
+    def generate_prediction(self, x, y, sigma, n, weight, beta, baseline, unscaled=False):
         
         # spatial response
-        spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr, spatial_rf, mask)
+        spatial_ts = self.spatial_response(x, y, sigma)
         
         # compression
         spatial_ts **= n
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf())[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf())
         
         # convert units
         model = self.normalizer(model)
@@ -130,6 +167,63 @@ class SpatioTemporalModel(PopulationModel):
             
             return model
 
+    def generate_mp_regressors(self, x, y, sigma, n, downsampled=False):
+        
+        r"""
+        The magnocellular and parvocellular responses, each convolved with the
+        HRF. The unscaled prediction is the normalized `(1-weight)*m +
+        weight*p` of the two, so the 'mixture' finisher and `mixture_grid`
+        solve `weight` in closed form, see `popeye.utilities.mixture_weight`.
+        
+        Parameters
+        __________
+        x : float
+            Horizontal location of the Gaussian RF.
+        
+        y: float 
+            Vertical location of the Gaussian RF.
+        
+        sigma: float
+            Dipsersion of the Gaussian RF.
+        
+        n : float
+            The compressive exponent of the spatial response.
+        
+        downsampled : bool
+            Use the downsampled stimulus, like `generate_ballpark_prediction`.
+        
+        """
+        
+        if downsampled:
+            
+            # mask for speed
+            mask = self.distance_mask_coarse(x, y, sigma)
+            
+            # generate the RF
+            spatial_rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x0, self.stimulus.deg_y0)
+            spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
+            
+            # spatial response
+            PROFILE.count('kernel')
+            spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr0, spatial_rf, mask)
+            
+        else:
+            
+            # spatial response
+            spatial_ts = self.spatial_response(x, y, sigma)
+        
+        # compression
+        spatial_ts = spatial_ts**n
+        
+        # temporal response
+        PROFILE.count('kernel')
+        m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
+        
+        # convolve both with HRF
+        m_model, p_model = utils.convolve_hrf(np.array([m_ts, p_ts]), self.hrf())
+        
+        return m_model, p_model
+    
     @auto_attr
     def p(self):
         p = np.exp(-((self.t-self.center)**2)/(2*self.tau**2))
@@ -19,6 +19,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_og_receptive_field, generate_mp_timeseries, generate_rf_timeseries
+from popeye.profiling import PROFILE
 
 class SpatioTemporalModel(PopulationModel):
     
@@ -27,6 +28,12 @@ class SpatioTemporalModel(PopulationModel):
     
     """
     
+    # `weight` mixes the regressors of `generate_mp_regressors`
+    weight_index = 3
+    
+    # the native stimulus is only ever projected
+    packed_stimulus = True
+    
     def __init__(self, stimulus, hrf_model, normalizer=utils.percent_change):
         
         """
@@ -83,16 +90,18 @@ class SpatioTemporalModel(PopulationModel):
         spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
         
         # spatial_response
+        PROFILE.count('kernel')
         spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr0, spatial_rf, mask)
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf_model(hrf_delay, self.stimulus.tr_length))[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf(hrf_delay))
         
         # units
         model = self.normalizer(model)
@@ -145,24 +154,18 @@ class SpatioTemporalModel(PopulationModel):
         
         """
         
-        # mask for speed
-        mask = self.distance_mask(x, y, sigma)
-        
-        # generate the RF
-        spatial_rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x, self.stimulus.deg_y)
-        spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x[0,0:2])**2)
-        
         # spatial response
-        spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr, spatial_rf, mask)
+        spatial_ts = self.spatial_response(x, y, sigma)
         
         # temporal response
+        PROFILE.count('kernel')
         m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
         
         # mix them
         mp_ts = (1-weight) * m_ts + weight * p_ts 
         
         # convolve with HRF
-        model = fftconvolve(mp_ts, self.hrf_model(hrf_delay, self.stimulus.tr_length))[0:len(mp_ts)]
+        model = utils.convolve_hrf(mp_ts, self.hrf(hrf_delay))
         
         # convert units
         model = self.normalizer(model)
@@ -179,6 +182,61 @@ class SpatioTemporalModel(PopulationModel):
             
             return model
     
+    def generate_mp_regressors(self, x, y, sigma, hrf_delay, downsampled=False):
+        
+        r"""
+        The magnocellular and parvocellular responses, each convolved with the
+        HRF. The unscaled prediction is the normalized `(1-weight)*m +
+        weight*p` of the two, so the 'mixture' finisher and `mixture_grid`
+        solve `weight` in closed form, see `popeye.utilities.mixture_weight`.
+        
+        Parameters
+        __________
+        x : float
+            Horizontal location of the Gaussian RF.
+        
+        y: float 
+            Vertical location of the Gaussian RF.
+        
+        sigma: float
+            Dipsersion of the Gaussian RF.
+        
+        hrf_delay : float
+            The delay of the peak and undershoot of the hemodynamic response
+            function in seconds.
+        
+        downsampled : bool
+            Use the downsampled stimulus, like `generate_ballpark_prediction`.
+        
+        """
+        
+        if downsampled:
+            
+            # mask for speed
+            mask = self.distance_mask_coarse(x, y, sigma)
+            
+            # generate the RF
+            spatial_rf = generate_og_receptive_field(x, y, sigma, self.stimulus.deg_x0, self.stimulus.deg_y0)
+            spatial_rf /= ((2 * np.pi * sigma**2) * 1/np.diff(self.stimulus.deg_x0[0,0:2])**2)
+            
+            # spatial response
+            PROFILE.count('kernel')
+            spatial_ts = generate_rf_timeseries(self.stimulus.stim_arr0, spatial_rf, mask)
+            
+        else:
+            
+            # spatial response
+            spatial_ts = self.spatial_response(x, y, sigma)
+        
+        # temporal response
+        PROFILE.count('kernel')
+        m_ts, p_ts = generate_mp_timeseries(spatial_ts, self.m_amp, self.p_amp, self.stimulus.flicker_vec)
+        
+        # convolve both with HRF
+        m_model, p_model = utils.convolve_hrf(np.array([m_ts, p_ts]), self.hrf(hrf_delay))
+        
+        return m_model, p_model
+    
     @auto_attr
     def p(self):
         
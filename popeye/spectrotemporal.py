@@ -22,6 +22,7 @@ from popeye.onetime import auto_attr
 import popeye.utilities as utils
 from popeye.base import PopulationModel, PopulationFit
 from popeye.spinach import generate_rf_timeseries_1D
+from popeye.profiling import PROFILE
 
 def recast_estimation_results(output, grid_parent, write=True):
     
@@ -88,6 +89,7 @@ def compute_model_ts(center_freq, sigma,
     mask[distance < (5*sigma)] = 1
         
     # extract the response
+    PROFILE.count('kernel')
     stim = generate_rf_timeseries_1D(spectrogram,rf,mask)
     
     # recast the stimulus into a time-series that i can 
@@ -14,6 +14,11 @@ ctypedef np.double_t DTYPE2_t
 DTYPE3 = np.short
 ctypedef short DTYPE3_t
 
+# a binary stimulus, or the float32 averages of an area-resampled one
+ctypedef fused STIM_t:
+    short
+    float
+
 from libc.math cimport sin, cos, exp, sqrt
 
 try:
@@ -22,6 +27,15 @@ except NameError:  # python3
     xrange = range
 
 
+@cython.cdivision(True)
+cdef inline Py_ssize_t time_block(Py_ssize_t tlim, int num_threads) nogil:
+    
+    # each thread owns a contiguous run of timepoints, so that no two
+    # threads ever write to the same output sample
+    if num_threads < 1:
+        num_threads = 1
+    return max(1, (tlim + num_threads - 1) // num_threads)
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def binner(np.ndarray[DTYPE2_t, ndim=1] signal,
@@ -216,69 +230,343 @@ def generate_strf_weight_timeseries(np.ndarray[DTYPE2_t, ndim=1] stim_ts,
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def generate_rf_timeseries_nomask(np.ndarray[DTYPE3_t, ndim=3] stim_arr,
-                                  np.ndarray[DTYPE2_t, ndim=2] rf):
+def generate_rf_timeseries_nomask(const STIM_t[:, :, :] stim_arr,
+                                  const DTYPE2_t[:, :] rf,
+                                  int num_threads=1):
 
     # cdef's
-    cdef int i,j,k
-    cdef int xlim = stim_arr.shape[0]
-    cdef int ylim = stim_arr.shape[1]
-    cdef int zlim = stim_arr.shape[2]
+    cdef Py_ssize_t i,j,k,b,k0,k1
+    cdef Py_ssize_t xlim = stim_arr.shape[0]
+    cdef Py_ssize_t ylim = stim_arr.shape[1]
+    cdef Py_ssize_t zlim = stim_arr.shape[2]
+    cdef Py_ssize_t block = time_block(zlim, num_threads)
+    cdef Py_ssize_t num_blocks = (zlim + block - 1) // block
+    cdef DTYPE2_t w
 
     # initialize output variable
     cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(zlim,dtype=DTYPE2)
+    cdef DTYPE2_t[::1] out = stim
+
+    # the loop, with time innermost since it is the contiguous axis
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, zlim)
+            for i in range(xlim):
+                for j in range(ylim):
+                    w = rf[i,j]
+                    for k in range(k0,k1):
+                        out[k] += stim_arr[i,j,k]*w
 
-    # the loop
-    for i in xrange(xlim):
-        for j in xrange(ylim):
-            for k in xrange(zlim):
-                stim[k] += stim_arr[i,j,k]*rf[i,j]
+    return stim
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def generate_rf_timeseries(const STIM_t[:, :, :] stim_arr,
+                           const DTYPE2_t[:, :] rf,
+                           const DTYPE_t[:, :] mask,
+                           int num_threads=1):
+
+    # cdef's
+    cdef Py_ssize_t i,j,k,b,k0,k1
+    cdef Py_ssize_t xlim = stim_arr.shape[0]
+    cdef Py_ssize_t ylim = stim_arr.shape[1]
+    cdef Py_ssize_t zlim = stim_arr.shape[2]
+    cdef Py_ssize_t block = time_block(zlim, num_threads)
+    cdef Py_ssize_t num_blocks = (zlim + block - 1) // block
+    cdef DTYPE2_t w
+
+    # initialize output variable
+    cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(zlim,dtype=DTYPE2)
+    cdef DTYPE2_t[::1] out = stim
+
+    # the loop, with time innermost since it is the contiguous axis
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, zlim)
+            for i in range(xlim):
+                for j in range(ylim):
+                    if mask[i,j] == 1:
+                        w = rf[i,j]
+                        for k in range(k0,k1):
+                            out[k] += stim_arr[i,j,k]*w
 
     return stim
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def generate_rf_timeseries(np.ndarray[DTYPE3_t, ndim=3] stim_arr,
-                           np.ndarray[DTYPE2_t, ndim=2] rf,
-                           np.ndarray[DTYPE_t, ndim=2] mask):
+def generate_og_sparse_receptive_field(DTYPE2_t x, DTYPE2_t y, DTYPE2_t sigma,
+                                       const DTYPE2_t[:, :] deg_x,
+                                       const DTYPE2_t[:, :] deg_y,
+                                       DTYPE2_t support=5.0):
+    """
+    Generate a Gaussian, limited to the pixels within `support` sigmas.
+
+    Parameters
+    ----------
+    x : float
+       The x coordinate of the center of the Gaussian (degrees)
+    y : float
+       The y coordinate of the center of the Gaussian (degrees)
+    sigma : float
+       The dispersion of the Gaussian (degrees)
+    deg_x : 2D array
+            The coordinate matrix along the horizontal dimension of the display (degrees)
+    deg_y : 2D array
+            The coordinate matrix along the vertical dimension of the display (degrees)
+    support : float
+        The radius of the receptive field, in units of sigma.
+
+    Returns
+
+    pixels : ndarray
+        The flat (C-order) index of each pixel within the support.
+
+    weights : ndarray
+        The value of the Gaussian at each of those pixels.
+
+    """
+
+    # cdef's
+    cdef Py_ssize_t i,j,n
+    cdef Py_ssize_t xlim = deg_x.shape[0]
+    cdef Py_ssize_t ylim = deg_x.shape[1]
+    cdef Py_ssize_t num_pixels = 0
+    cdef DTYPE2_t s_factor2 = (2.0*sigma**2)
+    cdef DTYPE2_t s_distance = (support*sigma)**2
+    cdef DTYPE2_t d
+
+    # count the pixels within the support
+    with nogil:
+        for i in range(xlim):
+            for j in range(ylim):
+                d = (deg_x[i,j]-x)**2 + (deg_y[i,j]-y)**2
+                if d <= s_distance:
+                    num_pixels += 1
+
+    # initialize output variables
+    cdef np.ndarray[np.intp_t, ndim=1, mode='c'] pixels = np.zeros(num_pixels,dtype=np.intp)
+    cdef np.ndarray[DTYPE2_t, ndim=1, mode='c'] weights = np.zeros(num_pixels,dtype=DTYPE2)
+    cdef np.intp_t[::1] pixels_view = pixels
+    cdef DTYPE2_t[::1] weights_view = weights
+
+    # fill them in
+    n = 0
+    with nogil:
+        for i in range(xlim):
+            for j in range(ylim):
+                d = (deg_x[i,j]-x)**2 + (deg_y[i,j]-y)**2
+                if d <= s_distance:
+                    pixels_view[n] = i*ylim + j
+                    weights_view[n] = exp(-d/s_factor2)
+                    n += 1
+
+    return pixels, weights
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def generate_sparse_rf_timeseries(const STIM_t[:, :, :] stim_arr,
+                                  const np.intp_t[:] pixels,
+                                  const DTYPE2_t[:] weights,
+                                  int num_threads=1):
 
     # cdef's
-    cdef int i,j,k
-    cdef int xlim = stim_arr.shape[0]
-    cdef int ylim = stim_arr.shape[1]
-    cdef int zlim = stim_arr.shape[2]
+    cdef Py_ssize_t i,j,k,n,b,k0,k1
+    cdef Py_ssize_t ylim = stim_arr.shape[1]
+    cdef Py_ssize_t zlim = stim_arr.shape[2]
+    cdef Py_ssize_t num_pixels = pixels.shape[0]
+    cdef Py_ssize_t block = time_block(zlim, num_threads)
+    cdef Py_ssize_t num_blocks = (zlim + block - 1) // block
+    cdef DTYPE2_t w
 
     # initialize output variable
     cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(zlim,dtype=DTYPE2)
+    cdef DTYPE2_t[::1] out = stim
+
+    # gather only the covered pixels, with time innermost
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, zlim)
+            for n in range(num_pixels):
+                i = pixels[n] // ylim
+                j = pixels[n] % ylim
+                w = weights[n]
+                for k in range(k0,k1):
+                    out[k] += stim_arr[i,j,k]*w
 
-    # the loop
-    for i in xrange(xlim):
-        for j in xrange(ylim):
-            if mask[i,j] == 1:
-                for k in xrange(zlim):
-                    stim[k] += stim_arr[i,j,k]*rf[i,j]
+    return stim
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def generate_separable_rf_timeseries(const STIM_t[:, :, :] stim_arr,
+                                     const DTYPE2_t[:] row_weights,
+                                     const DTYPE2_t[:] col_weights,
+                                     Py_ssize_t row0,
+                                     Py_ssize_t col0,
+                                     int num_threads=1):
+
+    """
+    Generate the time-series of a separable receptive field.
+
+    The receptive field is the outer product of `row_weights` and
+    `col_weights`, starting at row `row0` and column `col0` of the stimulus.
+    Each row of the stimulus is contracted with `col_weights`, and those
+    row sums with `row_weights`, so the receptive field itself is never
+    formed.
+
+    Parameters
+    ----------
+    stim_arr : 3D array
+        The (rows, columns, time) stimulus.
+    row_weights : 1D array
+        The profile of the receptive field down the rows.
+    col_weights : 1D array
+        The profile of the receptive field across the columns.
+    row0 : int
+        The first row the receptive field covers.
+    col0 : int
+        The first column the receptive field covers.
+    num_threads : int
+        The number of OpenMP threads the timepoints are split across.
+
+    Returns
+    -------
+    stim : 1D array
+        The time-series of the receptive field.
+
+    """
+
+    # cdef's
+    cdef Py_ssize_t i,j,k,b,k0,k1
+    cdef Py_ssize_t num_rows = row_weights.shape[0]
+    cdef Py_ssize_t num_cols = col_weights.shape[0]
+    cdef Py_ssize_t zlim = stim_arr.shape[2]
+    cdef Py_ssize_t block = time_block(zlim, num_threads)
+    cdef Py_ssize_t num_blocks = (zlim + block - 1) // block
+    cdef DTYPE2_t w
+
+    # initialize output variable
+    cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(zlim,dtype=DTYPE2)
+    cdef DTYPE2_t[::1] out = stim
+
+    # the sum along each row, blocks of timepoints apart
+    cdef DTYPE2_t[::1] row_sum = np.zeros(zlim,dtype=DTYPE2)
+
+    # contract the columns, then the rows, with time innermost
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, zlim)
+            for i in range(num_rows):
+                for k in range(k0,k1):
+                    row_sum[k] = 0
+                for j in range(num_cols):
+                    w = col_weights[j]
+                    for k in range(k0,k1):
+                        row_sum[k] += stim_arr[row0+i,col0+j,k]*w
+                w = row_weights[i]
+                for k in range(k0,k1):
+                    out[k] += row_sum[k]*w
 
     return stim
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def generate_rf_timeseries_1D(np.ndarray[DTYPE2_t, ndim=2] stim_arr,
-                              np.ndarray[DTYPE2_t, ndim=1] rf,
-                              np.ndarray[DTYPE_t, ndim=1] mask):
+@cython.cdivision(True)
+def generate_packed_rf_timeseries(const DTYPE_t[:, :] stim_bits,
+                                  const np.intp_t[:] pixels,
+                                  const DTYPE2_t[:] weights,
+                                  Py_ssize_t tlim,
+                                  int num_threads=1):
+
+    """
+    Generate the time-series of a sparse receptive field from a bit-packed
+    binary stimulus.
+
+    Parameters
+    ----------
+    stim_bits : 2D array
+        The (pixels, time) binary stimulus, packed 8 timepoints to a byte along
+        time with `numpy.packbits`.
+    pixels : 1D array
+        The row of `stim_bits` of each pixel of the receptive field.
+    weights : 1D array
+        The receptive field at each of those pixels.
+    tlim : int
+        The number of timepoints in the stimulus.
+    num_threads : int
+        The number of OpenMP threads the timepoints are split across.
+
+    Returns
+
+    stim : ndarray
+        The 1D array containing the stimulus energies given the receptive field
+
+    """
 
     # cdef's
-    cdef int i,j,k
-    cdef int xlim = stim_arr.shape[0]
-    cdef int ylim = stim_arr.shape[1]
+    cdef Py_ssize_t n,p,k,bit,b,k0,k1
+    cdef Py_ssize_t num_pixels = pixels.shape[0]
+    cdef Py_ssize_t num_bytes = stim_bits.shape[1]
+    cdef Py_ssize_t block = time_block(num_bytes, num_threads)
+    cdef Py_ssize_t num_blocks = (num_bytes + block - 1) // block
+    cdef DTYPE_t byte
+    cdef DTYPE2_t w
+
+    # initialize output variable, padded out to whole bytes
+    cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(num_bytes*8,dtype=DTYPE2)
+    cdef DTYPE2_t[::1] out = stim
+
+    # each thread owns a run of bytes, and so of timepoints
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, num_bytes)
+            for n in range(num_pixels):
+                p = pixels[n]
+                w = weights[n]
+                for k in range(k0,k1):
+                    byte = stim_bits[p,k]
+                    if byte != 0:
+                        for bit in range(8):
+                            if byte & (128 >> bit):
+                                out[k*8+bit] += w
+
+    return stim[0:tlim]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def generate_rf_timeseries_1D(const DTYPE2_t[:, :] stim_arr,
+                              const DTYPE2_t[:] rf,
+                              const DTYPE_t[:] mask,
+                              int num_threads=1):
+
+    # cdef's
+    cdef Py_ssize_t i,j,b,j0,j1
+    cdef Py_ssize_t xlim = stim_arr.shape[0]
+    cdef Py_ssize_t ylim = stim_arr.shape[1]
+    cdef Py_ssize_t block = time_block(ylim, num_threads)
+    cdef Py_ssize_t num_blocks = (ylim + block - 1) // block
+    cdef DTYPE2_t w
 
     # initialize output variable
     cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(ylim,dtype=DTYPE2)
-
-    # the loop
-    for i in xrange(xlim):
-        if mask[i] == 1:
-            for j in xrange(ylim):
-                stim[j] += stim_arr[i,j]*rf[i]
+    cdef DTYPE2_t[::1] out = stim
+
+    # the loop, with time innermost since it is the contiguous axis
+    with nogil:
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            j0 = b*block
+            j1 = min(j0+block, ylim)
+            for i in range(xlim):
+                if mask[i] == 1:
+                    w = rf[i]
+                    for j in range(j0,j1):
+                        out[j] += stim_arr[i,j]*w
 
     return stim
 
@@ -381,10 +669,11 @@ def generate_dog_timeseries(np.ndarray[DTYPE2_t, ndim=2] deg_x,
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def generate_og_timeseries(np.ndarray[DTYPE2_t, ndim=2] deg_x,
-                           np.ndarray[DTYPE2_t, ndim=2] deg_y,
-                           np.ndarray[DTYPE_t, ndim=3] stim_arr,
-                           DTYPE2_t x, DTYPE2_t y, DTYPE2_t s):
+def generate_og_timeseries(const DTYPE2_t[:, :] deg_x,
+                           const DTYPE2_t[:, :] deg_y,
+                           const DTYPE_t[:, :, :] stim_arr,
+                           DTYPE2_t x, DTYPE2_t y, DTYPE2_t s,
+                           int num_threads=1):
 
     """
     Generate a time-series given a stimulus array and Gaussian parameters.
@@ -401,8 +690,8 @@ def generate_og_timeseries(np.ndarray[DTYPE2_t, ndim=2] deg_x,
        The y coordinate of the center of the Gaussian (degrees)
     s : float
        The dispersion of the Gaussian (degrees)
-    beta : float
-        The amplitude of the Gaussian
+    num_threads : int
+        The number of OpenMP threads the timepoints are split across.
 
     Returns
 
@@ -412,29 +701,40 @@ def generate_og_timeseries(np.ndarray[DTYPE2_t, ndim=2] deg_x,
     """
 
     # cdef's
-    cdef int i,j,k,num_pixels_used
-    cdef int xlim = deg_x.shape[0]
-    cdef int ylim = deg_x.shape[1]
-    cdef int zlim = stim_arr.shape[2]
-    cdef DTYPE2_t pi = 3.14159265
+    cdef Py_ssize_t i,j,k,b,k0,k1
+    cdef Py_ssize_t xlim = deg_x.shape[0]
+    cdef Py_ssize_t ylim = deg_x.shape[1]
+    cdef Py_ssize_t zlim = stim_arr.shape[2]
+    cdef Py_ssize_t block = time_block(zlim, num_threads)
+    cdef Py_ssize_t num_blocks = (zlim + block - 1) // block
     cdef DTYPE2_t gauss_area = 2.0*s**2
     cdef DTYPE2_t gauss_distance = (3.0*s)**2
-    cdef DTYPE2_t gauss_integral = 2.0*pi*s**2
-    cdef DTYPE2_t d, gauss1D
-    cdef DTYPE2_t sum_gauss = 0.0
+    cdef DTYPE2_t d, w
+
+    # the gaussian is computed once, zero outside of 3 sigma
+    cdef DTYPE2_t[:, ::1] gauss = np.zeros((xlim,ylim),dtype=DTYPE2)
 
     # initialize output variable
     cdef np.ndarray[DTYPE2_t,ndim=1,mode='c'] stim = np.zeros(zlim,dtype=DTYPE2)
-
-    # the loop
-    for i in xrange(xlim):
-        for j in xrange(ylim):
-            d = (deg_x[i,j]-x)**2 + (deg_y[i,j]-y)**2
-            if d <= gauss_distance:
-                gauss1D = exp(-d/gauss_area)
-                sum_gauss += gauss1D
-                for k in xrange(zlim):
-                    stim[k] += stim_arr[i,j,k]*gauss1D
+    cdef DTYPE2_t[::1] out = stim
+
+    with nogil:
+        for i in range(xlim):
+            for j in range(ylim):
+                d = (deg_x[i,j]-x)**2 + (deg_y[i,j]-y)**2
+                if d <= gauss_distance:
+                    gauss[i,j] = exp(-d/gauss_area)
+
+        # the loop, with time innermost since it is the contiguous axis
+        for b in prange(num_blocks, num_threads=num_threads, schedule='static'):
+            k0 = b*block
+            k1 = min(k0+block, zlim)
+            for i in range(xlim):
+                for j in range(ylim):
+                    w = gauss[i,j]
+                    if w != 0:
+                        for k in range(k0,k1):
+                            out[k] += stim_arr[i,j,k]*w
 
     return stim
 
@@ -91,4 +91,45 @@ def test_auditory_fit():
     rf /= (fit.sigma*np.sqrt(2*np.pi))
     npt.assert_almost_equal(np.round(rf.sum()), np.round(fit.receptive_field_log10.sum())) 
     
-    
\ No newline at end of file
+    
+def test_auditory_jacobian():
+    
+    # stimulus features
+    duration = 30 # seconds
+    Fs = int(44100/2) # Hz
+    lo_freq = 200.0 # Hz
+    hi_freq = 10000.0 # Hz
+    tr_length = 1.0 # seconds
+    dtype = ctypes.c_double
+    
+    # generate auditory stimulus
+    time = np.linspace(0,duration,duration*Fs)
+    ch = chirp(time, lo_freq, duration, hi_freq, method='logarithmic')
+    signal = np.concatenate((ch,ch[::-1]))
+    blank = np.zeros((10*Fs))
+    signal = np.concatenate((blank,signal,blank),-1)
+    
+    # instantiate an instance of the Stimulus class
+    stimulus = AuditoryStimulus(signal, Fs, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = aud.AuditoryModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # a pRF
+    params = np.array([np.log10(987), np.log10(123), 2.4, 0.59])
+
+    # compare the analytic Jacobian to finite differences
+    prediction, jacobian = model.generate_prediction_jacobian(*params)
+    npt.assert_almost_equal(prediction, model.generate_prediction(*params))
+    for i in range(len(params)):
+        h = np.zeros(len(params))
+        h[i] = 1e-6
+        numeric = (model.generate_prediction(*(params+h)) - model.generate_prediction(*(params-h))) / 2e-6
+        npt.assert_allclose(jacobian[:,i], numeric, rtol=1e-3, atol=1e-3 * np.max(np.abs(numeric)))
+    
+    # the batched predictions match the scalar ones
+    parameters = np.array([params, params * 1.1])
+    predictions = model.generate_predictions(parameters)
+    for p, prediction in zip(parameters, predictions):
+        npt.assert_almost_equal(prediction, model.generate_prediction(*p))
@@ -75,7 +75,7 @@ def test_auditory_hrf_fit():
     npt.assert_almost_equal(fit.center_freq0, 3)
     npt.assert_almost_equal(fit.sigma0, 2)
     npt.assert_almost_equal(fit.hrf0, 1.2222222222222223)
-    npt.assert_almost_equal(fit.beta0, 2.3404365192849017)
+    npt.assert_almost_equal(fit.beta0, 2.3404384219153878)
     npt.assert_almost_equal(fit.baseline0, 1.416)
     
     # final fit
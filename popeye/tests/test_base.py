@@ -3,6 +3,8 @@ import sharedmem
 import ctypes
 import pickle
 import time
+import tempfile
+import shutil
 
 import numpy as np
 import numpy.testing as npt
@@ -309,4 +311,75 @@ def test_resurrect_model():
     npt.assert_almost_equal(np.sum(fit.scaled_ballpark_prediction-fit.data)**2,0)
     
     
-    
\ No newline at end of file
+    
+def test_cache_model_path():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    thetas = np.insert(thetas,0,-1)
+    thetas = np.append(thetas,-1)
+    num_blank_steps = 20
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.5
+    scale_factor = 0.50
+    pixels_across = 100
+    pixels_down = 100
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, screen_width, 
+                                thetas, num_bar_steps, num_blank_steps, ecc, clip=0.01)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    model.mask_size = 5
+    
+    # set cache grids
+    grids = (utils.grid_slice(-10, 10, 5), utils.grid_slice(-10, 10, 5), utils.grid_slice(0.55,5.25, 5))
+    
+    # cache the pRF model to disk
+    cached_model_path = tempfile.mkdtemp()
+    cache = model.cache_model(grids, ncpus=3, path=cached_model_path)
+    
+    # resurrect it
+    model = og.GaussianModel(stimulus, utils.spm_hrf, cached_model_path=cached_model_path)
+    model.hrf_delay = 0
+    
+    # memory-mapped and the same
+    nt.assert_true(isinstance(model.cached_model_timeseries, np.memmap))
+    npt.assert_almost_equal(model.cached_model_timeseries, [c[0] for c in cache], 4)
+    npt.assert_equal(model.cached_model_parameters, [c[1] for c in cache])
+    
+    # the header describes the cache
+    timeseries, parameters, header = utils.load_cached_model(cached_model_path)
+    npt.assert_equal(header['shape'], timeseries.shape)
+    npt.assert_equal(header['grids'], utils.grid_spec(grids))
+    
+    # a voxel sitting on one of the cached grid points
+    x, y, sigma = cache[42][1]
+    data = model.generate_prediction(x, y, sigma, 1, 0)
+    bounds = ((-12.0,12.0),(-12.0,12.0),(0.001,12.0),(1e-8,None),(None,None))
+    
+    # the ballpark comes from the cache, with its amplitude and offset
+    fit = og.GaussianFit(model, data, grids, bounds, auto_fit=False)
+    npt.assert_almost_equal(fit.ballpark, (x, y, sigma, 1, 0), 4)
+    
+    # a different hrf makes it stale
+    model = og.GaussianModel(stimulus, utils.spm_hrf, cached_model_path=cached_model_path)
+    model.hrf_delay = 1.0
+    npt.assert_raises(ValueError, lambda: model.resurrect_cached_model)
+    
+    # and so does a different stimulus
+    stimulus = VisualStimulus(bar[::-1], viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    model = og.GaussianModel(stimulus, utils.spm_hrf, cached_model_path=cached_model_path)
+    model.hrf_delay = 0
+    npt.assert_raises(ValueError, lambda: model.resurrect_cached_model)
+    
+    shutil.rmtree(cached_model_path)
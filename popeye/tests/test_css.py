@@ -9,6 +9,7 @@ import nose.tools as nt
 import popeye.utilities as utils
 from popeye import css
 from popeye.visual_stimulus import VisualStimulus, simulate_bar_stimulus, resample_stimulus
+from popeye.profiling import PROFILE
 
 def test_css_fit():
     
@@ -97,3 +98,84 @@ def test_css_fit():
                                                      
                                                      
                                                      
+
+def test_css_jacobian():
+    
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 0
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 50
+    pixels_across = 50
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the css model
+    model = css.CompressiveSpatialSummationModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0.2
+    
+    # a pRF
+    params = np.array([-2.24, 1.58, 1.23, 0.9, 1.0, -0.25])
+
+    # compare the analytic Jacobian to finite differences
+    prediction, jacobian = model.generate_prediction_jacobian(*params)
+    npt.assert_almost_equal(prediction, model.generate_prediction(*params))
+    for i in range(len(params)):
+        h = np.zeros(len(params))
+        h[i] = 1e-6
+        numeric = (model.generate_prediction(*(params+h)) - model.generate_prediction(*(params-h))) / 2e-6
+        npt.assert_allclose(jacobian[:,i], numeric, rtol=1e-3, atol=1e-3 * np.max(np.abs(numeric)))
+    
+    # the batched predictions match the scalar ones
+    parameters = np.array([params, params * 1.1])
+    predictions = model.generate_predictions(parameters)
+    for p, prediction in zip(parameters, predictions):
+        npt.assert_almost_equal(prediction, model.generate_prediction(*p))
+
+def test_css_fanned_grid():
+    
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 0
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 50
+    pixels_across = 50
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the css model
+    model = css.CompressiveSpatialSummationModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0.2
+    model.fanned_grid = True
+    
+    # the spatial grid is projected once, however many exponents there are
+    grids = ((-3,2), (-3,2), (0.5,2.75), (0.1,0.9))
+    for Ns in [3, 4]:
+        snapshot = PROFILE.snapshot()
+        predictions, parameters = model.generate_ballpark_grid(grids, Ns)
+        npt.assert_equal(PROFILE.since(snapshot)['project'], 1)
+        npt.assert_equal(predictions.shape, (Ns**4, stimulus.run_length))
+    
+    # assert equivalence
+    for i in [0, 17, 101, 255]:
+        npt.assert_almost_equal(predictions[i], model.generate_ballpark_prediction(*parameters[i], unscaled=True))
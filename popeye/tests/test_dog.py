@@ -57,7 +57,7 @@ def test_dog():
     x_grid = utils.grid_slice(-5,5,4)
     y_grid = utils.grid_slice(-5,5,4)
     s_grid = utils.grid_slice(1/stimulus.ppd0*1.10,3.5,4)
-    sr_grid = utils.grid_slice(1.0,2.0,4)
+    sr_grid = utils.grid_slice(1.0,3.0,4)
     vr_grid = utils.grid_slice(0.10,0.90,4)
     grids = (x_grid, y_grid, s_grid, sr_grid, vr_grid,)
     
@@ -75,10 +75,10 @@ def test_dog():
     # coarse fit
     ballpark = [1.666666666666667,
                 1.666666666666667,
-                2.8243187483428391,
-                1.9999999999999998,
-                0.10000000000000001,
-                0.3639449,
+                1.4729562450285176,
+                1.6666666666666665,
+                0.3666666666666667,
+                0.2377718,
                 -0.025000000000000022]
                 
     npt.assert_almost_equal((fit.x0,fit.y0,fit.s0,fit.sr0,fit.vr0, fit.beta0, fit.baseline0), ballpark)
@@ -100,4 +100,156 @@ def test_dog():
     
     # polar coordinates
     npt.assert_almost_equal([fit.theta,fit.rho],[np.arctan2(y,x),np.sqrt(x**2+y**2)])
-    
\ No newline at end of file
+    
+def test_dog_jacobian():
+    
+    # stimulus features
+    viewing_distance = 31
+    screen_width = 41
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 0
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 60
+    pixels_across = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = dog.DifferenceOfGaussiansModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # a pRF
+    params = np.array([2.2, 2.5, 0.9, 1.5, 0.5, 0.25, -0.25])
+
+    # compare the analytic Jacobian to finite differences
+    prediction, jacobian = model.generate_prediction_jacobian(*params)
+    npt.assert_almost_equal(prediction, model.generate_prediction(*params))
+    for i in range(len(params)):
+        h = np.zeros(len(params))
+        h[i] = 1e-6
+        numeric = (model.generate_prediction(*(params+h)) - model.generate_prediction(*(params-h))) / 2e-6
+        npt.assert_allclose(jacobian[:,i], numeric, rtol=1e-3, atol=1e-3 * np.max(np.abs(numeric)))
+    
+    # the batched predictions match the scalar ones
+    parameters = np.array([params, params * 1.1])
+    predictions = model.generate_predictions(parameters)
+    for p, prediction in zip(parameters, predictions):
+        npt.assert_almost_equal(prediction, model.generate_prediction(*p))
+
+def test_dog_linear_grid():
+    
+    # stimulus features
+    viewing_distance = 31
+    screen_width = 41
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 0
+    num_bar_steps = 30
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 100
+    pixels_across = 100
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = dog.DifferenceOfGaussiansModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    model.linear_grid = True
+    
+    # create "data"
+    x, y, sigma, sigma_ratio, volume_ratio = 2.2, 2.5, 0.90, 1.5, 0.5
+    data = model.generate_prediction(x, y, sigma, sigma_ratio, volume_ratio, 0.25, -0.10)
+    
+    # set up the grids
+    grids = (utils.grid_slice(-5,5,4), utils.grid_slice(-5,5,4), utils.grid_slice(0.25,2.5,4),
+             utils.grid_slice(1.0,2.5,4), utils.grid_slice(0.1,0.9,2))
+    bounds = ((-ecc,ecc), (-ecc,ecc), (1/stimulus.ppd,5), (1.0,None), (1e-8,1.0), (1e-8,None), (None,None))
+    
+    # the volume ratio in closed form, within the bounds
+    estimate, rss = model.linear_grid_search(data, grids, bounds=bounds)
+    nt.assert_true(0.1 <= estimate[4] <= 0.9)
+    nt.assert_true(estimate[2] >= 1/stimulus.ppd)
+    
+    # no better than a sweep over it
+    rfs = model.gaussian_receptive_fields([estimate[0]]*2, [estimate[1]]*2, [estimate[2], estimate[2]*estimate[3]],
+                                          support=np.inf, downsampled=True)
+    center, surround = model.hrf_responses(rfs, downsampled=True)
+    for vr in np.linspace(0.1, 0.9, 41):
+        prediction = center - np.sqrt(vr) * surround
+        residuals = data - np.polyval(np.polyfit(prediction, data, 1), prediction)
+        nt.assert_true(rss <= np.sum(residuals**2) + 1e-8)
+    
+    # the bank is kept
+    nt.assert_true(model.gaussian_bank(grids)[0] is model.gaussian_bank(grids)[0])
+    
+    # fit it
+    fit = dog.DifferenceOfGaussiansFit(model, data, grids, bounds)
+    npt.assert_almost_equal((fit.x0, fit.y0, fit.s0, fit.sr0, fit.vr0), estimate)
+    
+    # fine fit
+    npt.assert_almost_equal(fit.x, x, 2)
+    npt.assert_almost_equal(fit.y, y, 2)
+    npt.assert_almost_equal(fit.sigma, sigma, 2)
+    npt.assert_almost_equal(fit.sigma_ratio, sigma_ratio, 2)
+    npt.assert_almost_equal(fit.volume_ratio, volume_ratio, 2)
+    
+    # with a mask, the bank is masked like the ballpark
+    model.mask_size = 5
+    bank, parameters, center, surround, products = model.gaussian_bank(grids)
+    for i in [0, 37, 150, 255]:
+        ballpark = model.generate_ballpark_prediction(*np.append(parameters[i], 0.5), unscaled=True)
+        prediction = bank[center[i]] - np.sqrt(0.5) * bank[surround[i]]
+        npt.assert_almost_equal(np.corrcoef(ballpark, prediction)[0,1], 1)
+
+def test_dog_ballpark_mask():
+    
+    # stimulus features
+    viewing_distance = 31
+    screen_width = 41
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 0
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 60
+    pixels_across = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = dog.DifferenceOfGaussiansModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # a wide mask leaves the ballpark as it is, wherever the pRF is on the display
+    for x, y in [(-4.0, 4.0), (4.0, 4.0), (-4.0, -4.0), (4.0, -4.0)]:
+        unmasked = model.generate_ballpark_prediction(x, y, 1.0, 1.5, 0.5, unscaled=True)
+        model.mask_size = 20
+        masked = model.generate_ballpark_prediction(x, y, 1.0, 1.5, 0.5, unscaled=True)
+        del model.mask_size
+        npt.assert_almost_equal(np.corrcoef(masked, unmasked)[0,1], 1, 4)
+        
+        # it is the mask of the downsampled display
+        npt.assert_equal(model.distance_mask_coarse(x, y, 1.5).shape, stimulus.deg_x0.shape)
@@ -90,6 +90,341 @@ def test_og_fit():
     # test model == fit RF
     npt.assert_almost_equal(np.round(fit.model.generate_receptive_field(x,y,sigma).sum()), np.round(fit.receptive_field.sum()))
 
+def test_og_hrf_basis():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # the usual predictions
+    params = (-3.1, 2.2, 1.7, 2.5, -0.25)
+    prediction = model.generate_prediction(*params)
+    ballpark = model.generate_ballpark_prediction(*params[0:3], unscaled=True)
+    
+    # from the HRF-convolved stimulus, which is float32
+    model.hrf_basis = True
+    npt.assert_allclose(model.generate_prediction(*params), prediction, rtol=1e-5, atol=1e-4)
+    npt.assert_allclose(model.generate_ballpark_prediction(*params[0:3], unscaled=True), ballpark, rtol=1e-5, atol=1e-4)
+    
+    # the convolved stimulus is only built once per kernel
+    nt.assert_equal(len(stimulus.convolved_stimuli), 2)
+    model.generate_prediction(*params)
+    nt.assert_equal(len(stimulus.convolved_stimuli), 2)
+    
+    # a new kernel evicts the least recently used one, the downsampled stimulus
+    stimulus.convolved(utils.spm_hrf(1, tr_length))
+    nt.assert_equal([key[1] for key in stimulus.convolved_stimuli], [False, False])
+
+def test_og_least_squares_fit():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # a pRF
+    params = np.array([-3.1, 2.2, 1.7, 2.5, -0.25])
+
+    # compare the analytic Jacobian to finite differences
+    prediction, jacobian = model.generate_prediction_jacobian(*params)
+    npt.assert_almost_equal(prediction, model.generate_prediction(*params))
+    for i in range(len(params)):
+        h = np.zeros(len(params))
+        h[i] = 1e-6
+        numeric = (model.generate_prediction(*(params+h)) - model.generate_prediction(*(params-h))) / 2e-6
+        npt.assert_allclose(jacobian[:,i], numeric, rtol=1e-3, atol=1e-3 * np.max(np.abs(numeric)))
+    
+    # fit it with the gradient-based finisher
+    model.finisher = 'least_squares'
+    data = model.generate_prediction(*params)
+    grids = (utils.grid_slice(-10,10,5), utils.grid_slice(-10,10,5), utils.grid_slice(0.25,5.25,5))
+    bounds = ((-12.0,12.0), (-12.0,12.0), (0.001,12.0), (1e-8,None), (None,None))
+    fit = og.GaussianFit(model, data, grids, bounds)
+    
+    # assert equivalence
+    npt.assert_almost_equal(fit.estimate, params, 2)
+    npt.assert_equal(fit.result.converged, True)
+
+def test_og_projected_fit():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model, solving beta and baseline in closed form
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    model.finisher = 'projected'
+    
+    # generate a time-series
+    params = np.array([-3.1, 2.2, 1.7, 2.5, -0.25])
+    data = model.generate_prediction(*params)
+    
+    # fit it
+    grids = (utils.grid_slice(-10,10,5), utils.grid_slice(-10,10,5), utils.grid_slice(0.25,5.25,5))
+    bounds = ((-12.0,12.0), (-12.0,12.0), (0.001,12.0), (1e-8,None), (None,None))
+    fit = og.GaussianFit(model, data, grids, bounds)
+    
+    # the estimate still holds beta and baseline
+    npt.assert_equal(len(fit.estimate), len(params))
+    npt.assert_almost_equal(fit.estimate, params, 2)
+
+def test_og_generate_predictions():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # a matrix of pRFs
+    parameters = np.array([[-3.1, 2.2, 1.7, 2.5, -0.25],
+                           [4.0, -1.0, 0.8, 1.0, 0.5],
+                           [0.5, 0.5, 3.0, -2.0, 0.0]])
+    
+    # predicted a chunk at a time
+    predictions = model.generate_predictions(parameters, chunk_size=2)
+    npt.assert_equal(predictions.shape, (3, stimulus.run_length))
+    
+    # assert equivalence
+    for p, prediction in zip(parameters, predictions):
+        npt.assert_almost_equal(prediction, model.generate_prediction(*p))
+        npt.assert_almost_equal(model.generate_predictions(p, unscaled=True)[0],
+                                model.generate_prediction(*p, unscaled=True))
+
+def test_og_separable_prediction():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # the same pRF through each layout, with and without the HRF basis
+    for layout in ['native', 'pixels', 'packed']:
+        
+        stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype, layout=layout)
+        
+        # the gaussian model never unpacks the native stimulus
+        og.GaussianModel(stimulus, utils.spm_hrf)
+        if layout == 'packed':
+            nt.assert_true('stim_arr' not in stimulus.__dict__)
+            nt.assert_true('stim_arr0' in stimulus.__dict__)
+        
+        for hrf_basis in [False, True]:
+            
+            # initialize the gaussian model
+            model = og.GaussianModel(stimulus, utils.spm_hrf)
+            model.hrf_delay = 0
+            model.hrf_basis = hrf_basis
+            
+            # the sparse RF
+            sparse = model.generate_prediction(-3.1, 2.2, 1.7, 2.5, -0.25)
+            
+            # as two profiles
+            model.separable = True
+            separable = model.generate_prediction(-3.1, 2.2, 1.7, 2.5, -0.25)
+            
+            # assert equivalence
+            npt.assert_allclose(separable, sparse, rtol=1e-4, atol=1e-4)
+    
+    # the profiles factor the RF
+    row0, row_weights, col0, col_weights = model.separable_receptive_field(-3.1, 2.2, 1.7)
+    pixels, weights = model.sparse_receptive_field(-3.1, 2.2, 1.7)
+    rf = np.zeros_like(stimulus.deg_x)
+    rf[row0:row0+len(row_weights), col0:col0+len(col_weights)] = np.outer(row_weights, col_weights)
+    npt.assert_almost_equal(rf.ravel()[pixels], weights)
+    
+    # nothing beyond the display
+    npt.assert_equal(model.spatial_response(100, 100, 1.0), np.zeros(stimulus.run_length))
+
+def test_og_scale_space_grid():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    model.scale_space_grid = True
+    
+    # a dense grid
+    grids = (utils.grid_slice(-10,10,21), utils.grid_slice(-10,10,21), utils.grid_slice(0.5,4.5,5))
+    predictions, parameters = model.generate_ballpark_grid(grids)
+    
+    # the centers are on the pixels
+    npt.assert_equal(np.in1d(parameters[:,0], stimulus.deg_x0[0,:]).all(), True)
+    npt.assert_equal(np.in1d(parameters[:,1], stimulus.deg_y0[:,0]).all(), True)
+    
+    # assert equivalence
+    for i in np.random.RandomState(0).choice(len(parameters), 10, replace=False):
+        npt.assert_allclose(predictions[i], model.generate_ballpark_prediction(*parameters[i], unscaled=True),
+                            rtol=1e-4, atol=1e-4)
+    
+    # fit the response
+    data = model.generate_prediction(-3.1, 2.2, 1.7, 2.5, -0.25)
+    bounds = ((-12.0,12.0), (-12.0,12.0), (0.001,12.0), (1e-8,None), (None,None))
+    fit = og.GaussianFit(model, data, grids, bounds)
+    
+    # the grid is kept
+    nt.assert_true(model.ballpark_grid(grids)[0] is model.ballpark_grid(grids)[0])
+    
+    # coarse fit, off the grid
+    nt.assert_true(any(np.all(parameters == fit.ballpark[0:3], 1)))
+    
+    # fine fit
+    npt.assert_almost_equal(fit.x, -3.1, 2)
+    npt.assert_almost_equal(fit.y, 2.2, 2)
+    npt.assert_almost_equal(fit.sigma, 1.7, 2)
+
+def test_og_pyramid_fit():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.25
+    pixels_across = 80
+    pixels_down = 80
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # refine at half resolution before a short polish at native resolution
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    model.pyramid = (0.5,)
+    model.polish_iterations = 2
+    
+    # the level is built once
+    level = model.at_scale(0.5)
+    npt.assert_equal(level.stimulus.stim_arr.shape, (40, 40, stimulus.run_length))
+    nt.assert_true(model.at_scale(0.5).stimulus is level.stimulus)
+    nt.assert_true(model.at_scale(1.0).stimulus is stimulus)
+    
+    # generate a time-series
+    params = np.array([-3.1, 2.2, 1.7, 2.5, -0.25])
+    data = model.generate_prediction(*params)
+    
+    # fit it
+    grids = (utils.grid_slice(-10,10,5), utils.grid_slice(-10,10,5), utils.grid_slice(0.25,5.25,5))
+    bounds = ((-12.0,12.0), (-12.0,12.0), (0.001,12.0), (1e-8,None), (None,None))
+    fit = og.GaussianFit(model, data, grids, bounds)
+    
+    # assert equivalence
+    npt.assert_almost_equal(fit.estimate, params, 1)
+    npt.assert_almost_equal(fit.rsquared, 1, 2)
+
 def test_negative_og_fit():
 
     # stimulus features
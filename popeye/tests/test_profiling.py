@@ -0,0 +1,107 @@
+import ctypes
+
+import numpy as np
+import numpy.testing as npt
+import nose.tools as nt
+
+import popeye.utilities as utils
+import popeye.og as og
+from popeye.profiling import Profile, aggregate_profiles, summarize_profiles
+from popeye.visual_stimulus import VisualStimulus, simulate_bar_stimulus
+
+def test_profile():
+    
+    profile = Profile()
+    
+    # counters and timers
+    snapshot = profile.snapshot()
+    profile.count('objective')
+    profile.count('objective', 2)
+    with profile.timer('grid'):
+        pass
+    
+    # only what happened since the snapshot
+    since = profile.since(snapshot)
+    npt.assert_equal(since['objective'], 3)
+    npt.assert_equal(since['grid'], 1)
+    nt.assert_true(since['grid_time'] >= 0)
+    
+    snapshot = profile.snapshot()
+    profile.count('fft')
+    npt.assert_equal(profile.since(snapshot), {'fft': 1})
+    
+    # within a stage, also under the stage's name
+    snapshot = profile.snapshot()
+    with profile.stage('finish'):
+        profile.count('objective')
+        with profile.timer('convolve'):
+            pass
+    profile.count('objective')
+    since = profile.since(snapshot)
+    npt.assert_equal([since['objective'], since['finish.objective'], since['finish'], since['finish.convolve']], [2, 1, 1, 1])
+    nt.assert_true('finish.finish' not in since)
+    nt.assert_true(since['finish.convolve_time'] <= since['finish_time'])
+    snapshot = profile.snapshot()
+    profile.count('fft')
+    
+    # nothing when disabled
+    profile.enabled = False
+    profile.count('fft')
+    with profile.timer('grid'):
+        pass
+    npt.assert_equal(profile.since(snapshot), {'fft': 1})
+
+def test_fit_profile():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 10
+    num_bar_steps = 20
+    ecc = 12
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_across = 60
+    pixels_down = 60
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.spm_hrf)
+    model.hrf_delay = 0
+    
+    # fit two voxels
+    grids = (utils.grid_slice(-10,10,5), utils.grid_slice(-10,10,5), utils.grid_slice(0.25,5.25,5))
+    bounds = ((-12.0,12.0), (-12.0,12.0), (0.001,12.0), (1e-8,None), (None,None))
+    fits = []
+    for i, params in enumerate([(-3.1, 2.2, 1.7, 2.5, -0.25), (4.0, -1.0, 0.8, 1.0, 0.5)]):
+        data = model.generate_prediction(*params)
+        fits.append(og.GaussianFit(model, data, grids, bounds, voxel_index=(i,0,0)))
+    
+    # every stage is accounted for
+    profile = fits[0].profile
+    for name in ('grid', 'finish', 'objective', 'convolve', 'project', 'hrf', 'kernel'):
+        nt.assert_true(profile[name] > 0)
+    nt.assert_true(profile['objective'] >= fits[0].result.funcalls)
+    
+    # and each stage's share of it
+    for name in ('objective', 'kernel', 'project'):
+        npt.assert_equal(profile['grid.' + name] + profile['finish.' + name], profile[name])
+    nt.assert_true(profile['finish.objective'] >= fits[0].result.funcalls)
+    nt.assert_true(profile['finish_time'] <= fits[0].finish - fits[0].start)
+    
+    # and survives in the lean result
+    npt.assert_equal(fits[0].result.profile, profile)
+    
+    # aggregated across voxels
+    summary = aggregate_profiles([fit.result for fit in fits])
+    npt.assert_equal(summary['objective']['total'], fits[0].profile['objective'] + fits[1].profile['objective'])
+    nt.assert_true(summary['finish_time']['voxel_index'] in [(0,0,0), (1,0,0)])
+    nt.assert_true('objective' in summarize_profiles(fits))
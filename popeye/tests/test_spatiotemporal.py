@@ -130,3 +130,69 @@ def test_strf_fit():
     
     # test model == fit RF
     npt.assert_almost_equal(np.round(fit.model.generate_receptive_field(x,y,sigma).sum()), np.round(fit.receptive_field.sum()))
+
+def test_strf_mixture_fit():
+    
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.tile(np.arange(0,360,90),2)
+    thetas = np.insert(thetas,0,-1)
+    thetas = np.append(thetas,-1)
+    num_blank_steps = 20
+    num_bar_steps = 20
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 200
+    pixels_across = 200
+    dtype = ctypes.c_int16
+    projector_hz = 480
+    tau = 0.00875
+    mask_size = 5
+    hrf = 0.25
+    
+    # create the sweeping bar stimulus in memory
+    stim = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance, 
+                                 screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(stim, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    stimulus.fps = projector_hz
+    flicker_vec = np.zeros_like(stim[0,0,:]).astype('uint8')
+    flicker_vec[1*20:5*20] = 1
+    flicker_vec[5*20:9*20] = 2
+    stimulus.flicker_vec = flicker_vec
+    stimulus.flicker_hz = [10,20]
+    
+    # initialize the gaussian model, with the weight solved in closed form
+    model = strf.SpatioTemporalModel(stimulus, utils.spm_hrf)
+    model.tau = tau
+    model.hrf_delay = hrf
+    model.mask_size = mask_size
+    model.finisher = 'mixture'
+    model.mixture_grid = True
+    
+    # create the "data"
+    x, y, sigma, weight, beta, baseline = -2.24, 1.58, 1.23, 0.90, 1.0, -0.25
+    data = model.generate_prediction(x, y, sigma, weight, beta, baseline)
+    
+    # the regressors mix into the prediction
+    m, p = model.generate_mp_regressors(x, y, sigma)
+    weight_hat, rss = utils.mixture_weight(m, p, data, (1e-8,1.0))
+    npt.assert_almost_equal(weight_hat, weight)
+    
+    # the weight is not on the grid
+    grids = (utils.grid_slice(-8.0,7.0,5), utils.grid_slice(-8.0,7.0,5), utils.grid_slice(0.75,3.0,5), None)
+    bounds = ((-10,10), (-10,10), (1/stimulus.ppd,10), (1e-8,1.0), (1e-8,1e5), (None,None))
+    
+    # fit the response
+    fit = strf.SpatioTemporalFit(model, data, grids, bounds)
+    nt.assert_true(1e-8 <= fit.weight0 <= 1.0)
+    
+    # fine fit
+    npt.assert_almost_equal(fit.x, x, 2)
+    npt.assert_almost_equal(fit.y, y, 2)
+    npt.assert_almost_equal(fit.sigma, sigma, 2)
+    npt.assert_almost_equal(fit.weight, weight, 2)
+    npt.assert_almost_equal(fit.beta, beta, 2)
+    npt.assert_almost_equal(fit.baseline, baseline, 2)
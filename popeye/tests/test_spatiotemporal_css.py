@@ -6,6 +6,7 @@ import numpy as np
 import numpy.testing as npt
 import nose.tools as nt
 from scipy.integrate import simps
+from scipy.stats import linregress
 
 import popeye.utilities as utils
 from popeye import spatiotemporal_css as strf
@@ -107,6 +108,14 @@ def test_strf_css_fit():
      
     npt.assert_almost_equal((fit.x0,fit.y0,fit.sigma0, fit.n0, fit.weight0,fit.beta0,fit.baseline0),ballpark)
     
+    # the fanned grid ranks the same masked ballpark predictions
+    model.fanned_grid = True
+    predictions, parameters = model.generate_ballpark_grid(grids)
+    for i in [0, 99, 345, 1023]:
+        slope, intercept = linregress(predictions[i], model.data)[0:2]
+        npt.assert_almost_equal((predictions[i] + intercept) * slope, model.generate_ballpark_prediction(*parameters[i]))
+    model.fanned_grid = False
+    
     # fine fit
     npt.assert_almost_equal(fit.x, x, 2)
     npt.assert_almost_equal(fit.y, y, 2)
@@ -95,7 +95,7 @@ def test_strf_hrf_fit():
      1.5,
      0.95,
      -0.0833333,
-     0.8992611,
+     0.8992621,
      -0.25]
      
     npt.assert_almost_equal((fit.x0,fit.y0,fit.sigma0,fit.weight0,fit.hrf0,fit.beta0,fit.baseline0), ballpark)
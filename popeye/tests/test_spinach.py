@@ -86,6 +86,64 @@ def test_generate_og_timeseries():
     # correlates with a step function: 
     nt.assert_equal(round(rval, 3), 1)
 
+def test_threaded_timeseries():
+    
+    # a random stimulus and receptive field
+    np.random.seed(0)
+    stim_arr = np.random.randint(0, 2, (40, 30, 57)).astype('short')
+    rf = np.random.rand(40, 30)
+    mask = (np.random.rand(40, 30) > 0.5).astype('uint8')
+    
+    # the straightforward answers
+    nomask = np.einsum('ijk,ij->k', stim_arr, rf)
+    masked = np.einsum('ijk,ij->k', stim_arr, rf * mask)
+    
+    # any number of threads gives the same answer
+    for num_threads in (1, 2, 4, 100):
+        npt.assert_almost_equal(spin.generate_rf_timeseries_nomask(stim_arr, rf, num_threads), nomask)
+        npt.assert_almost_equal(spin.generate_rf_timeseries(stim_arr, rf, mask, num_threads), masked)
+        npt.assert_almost_equal(spin.generate_rf_timeseries_1D(stim_arr[:,0,:].astype('double'), rf[:,0], mask[:,0], num_threads),
+                                np.dot(rf[:,0] * mask[:,0], stim_arr[:,0,:]))
+    
+    # the og kernel too
+    dx, dy = generate_coordinate_matrices(40, 40, 1, 1.0)
+    binary = np.random.randint(0, 2, (40, 40, 57)).astype('uint8')
+    response = generate_og_timeseries(dx, dy, binary, 1.0, -2.0, 3.0)
+    npt.assert_almost_equal(generate_og_timeseries(dx, dy, binary, 1.0, -2.0, 3.0, 3), response)
+    
+    # read-only arrays, such as a memory-mapped stimulus, are accepted
+    stim_arr.flags.writeable = False
+    npt.assert_almost_equal(spin.generate_rf_timeseries(stim_arr, rf, mask, 2), masked)
+
+def test_sparse_rf_timeseries():
+    
+    # the visuotopic coordinates
+    dx, dy = generate_coordinate_matrices(60, 50, 2, 1.0)
+    
+    # a random stimulus
+    np.random.seed(1)
+    stim_arr = np.random.randint(0, 2, (dx.shape[0], dx.shape[1], 33)).astype('short')
+    
+    # the sparse pRF only covers the pixels within the support
+    pixels, weights = spin.generate_og_sparse_receptive_field(2.0, -3.0, 1.5, dx, dy, 3.0)
+    d = (dx-2.0)**2 + (dy+3.0)**2
+    npt.assert_equal(pixels, np.flatnonzero(d <= (3.0*1.5)**2))
+    
+    # and has the same values as the dense one there
+    rf = generate_og_receptive_field(2.0, -3.0, 1.5, dx, dy)
+    npt.assert_almost_equal(weights, rf.ravel()[pixels])
+    
+    # so the response is the same as the masked dense one
+    mask = (d <= (3.0*1.5)**2).astype('uint8')
+    dense = spin.generate_rf_timeseries(stim_arr, rf, mask)
+    npt.assert_almost_equal(spin.generate_sparse_rf_timeseries(stim_arr, pixels, weights), dense)
+    npt.assert_almost_equal(spin.generate_sparse_rf_timeseries(stim_arr, pixels, weights, 3), dense)
+    
+    # a pRF off the screen covers nothing
+    pixels, weights = spin.generate_og_sparse_receptive_field(1e3, 1e3, 1.0, dx, dy)
+    npt.assert_equal(len(pixels), 0)
+    npt.assert_equal(spin.generate_sparse_rf_timeseries(stim_arr, pixels, weights), np.zeros(33))
+
 # def test_binner():
 #     
 #     signal = np.ones(10)
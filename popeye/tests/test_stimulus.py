@@ -1,14 +1,16 @@
 from __future__ import division
 
-import os, ctypes
+import os, ctypes, tempfile
 
 import popeye.utilities as utils
+from popeye import css, gabor, css_regularized
 import numpy as np
 import numpy.testing as npt
 
 import nose.tools as nt
+from scipy.ndimage.interpolation import zoom
 
-from popeye.visual_stimulus import pixels_per_degree, generate_coordinate_matrices, resample_stimulus, simulate_sinflicker_bar, simulate_bar_stimulus, VisualStimulus
+from popeye.visual_stimulus import pixels_per_degree, generate_coordinate_matrices, resample_stimulus, simulate_sinflicker_bar, simulate_bar_stimulus, VisualStimulus, pack_stimulus, unpack_stimulus, generate_sinflicker_frames, stream_stimulus
 
 
 def test_pixels_per_degree():
@@ -127,6 +129,40 @@ def test_resample_stimulus():
     # make sure the duty-cycle doesn't change with resampling
     npt.assert_almost_equal(np.sum(stimulus.stim_arr0==1)/np.sum(stimulus.stim_arr0>-1),np.sum(stimulus.stim_arr==1)/np.sum(stimulus.stim_arr>-1),3)
 
+def test_resample_stimulus_interp():
+    
+    # a thin bar, one pixel wide
+    stim_arr = np.zeros((60,80,10), dtype='int16')
+    stim_arr[:,33,:5] = 1
+    stim_arr[21,:,5:] = 1
+    
+    # nearest-neighbour matches zooming frame by frame
+    resampled = resample_stimulus(stim_arr, 0.25)
+    for tr in range(stim_arr.shape[-1]):
+        npt.assert_array_equal(resampled[:,:,tr], zoom(stim_arr[:,:,tr], 0.25, mode='nearest', order=0))
+    
+    # area-averaging keeps the bar, at a quarter of the contrast
+    resampled = resample_stimulus(stim_arr, 0.25, dtype='double', interp='area', chunk_size=3)
+    npt.assert_equal(resampled.shape, (15,20,10))
+    npt.assert_almost_equal(np.max(resampled), 0.25)
+    npt.assert_almost_equal(np.mean(resampled, (0,1)), np.mean(stim_arr, (0,1)))
+    
+    # a non-integer factor too
+    resampled = resample_stimulus(stim_arr, 0.3, dtype='double', interp='area')
+    npt.assert_almost_equal(np.mean(resampled, (0,1)), np.mean(stim_arr, (0,1)))
+    
+    # and the pixel layout of the stimulus keeps the averages
+    stimulus = VisualStimulus(stim_arr, 38, 25, 0.25, 1.0, ctypes.c_int16, interp='area', layout='pixels')
+    npt.assert_almost_equal(np.max(stimulus.stim_mat0), 0.25)
+    npt.assert_equal(stimulus.stim_arr0.shape, (15,20,10))
+    
+    # as does the stimulus itself, which therefore cannot be packed
+    stimulus = VisualStimulus(stim_arr, 38, 25, 0.25, 1.0, ctypes.c_int16, interp='area')
+    npt.assert_almost_equal(np.max(stimulus.stim_arr0), 0.25)
+    npt.assert_almost_equal(np.mean(stimulus.stim_arr0, (0,1)), np.mean(stim_arr, (0,1)), 5)
+    nt.assert_raises(ValueError, VisualStimulus, stim_arr, 38, 25, 0.25, 1.0, ctypes.c_int16,
+                     interp='area', layout='packed')
+
 def test_simulate_sinflicker_bar():
     
     # no blanks
@@ -144,3 +180,135 @@ def test_simulate_sinflicker_bar():
     yhat = np.append(yhat,np.repeat(0.5,60))
     nt.assert_almost_equal(np.sum(yhat-np.round(y,2)),0,1)
     
+
+def test_stream_stimulus():
+    
+    # the full-rate movie, and the same frames as a stream
+    bar = simulate_sinflicker_bar(100,100,50,10,[0,-1],1,10,5,1,1,60)
+    frames = generate_sinflicker_frames(100,100,50,10,[0,-1],1,10,5,1,1,60)
+    
+    # binned into TRs and downsampled as they stream past
+    stim_arr = stream_stimulus(frames, 60, 0.5)
+    expected = resample_stimulus(np.mean(bar.reshape(100,100,2,60), -1), 0.5, dtype='double', interp='area')
+    npt.assert_equal(stim_arr.shape, (50,50,2))
+    npt.assert_almost_equal(stim_arr, expected, 4)
+    
+    # from a memory-mapped file, in flicker sub-bins of a fractional size
+    path = os.path.join(tempfile.mkdtemp(), 'stream_stimulus.npy')
+    np.save(path, bar)
+    stim_arr = stream_stimulus(path, 7.5, interp='nearest', dtype='double')
+    npt.assert_equal(stim_arr.shape, (100,100,16))
+    npt.assert_almost_equal(stim_arr[:,:,0], np.mean(bar[:,:,0:8], -1))
+    os.remove(path)
+
+def test_pixel_layout():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 5
+    num_bar_steps = 10
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_down = 50
+    pixels_across = 50
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # the same stimulus, in both layouts
+    native = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    pixels = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype, layout='pixels')
+    
+    # the pixel-major matrix is the flattened stimulus
+    nt.assert_equal(pixels.stim_mat.shape, (pixels_down*pixels_across, bar.shape[-1]))
+    npt.assert_equal(pixels.stim_mat.reshape(bar.shape), bar)
+    nt.assert_equal(pixels.stim_mat0.shape[0], native.stim_arr0.shape[0]*native.stim_arr0.shape[1])
+    
+    # some receptive fields
+    np.random.seed(2)
+    rfs = np.random.rand(3, pixels_down, pixels_across)
+    
+    # a single one, a stack and a sparse one project the same way in both layouts
+    npt.assert_almost_equal(pixels.project(rfs[0]), native.project(rfs[0]), 3)
+    npt.assert_almost_equal(pixels.project(rfs), native.project(rfs), 3)
+    idx = np.arange(0, pixels_down*pixels_across, 7)
+    npt.assert_almost_equal(pixels.project(rfs[0].ravel()[idx], idx),
+                            native.project(rfs[0].ravel()[idx], idx), 3)
+    
+    # and match a direct sum
+    npt.assert_almost_equal(native.project(rfs[1]), np.einsum('ijk,ij->k', bar, rfs[1]), 6)
+    
+    # the downsampled stimulus
+    rf0 = np.random.rand(*native.stim_arr0.shape[0:2])
+    npt.assert_almost_equal(pixels.project(rf0, downsampled=True), native.project(rf0, downsampled=True), 3)
+    
+    # unknown layouts
+    nt.assert_raises(ValueError, VisualStimulus, bar, viewing_distance, screen_width,
+                     scale_factor, tr_length, dtype, layout='bogus')
+
+def test_packed_layout():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,90)
+    num_blank_steps = 5
+    num_bar_steps = 11
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.5
+    pixels_down = 50
+    pixels_across = 50
+    dtype = ctypes.c_int16
+    
+    # a binary aperture
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    bar = (bar > 0.5).astype('int16')
+    
+    # packing round-trips, at a 16th of the size
+    bits = pack_stimulus(bar)
+    nt.assert_equal(bits.shape, (pixels_down*pixels_across, int(np.ceil(bar.shape[-1]/8))))
+    npt.assert_equal(unpack_stimulus(bits, bar.shape), bar)
+    nt.assert_raises(ValueError, pack_stimulus, bar*2)
+    
+    # the same stimulus, in both layouts
+    native = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    packed = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype, layout='packed')
+    nt.assert_true('stim_arr' not in packed.__dict__)
+    
+    # the projections agree
+    np.random.seed(3)
+    rfs = np.random.rand(2, pixels_down, pixels_across)
+    npt.assert_almost_equal(packed.project(rfs[0]), native.project(rfs[0]))
+    npt.assert_almost_equal(packed.project(rfs), native.project(rfs))
+    idx = np.arange(0, pixels_down*pixels_across, 5)
+    npt.assert_almost_equal(packed.project(rfs[0].ravel()[idx], idx), native.project(rfs[0].ravel()[idx], idx))
+    rf0 = np.random.rand(*native.stim_arr0.shape[0:2])
+    npt.assert_almost_equal(packed.project(rf0, downsampled=True), native.project(rf0, downsampled=True))
+    
+    # models that only project the stimulus predict the same from the bits
+    css_native, css_packed = [css.CompressiveSpatialSummationModel(s, utils.spm_hrf) for s in (native, packed)]
+    css_native.hrf_delay = css_packed.hrf_delay = 0
+    npt.assert_almost_equal(css_packed.generate_ballpark_prediction(1.1, -2.2, 1.5, 0.5, unscaled=True),
+                            css_native.generate_ballpark_prediction(1.1, -2.2, 1.5, 0.5, unscaled=True))
+    npt.assert_almost_equal(css_packed.generate_prediction(1.1, -2.2, 1.5, 0.5, 1, 0, unscaled=True),
+                            css_native.generate_prediction(1.1, -2.2, 1.5, 0.5, 1, 0, unscaled=True))
+    gabor_native, gabor_packed = [gabor.GaborModel(s, utils.spm_hrf) for s in (native, packed)]
+    npt.assert_almost_equal(gabor_packed.generate_ballpark_prediction(1.1, -2.2, 1.5, 0.3, 0.1, 1.0),
+                            gabor_native.generate_ballpark_prediction(1.1, -2.2, 1.5, 0.3, 0.1, 1.0))
+    npt.assert_almost_equal(gabor_packed.generate_prediction(1.1, -2.2, 1.5, 0.3, 0.1, 1.0),
+                            gabor_native.generate_prediction(1.1, -2.2, 1.5, 0.3, 0.1, 1.0))
+    nt.assert_true('stim_arr' not in packed.__dict__)
+    
+    # and a model that reads it directly refuses it
+    nt.assert_raises(ValueError, css_regularized.CompressiveSpatialSummationModel, packed, utils.spm_hrf)
+    
+    # the stimulus is still there when asked for
+    npt.assert_equal(packed.stim_arr, native.stim_arr)
+    npt.assert_equal(packed.stim_arr0, native.stim_arr0)
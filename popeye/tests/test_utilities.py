@@ -1,5 +1,5 @@
 from __future__ import division
-import ctypes, sharedmem, sys
+import os, ctypes, sharedmem, sys, tempfile, pickle
 
 try:
     from StringIO import StringIO
@@ -9,6 +9,7 @@ except ImportError:
 import numpy as np
 import nose.tools as nt
 import numpy.testing as npt
+from scipy.signal import fftconvolve
 
 import nibabel
 
@@ -227,6 +228,23 @@ def test_grid_slice():
     npt.assert_equal(p0[2][0].max(),to_1)
     npt.assert_equal(p0[2][1].min(),from_2)
     npt.assert_equal(p0[2][1].max(),to_2)
+
+def test_unique_rows():
+    
+    # a grid with repeated rows
+    array = np.array([[1.0, 2.0, 0.5],
+                      [0.0, 3.0, 0.5],
+                      [1.0, 2.0, 0.5],
+                      [1.0, 1.0, 0.5],
+                      [0.0, 3.0, 0.5]])
+    
+    unique, inverse = utils.unique_rows(array)
+    
+    # sorted, first column first
+    npt.assert_equal(unique, [[0.0, 3.0, 0.5], [1.0, 1.0, 0.5], [1.0, 2.0, 0.5]])
+    
+    # and every row is recovered
+    npt.assert_equal(unique[inverse], array)
     
 def test_recast_estimation_results():
 
@@ -321,6 +339,26 @@ def test_recast_estimation_results():
     npt.assert_almost_equal(np.mean(dat[...,2]), sigma)
     npt.assert_almost_equal(np.mean(dat[...,3]), beta)
     npt.assert_almost_equal(np.mean(dat[...,4]), baseline)
+    
+    # the lean results
+    with sharedmem.Pool(np=3) as pool:
+        results = pool.map(utils.parallel_fit_result, bundle)
+    
+    # recast them the same way
+    nif = utils.recast_estimation_results(results, grid_parent, True)
+    npt.assert_almost_equal(nif.get_data(), dat)
+    
+    # convergence info survives the flush
+    for result in results:
+        npt.assert_equal(result.converged, True)
+        npt.assert_equal(result.funcalls > 0, True)
+        npt.assert_equal(result.duration >= 0, True)
+    
+    # and they can be turned back into a fit
+    fit = results[0].to_fit(model, data, grids, bounds)
+    npt.assert_equal(fit.voxel_index, results[0].voxel_index)
+    npt.assert_almost_equal(fit.estimate, results[0].estimate)
+    npt.assert_almost_equal(fit.rsquared, results[0].rsquared)
 
 
 def test_make_nifti():
@@ -397,6 +435,105 @@ def test_error_function():
     err = utils.error_function(params, bounds, response, func, verbose)
     npt.assert_equal(err,np.inf)
 
+def test_convolve_hrf():
+    
+    # a few time-series and an HRF
+    timeseries = np.random.rand(3,100)
+    hrf = utils.spm_hrf(0, 1.0)
+    
+    # one HRF for all
+    convolved = utils.convolve_hrf(timeseries, hrf)
+    for ts, c in zip(timeseries, convolved):
+        npt.assert_almost_equal(c, fftconvolve(ts, hrf)[0:len(ts)])
+    
+    # a kernel longer than DIRECT_CONVOLUTION_LENGTH goes via its cached spectrum
+    long_hrf = utils.spm_hrf(0, 0.25)
+    npt.assert_equal(len(long_hrf) > utils.DIRECT_CONVOLUTION_LENGTH, True)
+    convolved = utils.convolve_hrf(timeseries, long_hrf)
+    for ts, c in zip(timeseries, convolved):
+        npt.assert_almost_equal(c, fftconvolve(ts, long_hrf)[0:len(ts)])
+    nt.assert_true(utils.hrf_spectrum(long_hrf, 100)[0] is utils.hrf_spectrum(long_hrf.copy(), 100)[0])
+    
+    # one HRF each
+    hrfs = [utils.spm_hrf(d, 1.0) for d in (-0.5, 0, 0.5)]
+    convolved = utils.convolve_hrf(timeseries, hrfs)
+    for ts, h, c in zip(timeseries, hrfs, convolved):
+        npt.assert_almost_equal(c, fftconvolve(ts, h)[0:len(ts)])
+
+def test_linear_parameters():
+    
+    # an unscaled prediction and its scaled version
+    prediction = np.sin(np.linspace(0,1,100) * 2 * np.pi * 3)
+    beta = 2.5
+    baseline = -0.3
+    data = beta * (prediction + baseline)
+    
+    # unbounded recovers both
+    npt.assert_almost_equal(utils.linear_parameters(prediction, data), (beta, baseline))
+    
+    # a negative slope is held at the lower bound of beta
+    bounds = ((1e-8,None),(None,None))
+    beta_hat, baseline_hat = utils.linear_parameters(prediction, -data, bounds)
+    npt.assert_equal(beta_hat, 1e-8)
+    npt.assert_almost_equal(beta_hat * baseline_hat, np.mean(-data))
+    
+    # the projected error matches the error with the solved parameters
+    func = lambda freq, beta, baseline, unscaled=False: np.sin(np.linspace(0,1,100) * 2 * np.pi * freq) * (1 if unscaled else beta) + (0 if unscaled else beta * baseline)
+    bounds = ((0,10),(None,None),(None,None))
+    npt.assert_almost_equal(utils.error_function((3.0,), bounds, data, func, 0, projected=True), 0)
+    
+    # and the projected search returns every parameter
+    phat = utils.gradient_descent_search(data, utils.error_function, func, (2.9,1,0), bounds, 0, projected=True)
+    npt.assert_almost_equal(phat[0], (3.0, beta, baseline), 4)
+
+def test_mixture_weight():
+    
+    # two regressors and their mixture, in percent change
+    t = np.linspace(0,1,100)
+    m = 2 + np.sin(t * 2 * np.pi * 3)
+    p = 2 + np.cos(t * 2 * np.pi * 5)
+    weight = 0.3
+    data = 2.5 * (utils.percent_change((1-weight)*m + weight*p) - 0.3)
+    
+    # recovers the weight, whatever the normalizer did
+    weight_hat, rss = utils.mixture_weight(m, p, data)
+    npt.assert_almost_equal(weight_hat, weight)
+    npt.assert_almost_equal(rss, 0)
+    
+    # held within the bounds, where the fit is worse
+    weight_hat, rss = utils.mixture_weight(m, p, data, (0.5,1.0))
+    npt.assert_almost_equal(weight_hat, 0.5)
+    nt.assert_true(rss > 0)
+    
+    # many pairs at once
+    weights, rss = utils.mixture_weight(np.array([m, p]), np.array([p, m]), data)
+    npt.assert_almost_equal(weights, (weight, 1-weight))
+    npt.assert_almost_equal(rss, (0, 0))
+    
+    # the search only sees the nonlinear parameters
+    def regressors(freq):
+        return 2 + np.sin(t * 2 * np.pi * freq), p
+    
+    def func(freq, weight, beta, baseline, unscaled=False):
+        prediction = utils.percent_change((1-weight)*regressors(freq)[0] + weight*p)
+        if unscaled:
+            return prediction
+        return beta * (prediction + baseline)
+    
+    bounds = ((0,10),(0,1),(None,None),(None,None))
+    npt.assert_almost_equal(utils.mixture_error_function((3.0,), bounds[0:1], data, regressors, bounds[1], 0), 0)
+    phat = utils.mixture_search(data, regressors, func, (2.9,0.5,1,0), bounds, 1)
+    npt.assert_almost_equal(phat[0], (3.0, weight, 2.5, -0.3), 4)
+    
+    # and so does the grid
+    estimate, rss = utils.mixture_grid_search(data, regressors, (utils.grid_slice(1,5,5), utils.grid_slice(0,1,3)), bounds, 1)
+    npt.assert_almost_equal(estimate, (3.0, weight))
+    
+    # but never outside the bounds of the other parameters
+    estimate, rss = utils.mixture_grid_search(data, regressors, (utils.grid_slice(1,5,5), utils.grid_slice(0,1,3)),
+                                              ((3.5,10),) + bounds[1:], 1)
+    nt.assert_true(estimate[0] >= 3.5)
+
 def test_gradient_descent_search():
 
     # create a parameter to estimate
@@ -940,3 +1077,253 @@ def test_coeff_of_determination():
 #     npt.assert_true(o.JB() == (5.0825725194665461,0.07876502232916649,0.16483617111543283,1.9458968022816807))
 #     npt.assert_true(o.dw() == 0.0051450432267976026)
 #
+
+def test_batch_brute_force_search():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,45)
+    num_blank_steps = 0
+    num_bar_steps = 30
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 100
+    pixels_across = 100
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.double_gamma_hrf)
+    model.hrf_delay = 0
+    
+    # set search grid
+    grids = (utils.grid_slice(-5,5,5), utils.grid_slice(-5,5,5), utils.grid_slice(0.5,4.5,5))
+    
+    # generate the grid once
+    predictions, parameters = model.generate_ballpark_grid(grids)
+    npt.assert_equal(predictions.shape, (125, bar.shape[-1]))
+    npt.assert_equal(parameters, utils.grid_parameters(grids))
+    
+    # the "data" are scaled grid predictions, one with a negative amplitude
+    data = np.array([predictions[17]*2.5 - 0.25,
+                     predictions[98]*-1.5 + 1.0])
+    
+    # score all the voxels at once
+    ballparks, rss = utils.batch_brute_force_search(data, predictions, parameters)
+    
+    # assert equivalence
+    npt.assert_almost_equal(ballparks[0], np.append(parameters[17], (2.5, -0.25)))
+    npt.assert_almost_equal(ballparks[1], np.append(parameters[98], (-1.5, 1.0)))
+    npt.assert_almost_equal(rss, 0)
+    
+    # same answer chunk by chunk
+    chunked, rss = utils.batch_brute_force_search(data, predictions, parameters, chunk_size=1)
+    npt.assert_almost_equal(chunked, ballparks)
+    
+    # positive amplitudes only
+    ballparks, rss = utils.batch_brute_force_search(data, predictions, parameters, True)
+    npt.assert_almost_equal(ballparks[0], np.append(parameters[17], (2.5, -0.25)))
+    nt.assert_true(ballparks[1][3] > 0)
+    
+    # grid points outside the bounds are never chosen
+    bounds = ((-4,5),(-5,5),(0.5,5),(None,None),(None,None))
+    ballparks, rss = utils.batch_brute_force_search(data, predictions, parameters, bounds=bounds)
+    nt.assert_true(np.all(ballparks[:,0] >= -4))
+    npt.assert_almost_equal(ballparks[1], np.append(parameters[98], (-1.5, 1.0)))
+
+def test_batch_fit():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,45)
+    num_blank_steps = 0
+    num_bar_steps = 30
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 100
+    pixels_across = 100
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.double_gamma_hrf)
+    model.hrf_delay = 0
+    
+    # generate two pRFs
+    params = [(-5.24, 2.58, 1.24, 2.5, -0.25),
+              (3.12, -1.75, 2.1, 1.5, 0.5)]
+    data = np.array([model.generate_prediction(*p) for p in params])
+    indices = [(0,0,0),(0,0,1)]
+    
+    # set search grid
+    grids = (utils.grid_slice(-8,8,5), utils.grid_slice(-8,8,5), utils.grid_slice(0.5,4.5,5))
+    
+    # set search bounds
+    bounds = ((-12.0,12.0), (-12.0,12.0), (1/stimulus.ppd,12.0), (1e-8,1e2), (None,None))
+    
+    # fit them all
+    fits = utils.batch_fit(og.GaussianFit, model, data, grids, bounds, indices)
+    
+    # assert equivalence
+    for fit, p, index in zip(fits, params, indices):
+        npt.assert_equal(fit.voxel_index, index)
+        npt.assert_almost_equal(fit.estimate, p, 2)
+
+def test_fit_volume():
+    
+    # stimulus features
+    viewing_distance = 38
+    screen_width = 25
+    thetas = np.arange(0,360,45)
+    num_blank_steps = 0
+    num_bar_steps = 30
+    ecc = 10
+    tr_length = 1.0
+    scale_factor = 0.50
+    pixels_down = 100
+    pixels_across = 100
+    dtype = ctypes.c_int16
+    
+    # create the sweeping bar stimulus in memory
+    bar = simulate_bar_stimulus(pixels_across, pixels_down, viewing_distance,
+                                screen_width, thetas, num_bar_steps, num_blank_steps, ecc)
+    
+    # create an instance of the Stimulus class
+    stimulus = VisualStimulus(bar, viewing_distance, screen_width, scale_factor, tr_length, dtype)
+    
+    # initialize the gaussian model
+    model = og.GaussianModel(stimulus, utils.double_gamma_hrf)
+    model.hrf_delay = 0
+    
+    # a small volume with two pRFs in it
+    params = [(-5.24, 2.58, 1.24, 2.5, -0.25),
+              (3.12, -1.75, 2.1, 1.5, 0.5)]
+    indices = [(0,0,0),(1,0,1)]
+    volume = np.zeros((2,1,2,bar.shape[-1]))
+    mask = np.zeros((2,1,2))
+    for p, index in zip(params, indices):
+        volume[index] = model.generate_prediction(*p)
+        mask[index] = 1
+    nifti = utils.make_nifti(volume)
+    
+    # set search grid
+    grids = (utils.grid_slice(-8,8,5), utils.grid_slice(-8,8,5), utils.grid_slice(0.5,4.5,5))
+    
+    # set search bounds
+    bounds = ((-12.0,12.0), (-12.0,12.0), (1/stimulus.ppd,12.0), (1e-8,1e2), (None,None))
+    
+    # fit the volume, one voxel per chunk
+    estimates = utils.fit_volume(model, og.GaussianFit, nifti, mask, grids, bounds, chunk_size=1)
+    estimates = np.asarray(estimates.dataobj)
+    
+    # assert equivalence
+    npt.assert_equal(estimates.shape, (2,1,2,6))
+    for p, index in zip(params, indices):
+        npt.assert_almost_equal(estimates[index][0:5], p, 2)
+        npt.assert_almost_equal(estimates[index][5], 1, 2)
+    npt.assert_equal(estimates[0,0,1], np.zeros(6))
+    
+    # each voxel is fit once, and the overloaded estimate is stored just as well
+    class CountedFit(og.GaussianFit):
+        runs = []
+        def run(self):
+            CountedFit.runs.append(self.voxel_index)
+            og.GaussianFit.run(self)
+    estimates = utils.fit_volume(model, CountedFit, nifti, mask, grids, bounds, overloaded=True)
+    estimates = np.asarray(estimates.dataobj)
+    npt.assert_equal(sorted(CountedFit.runs), indices)
+    npt.assert_equal(estimates.shape, (2,1,2,6))
+    for p, index in zip(params, indices):
+        npt.assert_almost_equal(estimates[index][1], np.sqrt(p[0]**2 + p[1]**2), 2)
+    
+    # an empty mask
+    nt.assert_raises(ValueError, utils.fit_volume, model, og.GaussianFit, nifti,
+                     np.zeros((2,1,2)), grids, bounds)
+    
+    # the same volume as two memory-mapped runs
+    path = tempfile.mkdtemp()
+    half = bar.shape[-1] // 2
+    runs = [os.path.join(path, 'run1.npy'), os.path.join(path, 'run2.npy')]
+    np.save(runs[0], volume[...,0:half])
+    np.save(runs[1], volume[...,half:])
+    source = utils.FunctionalData(runs)
+    npt.assert_equal(source.shape, volume.shape)
+    npt.assert_equal(utils.FunctionalData([u'%s' %(run) for run in runs]).shape, volume.shape)
+    npt.assert_equal(source.timeseries(np.array(indices)), volume[(0,1),(0,0),(0,1)])
+    
+    # only the paths are pickled
+    source = pickle.loads(pickle.dumps(source))
+    nt.assert_true(source.arrays is None)
+    
+    # the workers read their own voxels
+    bundle = utils.source_bundle(og.GaussianFit, model, source, grids, bounds, indices, verbose=0)
+    results = [utils.parallel_fit_source(args) for args in bundle]
+    for result in results:
+        npt.assert_almost_equal(result.estimate, params[indices.index(result.voxel_index)], 2)
+    
+    # and so does fit_volume
+    estimates = np.asarray(utils.fit_volume(model, og.GaussianFit, source, mask, grids, bounds).dataobj)
+    for p, index in zip(params, indices):
+        npt.assert_almost_equal(estimates[index][0:5], p, 2)
+
+def test_hrf_kernel():
+    
+    # the cached kernel is the kernel
+    hrf = utils.hrf_kernel(utils.spm_hrf, 0.5, 1.0)
+    npt.assert_equal(hrf, utils.spm_hrf(0.5, 1.0))
+    
+    # generated once and shared, so it can't be changed
+    nt.assert_true(utils.hrf_kernel(utils.spm_hrf, 0.5, 1.0) is hrf)
+    nt.assert_false(hrf.flags.writeable)
+    
+    # on the grid, the interpolated kernel is exact
+    npt.assert_equal(utils.hrf_kernel(utils.spm_hrf, 0.5, 1.0, 0.25), hrf)
+    
+    # in between, it is close
+    delay = 0.537
+    npt.assert_almost_equal(utils.hrf_kernel(utils.spm_hrf, delay, 1.0, 0.01),
+                            utils.spm_hrf(delay, 1.0), 4)
+    npt.assert_almost_equal(utils.hrf_kernel(utils.double_gamma_hrf, -delay, 1.0, 0.01),
+                            utils.double_gamma_hrf(-delay, 1.0), 4)
+
+def test_cached_model_search():
+    
+    # a random cached model
+    np.random.seed(0)
+    timeseries = np.random.randn(500, 60).astype('float32')
+    norms = utils.squared_norms(timeseries, chunk_size=64)
+    npt.assert_almost_equal(norms, np.sum(timeseries.astype('double')**2, -1))
+    
+    # noisy copies of a few cached predictions
+    truth = [3, 250, 499]
+    data = timeseries[truth] + np.random.randn(3, 60) * 0.1
+    
+    # the full rss matrix
+    rss = np.array([np.sum((timeseries - d)**2, -1) for d in data])
+    
+    # streamed in blocks smaller than k, and all at once
+    for chunk_size in (2, 64, 1000):
+        idx, best = utils.cached_model_search(data, timeseries, norms, k=5, chunk_size=chunk_size)
+        npt.assert_equal(idx[:,0], truth)
+        npt.assert_equal(idx, np.argsort(rss, -1)[:,0:5])
+        npt.assert_almost_equal(best, np.sort(rss, -1)[:,0:5], 3)
+    
+    # a single voxel, without norms
+    idx, best = utils.cached_model_search(data[1], timeseries)
+    npt.assert_equal(idx, [[250]])
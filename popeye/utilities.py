@@ -5,7 +5,9 @@ though that might change with time.
 """
 
 from __future__ import division
-import sys, os, time, fnmatch, copy, ctypes
+import sys, os, time, fnmatch, copy, ctypes, itertools, json, hashlib
+from functools import wraps
+from collections import OrderedDict
 from multiprocessing import Array
 from itertools import repeat
 from random import shuffle
@@ -14,15 +16,19 @@ import datetime
 import numpy as np
 import nibabel
 from scipy.stats import gamma
-from scipy.optimize import brute, fmin_powell, fmin
+from scipy.optimize import brute, fmin_powell, fmin, least_squares
 from scipy.stats import linregress
 from scipy.integrate import romb, trapz
+from scipy.signal import lfilter
+from scipy.fftpack import next_fast_len
 from scipy import c_, ones, dot, stats, diff
 from scipy.linalg import inv, solve, det, norm
 from numpy import log, pi, sqrt, square, diagonal
 from numpy.random import randn, seed
 import sharedmem
 
+from popeye.profiling import PROFILE
+
 # Python 3 compatibility below:
 try:  # pragma: no cover
     import cPickle
@@ -39,6 +45,11 @@ try: # pragma: no cover
 except NameError:  # pragma: no cover
     xrange = range
 
+try: # pragma: no cover
+    string_types = (basestring,)
+except NameError:  # pragma: no cover
+    string_types = (str,)
+
 
 def regularizing_error_function(parameter, bundle, p_bounds, thr=0.10): # pragma: no cover
     
@@ -139,6 +150,183 @@ def glover_hrf(delay, tr, oversampling=1, time_length=32., onset=0.):
                                 u_dispersion=.9, ratio=.35)
 
 
+HRF_CACHE_SIZE = 4096
+
+def bounded_cache(maxsize):
+    
+    r"""Memoizes a function of hashable arguments, keeping at most `maxsize` results.
+    
+    This stands in for `functools.lru_cache`, which Python 2.7 lacks. A hit
+    moves its entry to the end, and the least recently used entry is
+    evicted once the cache is full.
+    
+    """
+    
+    def decorator(func):
+        
+        cache = OrderedDict()
+        
+        @wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.pop(args)
+            except KeyError:
+                result = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = result
+            return result
+        
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    
+    return decorator
+
+@bounded_cache(HRF_CACHE_SIZE)
+def _cached_hrf(hrf_model, delay, tr):
+    
+    hrf = np.array(hrf_model(delay, tr), dtype='double')
+    
+    # the same kernel is handed to every caller
+    hrf.flags.writeable = False
+    
+    return hrf
+
+def hrf_kernel(hrf_model, delay, tr, resolution=None):
+    
+    r"""Returns an HRF from a bounded cache shared by all models.
+    
+    Every distinct (`hrf_model`, `delay`, `tr`) kernel is generated once and
+    kept, up to `HRF_CACHE_SIZE` kernels. The kernel is read-only, since it
+    is shared.
+    
+    When the delay is a free parameter, as in `popeye.og_hrf`, the delays
+    visited by the search hardly ever repeat. Passing `resolution` instead
+    interpolates linearly between the cached kernels of the two nearest
+    multiples of `resolution`, which keeps the prediction continuous in
+    `delay` while only ever generating a bounded set of kernels.
+    
+    Parameters
+    ----------
+    hrf_model : callable
+        A function that generates an HRF given a delay and a TR, such as
+        `double_gamma_hrf` or `spm_hrf`.
+    
+    delay : float
+        The delay of the HRF.
+    
+    tr : float
+        The length of the repetition time in seconds.
+    
+    resolution : float
+        The spacing, in seconds of delay, of the kernels interpolated
+        between. If None, the kernel of `delay` itself is returned.
+    
+    Returns
+    -------
+    hrf : ndarray
+        The hemodynamic response function.
+    
+    """
+    
+    with PROFILE.timer('hrf'):
+        
+        if resolution is None:
+            return _cached_hrf(hrf_model, float(delay), float(tr))
+        
+        # the neighbouring kernels
+        step = delay / resolution
+        lower = np.floor(step)
+        weight = step - lower
+        hrf = _cached_hrf(hrf_model, float(lower * resolution), float(tr))
+        
+        if weight == 0:
+            return hrf
+        
+        upper = _cached_hrf(hrf_model, float((lower + 1) * resolution), float(tr))
+        return hrf + weight * (upper - hrf)
+
+# HRFs up to this many samples are convolved directly rather than via the FFT
+DIRECT_CONVOLUTION_LENGTH = 32
+
+@bounded_cache(HRF_CACHE_SIZE)
+def _cached_hrf_spectrum(hrf_bytes, nfft):
+    
+    spectrum = np.fft.rfft(np.frombuffer(hrf_bytes, dtype='double'), nfft)
+    
+    # the same spectrum is handed to every caller
+    spectrum.flags.writeable = False
+    
+    return spectrum
+
+def hrf_spectrum(hrf, num_timepoints):
+    
+    r"""The spectrum of `hrf`, zero-padded for convolving `num_timepoints` long time-series.
+    
+    The FFT length is the next fast length that avoids wrap-around, and the
+    spectrum of each distinct (`hrf`, length) pair is computed once and
+    kept, up to `HRF_CACHE_SIZE` spectra.
+    
+    Returns
+    -------
+    spectrum : ndarray
+        The read-only real FFT of the padded `hrf`.
+    
+    nfft : int
+        The FFT length.
+    
+    """
+    
+    hrf = np.ascontiguousarray(hrf, dtype='double')
+    nfft = next_fast_len(num_timepoints + len(hrf) - 1)
+    
+    return _cached_hrf_spectrum(hrf.tobytes(), nfft), nfft
+
+def convolve_hrf(timeseries, hrf):
+    
+    r"""Convolves one or many time-series with the HRF along time.
+    
+    This is `fftconvolve(response, hrf)[0:len(response)]`, as used by the
+    models' `generate_prediction`, without planning, padding and
+    transforming the HRF on every call. A short HRF, of up to
+    `DIRECT_CONVOLUTION_LENGTH` samples, is applied directly as a causal
+    filter. A longer one is applied via the FFT, with its spectrum taken
+    from the cache of `hrf_spectrum`.
+    
+    Parameters
+    ----------
+    timeseries : ndarray
+        A time-series, or a (num_timeseries x time) stack of them.
+    
+    hrf : ndarray or list
+        The HRF applied to every time-series, or one HRF per time-series,
+        which need not be of the same length.
+    
+    Returns
+    -------
+    convolved : ndarray
+        The convolved time-series, truncated to their original length.
+    
+    """
+    
+    timeseries = np.asarray(timeseries, dtype='double')
+    num_timepoints = timeseries.shape[-1]
+    
+    # one HRF per time-series
+    if not (isinstance(hrf, np.ndarray) and hrf.ndim == 1):
+        return np.array([convolve_hrf(ts, h) for ts, h in zip(timeseries, hrf)])
+    
+    with PROFILE.timer('convolve'):
+        
+        if len(hrf) <= DIRECT_CONVOLUTION_LENGTH:
+            return lfilter(hrf, 1.0, timeseries, axis=-1)
+        
+        PROFILE.count('fft')
+        spectrum, nfft = hrf_spectrum(hrf, num_timepoints)
+        convolved = np.fft.irfft(np.fft.rfft(timeseries, nfft, axis=-1) * spectrum, nfft, axis=-1)
+        
+        return convolved[..., 0:num_timepoints]
+
 def grid_slice(start, stop, Ns, dryrun=False):
     
     #### NOTE: there is some weird stuff going on when Ns is => stop-start
@@ -159,6 +347,106 @@ def grid_slice(start, stop, Ns, dryrun=False):
     else:
         return slice(start, stop+step, step)
         
+def grid_parameters(grids, Ns=None):
+    
+    r"""Expands a brute-force search space into the points it samples.
+    
+    The points are the same ones `scipy.optimize.brute` visits for the
+    same `grids` and `Ns`.
+    
+    Parameters
+    ----------
+    grids : tuple
+        A tuple of slice objects (see `grid_slice`) or of (min, max) pairs.
+    
+    Ns : int
+        Number of samples per dimension when `grids` holds (min, max) pairs.
+    
+    Returns
+    -------
+    parameters : ndarray
+        A (num_points x num_dimensions) array of grid points.
+    
+    """
+    
+    # get parameter space
+    if isinstance(grids[0], SliceType):
+        params = [np.arange(g.start, g.stop, g.step) for g in grids]
+    else:
+        params = [np.linspace(g[0], g[1], Ns) for g in grids]
+    
+    # make combos
+    return np.array([c for c in itertools.product(*params)], dtype='double')
+
+def unique_rows(array):
+    
+    r"""The unique rows of a 2D array, and where each row lands among them.
+    
+    This is `np.unique(array, axis=0, return_inverse=True)`, which needs
+    numpy 1.13, done with a lexicographic sort instead.
+    
+    Parameters
+    ----------
+    array : ndarray
+        A 2D array.
+    
+    Returns
+    -------
+    unique : ndarray
+        The unique rows of `array`, sorted lexicographically.
+    
+    inverse : ndarray
+        The row of `unique` of each row of `array`.
+    
+    """
+    
+    array = np.asarray(array)
+    
+    # sort the rows, first column first
+    order = np.lexsort(array.T[::-1])
+    ordered = array[order]
+    
+    # a row starts a new group wherever it differs from the one before
+    first = np.ones(len(array), dtype='bool')
+    first[1:] = np.any(np.diff(ordered, axis=0) != 0, axis=1)
+    
+    inverse = np.empty(len(array), dtype=np.intp)
+    inverse[order] = np.cumsum(first) - 1
+    
+    return ordered[first], inverse
+
+def within_bounds(parameters, bounds):
+    
+    r"""Flags the grid points that `error_function` would not reject.
+    
+    Parameters
+    ----------
+    parameters : ndarray
+        A (num_points x num_dimensions) array of grid points.
+    
+    bounds : tuple
+        A tuple of (min, max) pairs, one per dimension of `parameters`, as
+        passed to `error_function`. Extra trailing bounds are ignored.
+    
+    Returns
+    -------
+    inside : ndarray
+        A boolean array, True for the points inside `bounds`.
+    
+    """
+    
+    parameters = np.atleast_2d(parameters)
+    inside = np.ones(len(parameters), dtype='bool')
+    
+    # the same test as error_function
+    for p, b in zip(parameters.T, bounds):
+        if b[0]:
+            inside &= ~(p < b[0])
+        if b[1]:
+            inside &= ~(b[1] < p)
+    
+    return inside
+
 def distance_mask(x, y, sigma, deg_x, deg_y, amplitude=1):
     
     distance = (deg_x - x)**2 + (deg_y - y)**2
@@ -170,6 +458,14 @@ def distance_mask(x, y, sigma, deg_x, deg_y, amplitude=1):
 
 def recast_estimation_results(output, grid_parent, overloaded=False):
     
+    r"""Collates the fitted voxels into a parameter volume.
+    
+    `output` can hold `PopulationFit` objects or the lean
+    `popeye.base.PopulationFitResult` records returned by
+    `parallel_fit_result`, which carry the same estimates.
+    
+    """
+    
     # load the gridParent
     dims = list(grid_parent.shape)
     dims = dims[0:3]
@@ -279,6 +575,207 @@ def make_nifti(data, grid_parent=None):
         
     return nifti
 
+CACHED_MODEL_VERSION = 1
+
+def fingerprint(*arrays):
+    
+    r"""Returns a short hash of the contents, shapes and types of `arrays`."""
+    
+    sha = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha.update(str((arr.shape, arr.dtype.str)).encode())
+        sha.update(arr.view(np.uint8))
+    return sha.hexdigest()
+
+def grid_spec(grids, Ns=None):
+    
+    r"""Returns a JSON-friendly description of a brute-force search space."""
+    
+    if isinstance(grids[0], SliceType):
+        return {'slices': [[float(g.start), float(g.stop), float(g.step)] for g in grids]}
+    else:
+        return {'ranges': [[float(g[0]), float(g[1])] for g in grids], 'Ns': Ns}
+
+def is_cached_model(path):
+    
+    r"""Returns True if `path` holds a cached model written by `save_cached_model`."""
+    
+    return os.path.isfile(os.path.join(path, 'header.json'))
+
+def save_cached_model(path, timeseries, parameters, header):
+    
+    r"""Writes a cached model to disk.
+    
+    The cached model is a directory holding the predicted time-series as a
+    float32 .npy matrix, the parameters that generated them as a float64
+    .npy matrix, the squared norm of each time-series, and a JSON header
+    describing how they were made. The .npy files can be memory-mapped with
+    `load_cached_model`.
+    
+    Parameters
+    ----------
+    path : str
+        The directory to write to. It is created if it does not exist.
+    
+    timeseries : ndarray
+        A (num_points x num_timepoints) array of predictions.
+    
+    parameters : ndarray
+        A (num_points x num_parameters) array of model parameters.
+    
+    header : dict
+        A JSON-serializable description of the cached model, see
+        `PopulationModel.cache_header`.
+    
+    """
+    
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    
+    timeseries = np.asarray(timeseries, dtype='float32')
+    parameters = np.asarray(parameters, dtype='double')
+    
+    # the arrays
+    np.save(os.path.join(path, 'timeseries.npy'), timeseries)
+    np.save(os.path.join(path, 'parameters.npy'), parameters)
+    np.save(os.path.join(path, 'norms.npy'), squared_norms(timeseries))
+    
+    # the header goes last, it marks the cache as complete
+    header = dict(header)
+    header['version'] = CACHED_MODEL_VERSION
+    header['shape'] = list(timeseries.shape)
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump(header, f, indent=2, sort_keys=True)
+
+def load_cached_model(path, mmap_mode='r'):
+    
+    r"""Opens a cached model written by `save_cached_model`.
+    
+    Parameters
+    ----------
+    path : str
+        The cached model directory.
+    
+    mmap_mode : str or None
+        Passed to `numpy.load`. The default memory-maps the arrays read-only,
+        so that every worker shares the same pages without copying them.
+    
+    Returns
+    -------
+    timeseries : ndarray
+        The (num_points x num_timepoints) float32 predictions.
+    
+    parameters : ndarray
+        The (num_points x num_parameters) model parameters.
+    
+    header : dict
+        The header of the cached model.
+    
+    """
+    
+    with open(os.path.join(path, 'header.json')) as f:
+        header = json.load(f)
+    
+    if header.get('version') != CACHED_MODEL_VERSION:
+        raise ValueError("%s is version %s of the cached model format, expected version %s"
+                         %(path, header.get('version'), CACHED_MODEL_VERSION))
+    
+    timeseries = np.load(os.path.join(path, 'timeseries.npy'), mmap_mode=mmap_mode)
+    parameters = np.load(os.path.join(path, 'parameters.npy'), mmap_mode=mmap_mode)
+    
+    return timeseries, parameters, header
+
+def squared_norms(timeseries, chunk_size=10000):
+    
+    r"""Returns the squared norm of each row of `timeseries`, one block at a time."""
+    
+    norms = np.zeros(timeseries.shape[0])
+    for start in xrange(0, timeseries.shape[0], chunk_size):
+        block = np.asarray(timeseries[start:start+chunk_size], dtype='double')
+        norms[start:start+chunk_size] = np.sum(block**2, -1)
+    return norms
+
+def cached_model_search(data, timeseries, norms=None, k=1, chunk_size=10000):
+    
+    r"""Finds the cached predictions closest to each of many voxels.
+    
+    The cached model is streamed in blocks of `chunk_size` predictions, so
+    it can be a memory-mapped array larger than RAM. The residual sum of
+    squares between every prediction `a` and voxel `b` of a block is
+    computed as ||a||^2 - 2a.b + ||b||^2, which takes a single matrix
+    product per block instead of a full-size temporary per voxel.
+    
+    Parameters
+    ----------
+    data : ndarray
+        A (num_voxels x num_timepoints) array of measured time-series, or a
+        single time-series.
+    
+    timeseries : ndarray
+        The (num_points x num_timepoints) cached predictions.
+    
+    norms : ndarray
+        The squared norm of each cached prediction, see `squared_norms`.
+        Computed on the fly if not given.
+    
+    k : int
+        The number of matches returned per voxel.
+    
+    chunk_size : int
+        The number of cached predictions read per block.
+    
+    Returns
+    -------
+    indices : ndarray
+        A (num_voxels x k) array holding the rows of `timeseries` that best
+        match each voxel, best first.
+    
+    rss : ndarray
+        The residual sum of squares of each of those matches.
+    
+    """
+    
+    data = np.atleast_2d(np.asarray(data, dtype='double'))
+    num_voxels = data.shape[0]
+    num_points = timeseries.shape[0]
+    k = min(k, num_points)
+    
+    if norms is None:
+        norms = squared_norms(timeseries, chunk_size)
+    data_norms = np.sum(data**2, -1)
+    
+    # best matches so far
+    best_rss = np.full((k, num_voxels), np.inf)
+    best_idx = np.zeros((k, num_voxels), dtype=int)
+    columns = np.arange(num_voxels)
+    
+    for start in xrange(0, num_points, chunk_size):
+        
+        # one block of the cached model
+        block = np.asarray(timeseries[start:start+chunk_size], dtype='double')
+        
+        # rss of every prediction in the block against every voxel
+        rss = np.dot(block, data.T)
+        rss *= -2
+        rss += norms[start:start+chunk_size, np.newaxis]
+        rss += data_norms[np.newaxis, :]
+        
+        # merge with the best matches so far
+        rss = np.vstack((best_rss, rss))
+        idx = np.vstack((best_idx, np.arange(start, start+block.shape[0])[:,np.newaxis].repeat(num_voxels, 1)))
+        keep = np.argpartition(rss, k-1, axis=0)[0:k]
+        best_rss = rss[keep, columns]
+        best_idx = idx[keep, columns]
+    
+    # sort them
+    order = np.argsort(best_rss, axis=0)
+    best_rss = best_rss[order, columns]
+    best_idx = best_idx[order, columns]
+    
+    # rounding can push a perfect match a hair below zero
+    return best_idx.T, np.maximum(best_rss.T, 0)
+
 def generate_shared_array(unshared_arr,dtype):
 
     r"""Creates synchronized shared arrays from numpy arrays.
@@ -354,7 +851,7 @@ def normalize(array, imin=-1, imax=1, axis=-1):
 
 
 # generic gradient descent
-def gradient_descent_search(data, error_function, objective_function, parameters, bounds, verbose):
+def gradient_descent_search(data, error_function, objective_function, parameters, bounds, verbose, projected=False, maxiter=None):
 
     r"""A generic gradient-descent error minimization function.
 
@@ -399,6 +896,15 @@ def gradient_descent_search(data, error_function, objective_function, parameters
         The objective function that takes `parameters` and `args` and
         proceduces a model time-series.
 
+    projected : bool
+        Search only the nonlinear parameters, solving `beta` and `baseline`
+        at each step in closed form. The last two values of `parameters`
+        are then ignored, and the estimate still holds all of them. See
+        `error_function`.
+
+    maxiter : int
+        The maximum number of Powell iterations, None for no limit.
+
     Returns
     -------
     estimate : tuple
@@ -413,12 +919,163 @@ def gradient_descent_search(data, error_function, objective_function, parameters
 
     """
 
+    if projected:
+        parameters = parameters[:-2]
+
     output = fmin_powell(error_function, parameters,
-                         args=(bounds, data, objective_function, verbose),
-                         full_output=True, disp=False, retall=True)
+                         args=(bounds, data, objective_function, verbose, projected),
+                         maxiter=maxiter, full_output=True, disp=False, retall=True)
+
+    # restore the linear parameters to the estimate
+    if projected:
+        estimate = np.atleast_1d(output[0])
+        prediction = objective_function(*np.append(estimate,(1,0)), unscaled=True)
+        beta, baseline = linear_parameters(prediction, data, bounds[-2:])
+        output = (np.append(estimate,(beta,baseline)),) + tuple(output[1:])
 
     return output
 
+def least_squares_search(data, jacobian_function, parameters, bounds, verbose=False, maxiter=None):
+
+    r"""A bounded, gradient-based error minimization with an analytic Jacobian.
+
+    An alternative to `gradient_descent_search`. The residuals between the
+    model prediction and `data` are minimized with the trust-region
+    reflective method of `scipy.optimize.least_squares`, which follows the
+    derivatives of the prediction supplied by `jacobian_function` rather
+    than probing the objective, and which keeps the parameters within
+    `bounds` itself instead of relying on `error_function` returning inf.
+
+    Parameters
+    ----------
+    data : ndarray
+        The actual, measured time-series against which the model is fit.
+
+    jacobian_function : callable
+        Takes the model parameters and returns the prediction along with
+        its (num_timepoints x num_parameters) Jacobian, such as
+        `popeye.og.GaussianModel.generate_prediction_jacobian`.
+
+    parameters : tuple
+        A tuple of values representing a model setting, used as the seed.
+
+    bounds : tuple
+        The upper and lower bound of each parameter, `None` when the
+        parameter is unbounded. As in `error_function`, parameters past the
+        end of `bounds` are unbounded.
+
+    verbose : bool
+        Print each step of the minimization.
+
+    maxiter : int
+        The maximum number of prediction evaluations, None for the default
+        of `scipy.optimize.least_squares`.
+
+    Returns
+    -------
+    output : tuple
+        Laid out like the output of `gradient_descent_search`: the estimate,
+        the residual sum of squares, None, the number of Jacobian
+        evaluations, the number of prediction evaluations, a warning flag
+        that is 0 on convergence, and None.
+
+    """
+
+    bounds = list(bounds) + [(None,None)] * (len(parameters) - len(bounds))
+    lower = np.array([-np.inf if b[0] is None else b[0] for b in bounds], dtype='double')
+    upper = np.array([np.inf if b[1] is None else b[1] for b in bounds], dtype='double')
+
+    # the seed has to be feasible
+    x0 = np.clip(np.asarray(parameters, dtype='double'), lower, upper)
+
+    # the prediction and Jacobian come from the same call
+    last = {}
+    def evaluate(p): # pragma: no cover
+        if 'p' not in last or not np.array_equal(last['p'], p):
+            PROFILE.count('objective')
+            prediction, jacobian = jacobian_function(*p)
+            last['p'] = np.array(p)
+            last['residuals'] = prediction - data
+            last['jacobian'] = jacobian
+            if verbose:
+                print(p, np.sum(last['residuals']**2))
+        return last
+
+    result = least_squares(lambda p: evaluate(p)['residuals'], x0,
+                           jac=lambda p: evaluate(p)['jacobian'],
+                           bounds=(lower, upper), method='trf', x_scale='jac', max_nfev=maxiter)
+
+    return (result.x, 2 * result.cost, None, result.njev, result.nfev,
+            int(result.status <= 0), None)
+
+def mixture_search(data, regressor_function, objective_function, parameters, bounds, weight_index, verbose=False, maxiter=None, bounded_amplitude=False):
+    
+    r"""Like `gradient_descent_search`, with a mixing weight and the amplitude solved in closed form.
+    
+    Powell searches only the parameters other than the weight at
+    `weight_index`, `beta` and `baseline`. For each of its steps,
+    `regressor_function` returns the two regressors the weight mixes, and
+    the weight is solved with `mixture_weight`. `beta` and `baseline` are
+    then solved from the unscaled prediction of the estimate with
+    `linear_parameters`.
+    
+    Parameters
+    ----------
+    data : ndarray
+        The actual, measured time-series against which the model is fit.
+    
+    regressor_function : callable
+        Takes the parameters other than the weight, `beta` and `baseline`,
+        and returns the two regressors, such as
+        `popeye.spatiotemporal.SpatioTemporalModel.generate_mp_regressors`.
+    
+    objective_function : callable
+        Produces the model prediction from all of the parameters.
+    
+    parameters : tuple
+        All of the parameters of the model, used as the seed.
+    
+    bounds : tuple
+        The upper and lower bound of each of the parameters.
+    
+    weight_index : int
+        The position of the weight among the parameters.
+    
+    verbose : bool
+        Print each step of the minimization.
+    
+    maxiter : int
+        The maximum number of Powell iterations, None for no limit.
+    
+    bounded_amplitude : bool
+        Only weights with a positive slope are considered, as in
+        `mixture_grid_search`.
+    
+    Returns
+    -------
+    output : tuple
+        Laid out like the output of `gradient_descent_search`.
+    
+    """
+    
+    # the nonlinear parameters
+    nonlinear = [i for i in range(len(parameters)-2) if i != weight_index]
+    
+    output = fmin_powell(mixture_error_function, np.asarray(parameters)[nonlinear],
+                         args=([bounds[i] for i in nonlinear], data, regressor_function,
+                               bounds[weight_index], verbose, bounded_amplitude),
+                         maxiter=maxiter, full_output=True, disp=False, retall=True)
+    
+    # restore the weight, and the linear parameters, to the estimate
+    estimate = np.atleast_1d(output[0])
+    weight = mixture_weight(*regressor_function(*estimate), data=data, bounds=bounds[weight_index],
+                            bounded_amplitude=bounded_amplitude)[0]
+    estimate = np.insert(estimate, weight_index, weight)
+    prediction = objective_function(*np.append(estimate,(1,0)), unscaled=True)
+    beta, baseline = linear_parameters(prediction, data, bounds[-2:])
+    
+    return (np.append(estimate,(beta,baseline)),) + tuple(output[1:])
+
 def brute_force_search(data, error_function, objective_function, grids, bounds, Ns=None, verbose=False):
 
     r"""A generic brute-force grid-search error minimization function.
@@ -506,8 +1163,276 @@ def brute_force_search(data, error_function, objective_function, grids, bounds,
 
     return output
 
+def mixture_grid_search(data, regressor_function, grids, bounds, weight_index, Ns=None, bounded_amplitude=False, verbose=False):
+    
+    r"""Like `brute_force_search`, with a mixing weight solved in closed form.
+    
+    The dimension of `grids` at `weight_index` is not sampled, and may be
+    None. For each point of the other dimensions, the weight is instead
+    solved with
+    `mixture_weight`, within `bounds[weight_index]`, and with a positive
+    slope if `bounded_amplitude` is set.
+    
+    Returns
+    -------
+    estimate : ndarray
+        The best grid point, with its weight.
+    
+    rss : float
+        Its residual sum of squares.
+    
+    """
+    
+    # the grid, without the weight
+    grids = [g for i, g in enumerate(grids) if i != weight_index]
+    parameters = grid_parameters(grids, Ns)
+    
+    # drop the points that error_function would reject
+    other_bounds = [b for i, b in enumerate(bounds) if i != weight_index]
+    parameters = parameters[within_bounds(parameters, other_bounds)]
+    
+    weights = np.zeros(len(parameters))
+    rss = np.zeros(len(parameters))
+    for i, combo in enumerate(parameters):
+        PROFILE.count('objective')
+        weights[i], rss[i] = mixture_weight(*regressor_function(*combo), data=data,
+                                            bounds=bounds[weight_index], bounded_amplitude=bounded_amplitude)
+        if verbose:
+            print(combo, weights[i], rss[i])
+    
+    best = np.nanargmin(rss)
+    return np.insert(parameters[best], weight_index, weights[best]), rss[best]
+
+def batch_brute_force_search(data, predictions, parameters, bounded_amplitude=False, chunk_size=1000, bounds=None):
+    
+    r"""A brute-force grid-search over many voxels at once.
+    
+    Rather than regenerating every grid prediction for every voxel, the
+    predictions from `PopulationModel.generate_ballpark_grid` are z-scored
+    once. The correlation between every grid point and a chunk of voxels is
+    then a single matrix product, and the best grid point of each voxel has
+    a closed-form slope and intercept, identical to those of
+    `PopulationModel.regress`.
+    
+    Parameters
+    ----------
+    data : ndarray
+        A (num_voxels x num_timepoints) array of measured time-series.
+    
+    predictions : ndarray
+        A (num_points x num_timepoints) array of unscaled grid predictions.
+    
+    parameters : ndarray
+        A (num_points x num_dimensions) array of the grid points.
+    
+    bounded_amplitude : bool
+        If True, only positive amplitudes are considered a match, as is the
+        case when the lower bound of `beta` is positive.
+    
+    chunk_size : int
+        The number of voxels scored per matrix product.
+    
+    bounds : tuple
+        The bounds of the fit. Grid points outside them are not considered,
+        just as `error_function` scores them as `inf` in `brute_force_search`.
+    
+    Returns
+    -------
+    ballparks : ndarray
+        A (num_voxels x num_dimensions+2) array holding the best grid point,
+        slope and intercept of each voxel. Each row can be used as the
+        `ballpark` of a `PopulationFit`.
+    
+    rss : ndarray
+        The residual sum of squares of each voxel's ballpark.
+    
+    """
+    
+    data = np.atleast_2d(data)
+    num_timepoints = data.shape[-1]
+    
+    # drop the grid points that produce no usable prediction
+    predictions = np.asarray(predictions)
+    grid_mean = np.mean(predictions, -1)
+    grid_std = np.std(predictions, -1)
+    valid = np.isfinite(grid_std) & (grid_std > 0)
+    if bounds is not None:
+        valid &= within_bounds(parameters, bounds)
+    grid_mean = grid_mean[valid]
+    grid_std = grid_std[valid]
+    parameters = np.asarray(parameters)[valid]
+    
+    # z-score the grid once
+    grid = (predictions[valid] - grid_mean[:,np.newaxis]) / grid_std[:,np.newaxis]
+    
+    # output
+    ballparks = np.zeros((data.shape[0], parameters.shape[1]+2))
+    rss = np.zeros(data.shape[0])
+    
+    for start in xrange(0, data.shape[0], chunk_size):
+        
+        # z-score the voxels
+        chunk = data[start:start+chunk_size]
+        data_mean = np.mean(chunk, -1)
+        data_std = np.std(chunk, -1)
+        scale = np.where(data_std > 0, data_std, 1)
+        zdata = (chunk - data_mean[:,np.newaxis]) / scale[:,np.newaxis]
+        
+        # correlation of every grid point with every voxel
+        r = np.dot(grid, zdata.T) / num_timepoints
+        
+        # best grid point
+        if bounded_amplitude:
+            idx = np.argmax(r, 0)
+        else:
+            idx = np.argmax(r**2, 0)
+        r_best = r[idx, np.arange(len(idx))]
+        
+        # closed-form regression
+        slope = r_best * data_std / grid_std[idx]
+        intercept = data_mean - slope * grid_mean[idx]
+        if bounded_amplitude:
+            slope = np.abs(slope)
+        
+        # store
+        ballparks[start:start+chunk_size] = np.column_stack((parameters[idx], slope, intercept))
+        rss[start:start+chunk_size] = num_timepoints * data_std**2 * (1 - r_best**2)
+    
+    return ballparks, rss
+
 # generic error function
-def error_function(parameters, bounds, data, objective_function, verbose):
+def linear_parameters(prediction, data, bounds=((None,None),(None,None))):
+    
+    r"""The `beta` and `baseline` that best scale an unscaled prediction.
+    
+    Models predict `beta * (prediction + baseline)`, which is linear in
+    `beta` and in `beta * baseline`, so for a given unscaled prediction
+    both have a closed-form least-squares solution. The slope is kept
+    within the bounds of `beta`, with the intercept refit to match, and the
+    baseline is then kept within its own bounds.
+    
+    Parameters
+    ----------
+    prediction : ndarray
+        The unscaled prediction, as from `generate_prediction(..., unscaled=True)`.
+    
+    data : ndarray
+        The actual, measured time-series against which the model is fit.
+    
+    bounds : tuple
+        The bounds of `beta` and `baseline`, the last two of a model's bounds.
+    
+    Returns
+    -------
+    beta, baseline : float
+        The amplitude and offset of the prediction.
+    
+    """
+    
+    prediction_mean = np.mean(prediction)
+    data_mean = np.mean(data)
+    centered = prediction - prediction_mean
+    
+    # ordinary least-squares slope
+    ss = np.dot(centered, centered)
+    if ss > 0:
+        beta = np.dot(centered, data - data_mean) / ss
+    else:
+        beta = 0.0
+    
+    # the quadratic is convex, so the bounded slope is the clipped one
+    beta_bounds, baseline_bounds = bounds
+    if beta_bounds[0] is not None:
+        beta = max(beta, beta_bounds[0])
+    if beta_bounds[1] is not None:
+        beta = min(beta, beta_bounds[1])
+    
+    # the baseline is the intercept in units of beta
+    if beta == 0:
+        return beta, 0.0
+    baseline = (data_mean - beta * prediction_mean) / beta
+    if baseline_bounds[0] is not None:
+        baseline = max(baseline, baseline_bounds[0])
+    if baseline_bounds[1] is not None:
+        baseline = min(baseline, baseline_bounds[1])
+    
+    return beta, baseline
+
+def mixture_weight(m, p, data, bounds=(0.0, 1.0), bounded_amplitude=False):
+    
+    r"""The weight that best mixes two regressors into a fit of `data`.
+    
+    Models such as `popeye.spatiotemporal.SpatioTemporalModel` predict
+    `beta * (normalizer((1-weight)*m + weight*p) + baseline)`. The normalizer
+    only rescales and offsets the mixture, so whatever `beta` and `baseline`
+    turn out to be, the prediction is `slope*((1-weight)*m + weight*p) +
+    intercept`, a least-squares fit with two regressors and an intercept
+    that has a closed form. The weight is held within `bounds`, where the
+    best is either the unconstrained weight or one of the bounds.
+    
+    Parameters
+    ----------
+    m, p : ndarray
+        The two regressors, or a stack of pairs, one per row.
+    
+    data : ndarray
+        The actual, measured time-series against which the model is fit.
+    
+    bounds : tuple
+        The lower and upper bound of the weight.
+    
+    bounded_amplitude : bool
+        Only consider mixtures with a positive slope.
+    
+    Returns
+    -------
+    weight : float or ndarray
+        The best weight of each pair.
+    
+    rss : float or ndarray
+        The residual sum of squares of the fit with that weight.
+    
+    """
+    
+    # demeaned, and the mixture as m + weight*(p - m)
+    m = np.atleast_2d(m)
+    m = m - np.mean(m, -1)[:,np.newaxis]
+    u = np.atleast_2d(p) - np.mean(p, -1)[...,np.newaxis] - m
+    d = data - np.mean(data)
+    
+    mm, uu, mu = np.sum(m*m, -1), np.sum(u*u, -1), np.sum(m*u, -1)
+    md, ud, dd = np.dot(m, d), np.dot(u, d), np.dot(d, d)
+    
+    # the unconstrained fit, m*w1 + u*w2, up to their determinant
+    w1 = uu*md - mu*ud
+    w2 = mm*ud - mu*md
+    weight = w2 / np.where(w1 != 0, w1, np.inf)
+    
+    # the residuals of the unconstrained weight, held to the bounds, and of the bounds
+    lower = 0.0 if bounds[0] is None else bounds[0]
+    upper = 1.0 if bounds[1] is None else bounds[1]
+    weights = np.array([np.clip(weight, lower, upper),
+                        np.repeat(lower, len(weight)),
+                        np.repeat(upper, len(weight))])
+    rss = np.zeros(weights.shape)
+    for i in range(3):
+        xx = mm + 2*weights[i]*mu + weights[i]**2*uu
+        xd = md + weights[i]*ud
+        rss[i] = dd - xd**2 / np.where(xx > 0, xx, np.inf)
+        if bounded_amplitude:
+            rss[i, xd <= 0] = dd
+    
+    # the best of them
+    best = np.argmin(rss, 0)
+    weight = weights[best, np.arange(len(best))]
+    rss = rss[best, np.arange(len(best))]
+    
+    if np.ndim(p) == 1:
+        return weight[0], rss[0]
+    
+    return weight, rss
+
+def error_function(parameters, bounds, data, objective_function, verbose, projected=False):
 
     r"""A generic error function with bounding.
 
@@ -529,6 +1454,11 @@ def error_function(parameters, bounds, data, objective_function, verbose):
     debug : bool
         Useful for debugging a model, will print the parameters and error.
 
+    projected : bool
+        `parameters` holds all but `beta` and `baseline`, which are instead
+        solved from the unscaled prediction with `linear_parameters`. Their
+        bounds, the last two of `bounds`, still apply.
+
     Returns
     -------
     error : float
@@ -543,6 +1473,8 @@ def error_function(parameters, bounds, data, objective_function, verbose):
     # a scalar when num params is 1, and a tuple/list
     # when num params is > 1. have to look into this further
     
+    PROFILE.count('objective')
+    
     # check if parameters are inside bounds
     for p, b in zip(parameters,bounds):
         # if not return an inf
@@ -556,11 +1488,19 @@ def error_function(parameters, bounds, data, objective_function, verbose):
     ensemble.extend(parameters)
     
     # compute the RSS
-    prediction = objective_function(*ensemble)
+    if projected:
+        prediction = objective_function(*np.append(ensemble,(1,0)), unscaled=True)
+    else:
+        prediction = objective_function(*ensemble)
     
     # if nan, return inf
     if np.any(np.isnan(prediction)):
         return np.inf # pragma: no cover
+    
+    # scale the prediction by its best beta and baseline
+    if projected:
+        beta, baseline = linear_parameters(prediction, data, bounds[-2:])
+        prediction = beta * (prediction + baseline)
         
     # else, return RSS
     error = np.nansum((data-prediction)**2)
@@ -572,6 +1512,37 @@ def error_function(parameters, bounds, data, objective_function, verbose):
 
     return error
 
+def mixture_error_function(parameters, bounds, data, regressor_function, weight_bounds, verbose, bounded_amplitude=False):
+    
+    r"""Like `error_function`, with a mixing weight and the amplitude solved in closed form.
+    
+    `parameters` holds all but the weight, `beta` and `baseline`, and
+    `regressor_function` turns them into the two regressors the weight
+    mixes, see `mixture_weight`. `bounds` are those of `parameters`.
+    
+    """
+    
+    PROFILE.count('objective')
+    
+    # check if parameters are inside bounds
+    for p, b in zip(parameters,bounds):
+        if b[0] and p < b[0]:
+            return np.inf
+        if b[1] and b[1] < p:
+            return np.inf
+    
+    m, p = regressor_function(*parameters)
+    if np.any(np.isnan(m)) or np.any(np.isnan(p)):
+        return np.inf # pragma: no cover
+    
+    error = mixture_weight(m, p, data, weight_bounds, bounded_amplitude)[1]
+    
+    # print for debugging
+    if verbose:
+        print(parameters, error)
+    
+    return error
+
 def double_gamma_hrf(delay, tr, fptr=1.0, integrator=trapz):
 
     r"""The double gamma hemodynamic reponse function (HRF).
@@ -963,6 +1934,385 @@ def parallel_fit(args):
               verbose)
     return fit
 
+def parallel_fit_result(args):
+    
+    r"""
+    Like `parallel_fit`, but returns the lean `PopulationFitResult` of the
+    fit rather than the fit itself, which is much cheaper to send back from
+    a worker.
+    
+    """
+    
+    return parallel_fit(args).result
+
+def batch_fit(Fit, model, data, grids, bounds, indices, Ns=None, ncpus=1, chunk_size=1000, verbose=0, lean=False):
+    
+    r"""
+    Fits many voxels, sharing a single grid-search across all of them.
+    
+    The ballpark predictions are generated once with
+    `PopulationModel.generate_ballpark_grid` and scored against all voxels
+    with `batch_brute_force_search`. Each voxel's ballpark then seeds its
+    own gradient-descent.
+    
+    Paramaters
+    ----------
+    Fit : `PopulationFit` class
+        The fit class of the model, e.g. `popeye.og.GaussianFit`.
+    
+    model : `PopulationModel` class instance
+        The pRF model.
+    
+    data : ndarray
+        A (num_voxels x num_timepoints) array of measured time-series.
+    
+    grids, bounds, Ns :
+        As passed to `Fit`.
+    
+    indices : list
+        The voxel index of each row of `data`.
+    
+    ncpus : int
+        The number of CPUs used for the grid and the gradient-descent.
+    
+    chunk_size : int
+        The number of voxels scored per matrix product.
+    
+    verbose : int
+        As passed to `Fit`.
+    
+    lean : bool
+        Return the `PopulationFitResult` of each voxel instead of its `Fit`.
+    
+    Returns
+    -------
+    
+    fits : list
+        A list of `Fit` objects, as returned by `parallel_fit`, or of
+        `PopulationFitResult` records if `lean` is True.
+    
+    """
+    
+    # the grid is shared by all the voxels
+    predictions, parameters = model.generate_ballpark_grid(grids, Ns, ncpus)
+    
+    # score it against all the voxels
+    bounded_amplitude = bounds[-2][0] is not None and bounds[-2][0] > 0
+    ballparks, rss = batch_brute_force_search(data, predictions, parameters,
+                                              bounded_amplitude, chunk_size, bounds)
+    
+    def seeded_fit(voxel): # pragma: no cover
+        fit = Fit(model, data[voxel], grids, bounds, voxel_index=indices[voxel],
+                  Ns=Ns, auto_fit=False, verbose=verbose)
+        fit.ballpark = ballparks[voxel]
+        fit.run()
+        if lean:
+            return fit.result
+        return fit
+    
+    # finish each voxel
+    voxels = np.arange(len(data))
+    if ncpus > 1: # pragma: no cover
+        with sharedmem.Pool(np=ncpus) as pool:
+            fits = pool.map(seeded_fit, voxels)
+    else:
+        fits = [seeded_fit(voxel) for voxel in voxels]
+    
+    return fits
+
+def load_functional(nifti):
+    
+    r"""Returns the data of a functional NIfTI without reading it into memory.
+    
+    An uncompressed NIfTI is memory-mapped read-only, so indexing a handful
+    of voxels only reads those voxels from disk. A compressed NIfTI cannot
+    be memory-mapped and is read in full.
+    
+    Parameters
+    ----------
+    nifti : str or `nibabel.Nifti1Image`
+        The path to the functional data, or an image loaded with nibabel.
+    
+    Returns
+    -------
+    image : `nibabel.Nifti1Image`
+        The image, for its header and affine.
+    
+    data : ndarray
+        The (x, y, z, time) data array.
+    
+    """
+    
+    if isinstance(nifti, string_types):
+        nifti = nibabel.load(nifti, mmap='r')
+    
+    return nifti, np.asanyarray(nifti.dataobj)
+
+class FunctionalData(object):
+    
+    r"""
+    Functional data that each worker opens for itself and reads by voxel.
+    
+    Rather than the parent loading the (x, y, z, time) data and shipping a
+    time-series to every worker, the parent hands out voxel indices and this
+    object. Only the paths are pickled. Each process memory-maps the files on
+    first use, so reading a voxel only reads that voxel from disk and the
+    data is never copied into a worker.
+    
+    Paramaters
+    ----------
+    paths : str, `nibabel.Nifti1Image` or list
+        One or more uncompressed NIfTI or .npy files of (x, y, z, time) data.
+        Several runs are concatenated along time. An image already loaded
+        with nibabel is kept as is, and pickled whole.
+    
+    """
+    
+    def __init__(self, paths):
+        
+        if isinstance(paths, string_types + (nibabel.Nifti1Image,)):
+            paths = [paths]
+        
+        self.paths = list(paths)
+        self.arrays = None
+    
+    def __getstate__(self):
+        
+        # the memory-maps are reopened by whoever unpickles this
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+    
+    def open(self):
+        
+        r"""Memory-maps the runs, once per process."""
+        
+        if self.arrays is None:
+            self.arrays = []
+            for path in self.paths:
+                if isinstance(path, string_types) and path.endswith('.npy'):
+                    self.arrays.append(np.load(path, mmap_mode='r'))
+                else:
+                    self.arrays.append(load_functional(path)[1])
+        
+        return self.arrays
+    
+    @property
+    def shape(self):
+        
+        arrays = self.open()
+        return tuple(arrays[0].shape[0:3]) + (sum([a.shape[-1] for a in arrays]),)
+    
+    @property
+    def image(self):
+        
+        r"""The NIfTI image of the first run, for its header and affine, or None for .npy data."""
+        
+        path = self.paths[0]
+        if isinstance(path, string_types) and path.endswith('.npy'):
+            return None
+        return load_functional(path)[0]
+    
+    def timeseries(self, indices):
+        
+        r"""The time-series of one voxel index (x, y, z), or of an (n x 3) array of them."""
+        
+        indices = np.asarray(indices)
+        selection = tuple(indices[...,i] for i in range(3))
+        
+        return np.concatenate([np.asarray(a[selection], dtype='double') for a in self.open()], -1)
+
+def source_bundle(Fit, model, source, grids, bounds, indices, Ns=None, auto_fit=True, verbose=1):
+    
+    r"""
+    Like `multiprocess_bundle`, but holding only the voxel indices.
+    
+    Each entry carries `source`, a `FunctionalData`, in place of a
+    time-series, and `parallel_fit_source` reads the voxel in the worker.
+    
+    """
+    
+    num_voxels = len(indices)
+    
+    dat = list(zip(repeat(Fit,num_voxels),
+                   repeat(model,num_voxels),
+                   repeat(source,num_voxels),
+                   repeat(grids,num_voxels),
+                   repeat(bounds,num_voxels),
+                   [tuple(index) for index in indices],
+                   repeat(Ns,num_voxels),
+                   repeat(auto_fit,num_voxels),
+                   repeat(verbose,num_voxels)))
+    
+    # randomize list order
+    idx = np.argsort(np.random.rand(len(dat)))
+    dat = [dat[i] for i in idx]
+    
+    return dat
+
+def parallel_fit_source(args):
+    
+    r"""
+    Fits one entry of `source_bundle`, reading its voxel from the
+    `FunctionalData` in the worker, and returns the lean
+    `PopulationFitResult`.
+    
+    """
+    
+    Fit, model, source, grids, bounds, voxel_index, Ns, auto_fit, verbose = args
+    
+    # read this voxel
+    data = source.timeseries(voxel_index)
+    
+    # fit the data
+    fit = Fit(model, data, grids, bounds, voxel_index=voxel_index, Ns=Ns,
+              auto_fit=auto_fit, verbose=verbose)
+    
+    return fit.result
+
+def fit_volume(model, Fit, nifti, mask, grids, bounds, Ns=None, ncpus=1, 
+               chunk_size=1000, overloaded=False, verbose=0):
+    
+    r"""
+    Fits every voxel of a functional volume within `mask`.
+    
+    Unlike `multiprocess_bundle` and `recast_estimation_results`, no
+    per-voxel argument tuples are built and no `Fit` objects are kept. The
+    functional data is memory-mapped with `load_functional` and each worker
+    is handed a contiguous chunk of the voxels by index. The worker reads
+    that chunk, scores it against the shared grid with
+    `batch_brute_force_search`, finishes each voxel and writes its estimate
+    and r-squared straight into a preallocated shared output volume. Peak
+    memory therefore scales with `chunk_size` rather than with the number
+    of voxels.
+    
+    Paramaters
+    ----------
+    model : `PopulationModel` class instance
+        The pRF model.
+    
+    Fit : `PopulationFit` class
+        The fit class of the model, e.g. `popeye.og.GaussianFit`.
+    
+    nifti : str, `nibabel.Nifti1Image` or `FunctionalData`
+        The (x, y, z, time) functional data.
+    
+    mask : ndarray or `nibabel.Nifti1Image`
+        An (x, y, z) volume that is non-zero for the voxels to be fit.
+    
+    grids, bounds, Ns :
+        As passed to `Fit`.
+    
+    ncpus : int
+        The number of CPUs used for the grid and the gradient-descent.
+    
+    chunk_size : int
+        The number of voxels handed to a worker at a time.
+    
+    overloaded : bool
+        Store the `overloaded_estimate` rather than the `estimate`, as in
+        `recast_estimation_results`.
+    
+    verbose : int
+        As passed to `Fit`.
+    
+    Returns
+    -------
+    
+    estimates : `nibabel.Nifti1Image`
+        An (x, y, z, num_parameters+1) volume holding the estimate and the
+        r-squared of each voxel, laid out as in `recast_estimation_results`.
+    
+    """
+    
+    # functional data
+    if not isinstance(nifti, FunctionalData):
+        nifti = FunctionalData(nifti)
+    source = nifti
+    
+    # voxels to fit
+    if hasattr(mask, 'dataobj'):
+        mask = np.asanyarray(mask.dataobj)
+    indices = np.argwhere(np.asarray(mask) != 0)
+    if len(indices) == 0:
+        raise ValueError("The mask does not contain any voxels to fit.")
+    
+    # the grid is shared by all the voxels
+    predictions, parameters = model.generate_ballpark_grid(grids, Ns, ncpus)
+    bounded_amplitude = bounds[-2][0] is not None and bounds[-2][0] > 0
+    
+    def fit_voxel(voxel_data, ballpark, index): # pragma: no cover
+        
+        # finish the voxel and keep only its estimate
+        fit = Fit(model, voxel_data, grids, bounds, voxel_index=tuple(index),
+                  Ns=Ns, auto_fit=False, verbose=verbose)
+        fit.ballpark = ballpark
+        fit.run()
+        
+        if overloaded == True and fit.overloaded_estimate is not None:
+            voxel_dat = list(fit.overloaded_estimate)
+        else:
+            voxel_dat = list(fit.estimate)
+        voxel_dat.append(fit.rsquared)
+        
+        return voxel_dat
+    
+    def fit_chunk(start): # pragma: no cover
+        
+        # read this chunk of voxels
+        chunk = indices[start:start+chunk_size]
+        chunk_data = source.timeseries(chunk)
+        
+        # ballpark them all at once
+        ballparks, rss = batch_brute_force_search(chunk_data, predictions, parameters,
+                                                  bounded_amplitude, chunk_size, bounds)
+        
+        return np.array([fit_voxel(voxel_data, ballpark, index)
+                         for voxel_data, ballpark, index in zip(chunk_data, ballparks, chunk)])
+    
+    # how many values each voxel stores. an estimate is laid out like a ballpark, so a fit
+    # that has not run, given a grid point as its estimate, tells us without fitting a voxel
+    probe = Fit(model, source.timeseries(indices[0]), grids, bounds, voxel_index=tuple(indices[0]),
+                Ns=Ns, auto_fit=False, verbose=verbose)
+    probe.estimate = np.append(parameters[0], (1, 0))
+    if overloaded == True and probe.overloaded_estimate is not None:
+        num_values = len(probe.overloaded_estimate) + 1
+    else:
+        num_values = len(probe.estimate) + 1
+    
+    # initialize the statmaps
+    dims = list(source.shape[0:3])
+    dims.append(num_values)
+    estimates = generate_shared_array(np.zeros(dims), ctypes.c_double)
+    
+    def write_chunk(start, results):
+        chunk = indices[start:start+chunk_size]
+        results[np.isnan(results[:,-1])] = 0
+        estimates[chunk[:,0], chunk[:,1], chunk[:,2]] = results
+    
+    def parallel_chunk(start): # pragma: no cover
+        write_chunk(start, fit_chunk(start))
+        return None
+    
+    # every chunk writes into the shared volume as it finishes
+    starts = np.arange(0, len(indices), chunk_size)
+    if ncpus > 1: # pragma: no cover
+        with sharedmem.Pool(np=ncpus) as pool:
+            pool.map(parallel_chunk, starts)
+    else:
+        for start in starts:
+            parallel_chunk(start)
+    
+    # get header information from the functional data and update for the prf volume
+    image = source.image
+    if image is None:
+        return nibabel.Nifti1Image(np.asarray(estimates), np.eye(4))
+    hdr = image.header.copy()
+    hdr.set_data_shape(dims)
+    
+    # recast as nifti
+    return nibabel.Nifti1Image(np.asarray(estimates), image.affine, header=hdr)
+
 def cartes_to_polar(cartes):
 
     """
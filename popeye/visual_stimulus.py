@@ -11,14 +11,21 @@ from __future__ import division
 import ctypes
 import gc
 import sys  
+from collections import OrderedDict
 
 import numpy as np
+import sharedmem
 from scipy.ndimage.interpolation import zoom
+from scipy.sparse import csr_matrix
 from scipy.io import loadmat
 from scipy.signal import square
 
+from popeye.onetime import auto_attr
 from popeye.base import StimulusModel
 import popeye.utilities as utils
+from popeye.profiling import PROFILE
+from popeye.spinach import generate_rf_timeseries_nomask, generate_sparse_rf_timeseries, generate_packed_rf_timeseries
+from popeye.spinach import generate_separable_rf_timeseries
 
 def pixels_per_degree(pixels_across, screen_width, viewing_distance):
 
@@ -70,8 +77,55 @@ def generate_coordinate_matrices(pixels_across, pixels_down, ppd, scale_factor=1
     
     return deg_x, np.flipud(deg_y)
 
+def resampling_matrix(num_pixels, num_resampled, interp='nearest'):
+    
+    """The sparse matrix that resamples `num_pixels` along one axis to `num_resampled`.
+    
+    With 'nearest', each output pixel picks the input pixel that
+    `scipy.ndimage.zoom` would with `order=0`. With 'area', each output pixel
+    averages the input pixels it covers, weighted by their overlap, so thin
+    bars dim rather than alias.
+    
+    Parameters
+    ----------
+    num_pixels : int
+        The length of the axis.
+    
+    num_resampled : int
+        The length of the resampled axis.
+    
+    interp : str
+        'nearest' or 'area'.
+    
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        A (num_resampled x num_pixels) matrix.
+    """
+    
+    rows = np.arange(num_resampled)
+    
+    if interp == 'nearest':
+        if num_resampled > 1:
+            step = (num_pixels - 1) / (num_resampled - 1)
+        else:
+            step = 0
+        cols = np.floor(rows * step + 0.5).astype(int)
+        weights = np.ones(num_resampled)
+        return csr_matrix((weights, (rows, cols)), shape=(num_resampled, num_pixels))
+    
+    if interp == 'area':
+        ratio = num_pixels / num_resampled
+        lo = rows[:,np.newaxis] * ratio
+        hi = lo + ratio
+        pixels = np.arange(num_pixels)[np.newaxis]
+        overlap = np.clip(np.minimum(pixels + 1, hi) - np.maximum(pixels, lo), 0, None)
+        return csr_matrix(overlap / ratio)
+    
+    raise ValueError("Unknown interpolation '%s', use 'nearest' or 'area'" %(interp))
+
 def resample_stimulus(stim_arr, scale_factor=0.05, mode='nearest',
-                      order=0, dtype='uint8'):
+                      order=0, dtype='uint8', interp='nearest', ncpus=1, chunk_size=64):
     
     """Resamples the visual stimulus
     
@@ -81,9 +135,13 @@ def resample_stimulus(stim_arr, scale_factor=0.05, mode='nearest',
     over time.  The first two dimensions of `stim_arr` together represent the
     exent of the visual display (pixels) and the last dimensions represents
     time (TRs).
-
-    The underlying function used here is `scipy.ndimage.zoom`. Some arguments
-    are passed through to that function.
+    
+    The whole volume is resampled at once, `chunk_size` frames at a time,
+    by applying a sparse `resampling_matrix` along each spatial axis. The
+    default, 'nearest', matches `scipy.ndimage.zoom` with `order=0`. 'area'
+    averages the pixels each output pixel covers instead. Interpolation of
+    a higher `order` is left to `scipy.ndimage.zoom`, over the whole volume
+    in one call, and `mode` is passed through to it.
     
     Parameters
     ----------
@@ -104,7 +162,17 @@ def resample_stimulus(stim_arr, scale_factor=0.05, mode='nearest',
         Interpolation order, must be in range 0-5.
 
     dtype : numpy dtype, optional
-        Datatype for the returned array.
+        Datatype for the returned array. Averages are rounded to the nearest
+        integer for an integer datatype.
+    
+    interp : str, optional
+        'nearest' or 'area', used when `order` is 0.
+    
+    ncpus : int, optional
+        The number of CPUs the chunks of frames are split across.
+    
+    chunk_size : int, optional
+        The number of frames resampled at once.
         
     Returns
     -------
@@ -112,22 +180,131 @@ def resample_stimulus(stim_arr, scale_factor=0.05, mode='nearest',
         An array that is resampled according to the user-specified scale factor.
     """
     
+    stim_arr = np.asarray(stim_arr)
     dims = np.shape(stim_arr)
-    resampled_arr = np.zeros((int(round(dims[0] * scale_factor)),
-                              int(round(dims[1] * scale_factor)),
-                              dims[2]), dtype=dtype)
+    shape = (int(round(dims[0] * scale_factor)), int(round(dims[1] * scale_factor)), dims[2])
+    
+    # a smooth interpolation
+    if order > 0:
+        return zoom(stim_arr, (shape[0]/dims[0], shape[1]/dims[1], 1), mode=mode, order=order).astype(dtype)
     
-    # loop
-    for tr in np.arange(dims[-1]):
+    # the resampling along each axis
+    down = resampling_matrix(dims[0], shape[0], interp)
+    across = resampling_matrix(dims[1], shape[1], interp)
+    rounded = np.issubdtype(np.dtype(dtype), np.integer)
+    
+    if ncpus > 1: # pragma: no cover
+        resampled_arr = sharedmem.empty(shape, dtype=dtype)
+    else:
+        resampled_arr = np.zeros(shape, dtype=dtype)
+    
+    def resample_chunk(start):
+        
+        chunk = stim_arr[:,:,start:start+chunk_size]
+        num_frames = chunk.shape[-1]
+        
+        # down the rows, then across the columns
+        f = down.dot(chunk.reshape(dims[0], -1)).reshape(shape[0], dims[1], num_frames)
+        f = across.dot(f.transpose(1,0,2).reshape(dims[1], -1)).reshape(shape[1], shape[0], num_frames)
+        f = f.transpose(1,0,2)
         
-        # resize it
-        f = zoom(stim_arr[:,:,tr], scale_factor, mode=mode, order=order)
+        if rounded:
+            f = np.round(f)
         
         # insert it
-        resampled_arr[:,:,tr] = f
+        resampled_arr[:,:,start:start+num_frames] = f
+    
+    starts = range(0, dims[-1], chunk_size)
+    
+    if ncpus > 1: # pragma: no cover
+        with sharedmem.Pool(np=ncpus) as pool:
+            pool.map(resample_chunk, starts)
+    else:
+        for start in starts:
+            resample_chunk(start)
     
     return resampled_arr
 
+def pixel_matrix(stim_arr, dtype='float32'):
+    
+    """Flattens an (x,y,time) stimulus into a contiguous (pixels,time) matrix.
+    
+    Each row holds the time-series of one pixel, in the same C-order as
+    `numpy.ravel` of the display, so a receptive field flattened with
+    `numpy.ravel` lines up with the rows.
+    
+    Parameters
+    ----------
+    stim_arr : ndarray
+        The (x,y,time) stimulus.
+    
+    dtype : numpy dtype, optional
+        Datatype for the returned matrix.
+    
+    Returns
+    -------
+    stim_mat : ndarray
+        The (pixels,time) stimulus matrix.
+    """
+    
+    stim_arr = np.asarray(stim_arr)
+    return np.ascontiguousarray(stim_arr.reshape(-1, stim_arr.shape[-1]), dtype=dtype)
+
+def pack_stimulus(stim_arr):
+    
+    """Packs a binary (x,y,time) stimulus into one bit per pixel and timepoint.
+    
+    The pixels are laid out as in `pixel_matrix` and each pixel's time-series
+    is packed 8 timepoints to a byte with `numpy.packbits`, taking a 16th of
+    the memory of an int16 stimulus. The stimulus is packed a row of the
+    display at a time, so no full-size copy of it is made.
+    
+    Parameters
+    ----------
+    stim_arr : ndarray
+        The (x,y,time) stimulus. Every value must be 0 or 1.
+    
+    Returns
+    -------
+    stim_bits : ndarray
+        The (pixels,ceil(time/8)) uint8 packed stimulus.
+    """
+    
+    stim_arr = np.asarray(stim_arr)
+    rows, cols, frames = stim_arr.shape
+    stim_bits = np.zeros((rows*cols, (frames+7)//8), dtype='uint8')
+    
+    for row in range(rows):
+        
+        block = stim_arr[row]
+        if np.any((block != 0) & (block != 1)):
+            raise ValueError("Only a binary stimulus can be packed, its values must be 0 or 1.")
+        
+        stim_bits[row*cols:(row+1)*cols] = np.packbits(block != 0, axis=-1)
+    
+    return stim_bits
+
+def unpack_stimulus(stim_bits, shape):
+    
+    """Unpacks a stimulus packed with `pack_stimulus` into an (x,y,time) array.
+    
+    Parameters
+    ----------
+    stim_bits : ndarray
+        The (pixels,ceil(time/8)) packed stimulus.
+    
+    shape : tuple
+        The (x,y,time) shape of the stimulus.
+    
+    Returns
+    -------
+    stim_arr : ndarray
+        The uint8 (x,y,time) stimulus.
+    """
+    
+    stim_mat = np.unpackbits(stim_bits, axis=-1)[:, 0:shape[-1]]
+    return stim_mat.reshape(shape)
+
 def gaussian_2D(X, Y, x0, y0, sigma_x, sigma_y, degrees, amplitude=1):
     
     """
@@ -176,19 +353,24 @@ def gaussian_2D(X, Y, x0, y0, sigma_x, sigma_y, degrees, amplitude=1):
     
     return Z
 
-def simulate_sinflicker_bar(pixels_across, pixels_down, 
-                            viewing_distance, screen_width, 
-                            thetas, sweep_steps, bar_width,
-                            ecc, tr_length, flicker_hz, projector_hz):
+def generate_sinflicker_frames(pixels_across, pixels_down, 
+                               viewing_distance, screen_width, 
+                               thetas, sweep_steps, bar_width,
+                               ecc, tr_length, flicker_hz, projector_hz):
+    
+    """Yields the frames of `simulate_sinflicker_bar` one at a time, at the projector rate.
+    
+    See `stream_stimulus` for binning them into TRs without holding the
+    whole run in memory.
+    """
     
     # get number of frames per volume
     frames_per_vol = tr_length*projector_hz
     total_trs = len(thetas)*sweep_steps
-    total_frames = frames_per_vol * total_trs
     total_secs = total_trs*tr_length
     
     # flicker
-    t = np.linspace(0,total_secs,total_secs*projector_hz)
+    t = np.linspace(0,total_secs,int(total_secs*projector_hz))
     full_run = np.sin(2 * np.pi * flicker_hz * t)
     full_run = np.uint8((full_run + 1) * 128)
     
@@ -196,9 +378,6 @@ def simulate_sinflicker_bar(pixels_across, pixels_down,
     ppd = np.pi*pixels_across/np.arctan(screen_width/viewing_distance/2.0)/360.0 # degrees of visual angle
     deg_x, deg_y = generate_coordinate_matrices(pixels_across, pixels_down, ppd, 1.0)
     
-    # initialize the bar array
-    bar_stimulus = np.uint8(np.ones((pixels_down, pixels_across, total_frames)))
-    
     # counter
     tr_num = 0
     
@@ -230,23 +409,23 @@ def simulate_sinflicker_bar(pixels_across, pixels_down,
                 
                 # generate the gaussian
                 Z = gaussian_2D(deg_x,deg_y,xy0[0],xy0[1],sigma_x,sigma_y,theta)
-                Z_mask = np.zeros_like(Z)
-                Z_mask[Z>0.33] = 1
+                
+                # get the bar pixels
+                xx,yy = np.nonzero(Z>0.33)
                 
                 # loop over each flip
                 for fr in np.arange(frames_per_vol):
                     
                     # get the frame number
-                    f_num = tr_num * frames_per_vol + fr
+                    f_num = int(tr_num * frames_per_vol + fr)
                     
                     # set the frame to mean lum
-                    bar_stimulus[:,:,f_num] = 128
-                    
-                    # get the bar pixels
-                    xx,yy = np.nonzero(Z_mask)
+                    frame = np.zeros((pixels_down, pixels_across), dtype='uint8') + 128
                     
                     # set the amp modulation
-                    bar_stimulus[xx,yy,f_num] = full_run[f_num]
+                    frame[xx,yy] = full_run[f_num]
+                    
+                    yield frame
                     
                 # iterate TR
                 tr_num += 1
@@ -256,19 +435,123 @@ def simulate_sinflicker_bar(pixels_across, pixels_down,
             # step through each volume
             for step in np.arange(0,sweep_steps):
                                 
-                # step through each flip
+                # step through each flip, at mean luminance
                 for f in np.arange(frames_per_vol):
-                    
-                    # get the frame number
-                    f_num = tr_num * frames_per_vol + f
-                    
-                    # set the frame to mean luminance
-                    bar_stimulus[:,:,f_num] = 128
+                    yield np.zeros((pixels_down, pixels_across), dtype='uint8') + 128
                     
                 # iterate
                 tr_num += 1
-       
-    return bar_stimulus
+
+def simulate_sinflicker_bar(pixels_across, pixels_down, 
+                            viewing_distance, screen_width, 
+                            thetas, sweep_steps, bar_width,
+                            ecc, tr_length, flicker_hz, projector_hz):
+    
+    frames = generate_sinflicker_frames(pixels_across, pixels_down, viewing_distance, screen_width,
+                                        thetas, sweep_steps, bar_width, ecc, tr_length, flicker_hz, projector_hz)
+    
+    return np.dstack(list(frames))
+
+def iter_frames(source):
+    
+    """Yields the 2D frames of a movie one at a time.
+    
+    Parameters
+    ----------
+    source : iterable, ndarray or str
+        An iterable of 2D frames, such as `generate_sinflicker_frames`. An
+        (x,y,frames) array, including a `numpy.memmap`. The path of an
+        (x,y,frames) .npy file, which is memory-mapped. Or a sequence of
+        image file paths, read with `matplotlib.image.imread` and averaged
+        across color channels.
+    
+    Returns
+    -------
+    frames : generator
+        The frames, in order.
+    """
+    
+    if isinstance(source, utils.string_types):
+        source = np.load(source, mmap_mode='r')
+    
+    if isinstance(source, np.ndarray):
+        for f in range(source.shape[-1]):
+            yield source[:,:,f]
+        return
+    
+    for frame in source:
+        
+        if isinstance(frame, utils.string_types):
+            from matplotlib.image import imread
+            frame = imread(frame)
+            if frame.ndim == 3:
+                frame = np.mean(frame[:,:,0:3], -1)
+        
+        yield frame
+
+def stream_stimulus(source, frames_per_bin, scale_factor=1.0, interp='area', dtype='float32'):
+    
+    """Builds an (x,y,time) stimulus from a stream of frames, one frame at a time.
+    
+    Each frame is downsampled with `resampling_matrix` as it is read and
+    averaged into its time bin, so the full-rate, full-resolution movie is
+    never held in memory. Only the binned stimulus is. Bins are usually TRs,
+    with `frames_per_bin` the number of frames per TR, and can be flicker
+    sub-bins instead.
+    
+    Parameters
+    ----------
+    source : iterable, ndarray or str
+        The frames, see `iter_frames`.
+    
+    frames_per_bin : float
+        The number of frames averaged into each time bin, such as
+        `tr_length * projector_hz`. Need not be a whole number.
+    
+    scale_factor : float
+        The scale factor by which each frame is resampled.
+    
+    interp : str
+        'area' or 'nearest', see `resample_stimulus`.
+    
+    dtype : numpy dtype
+        Datatype for the returned array.
+    
+    Returns
+    -------
+    stim_arr : ndarray
+        The (x,y,bins) stimulus, ready for `VisualStimulus`. A trailing
+        partial bin is averaged over the frames it received.
+    """
+    
+    bins = []
+    total = None
+    count = 0
+    
+    for f, frame in enumerate(iter_frames(source)):
+        
+        # downsample it
+        if total is None:
+            dims = np.shape(frame)
+            shape = (int(round(dims[0] * scale_factor)), int(round(dims[1] * scale_factor)))
+            down = resampling_matrix(dims[0], shape[0], interp)
+            across = resampling_matrix(dims[1], shape[1], interp)
+            total = np.zeros(shape)
+        
+        # the bin this frame falls in
+        if int(f // frames_per_bin) > len(bins):
+            bins.append(total / count)
+            total = np.zeros_like(total)
+            count = 0
+        
+        # accumulate
+        total += across.dot(down.dot(np.asarray(frame, dtype='double')).T).T
+        count += 1
+    
+    if count:
+        bins.append(total / count)
+    
+    return np.asarray(np.dstack(bins), dtype=dtype)
 
 def simulate_bar_stimulus(pixels_across, pixels_down, 
                           viewing_distance, screen_width, 
@@ -386,9 +669,12 @@ def simulate_bar_stimulus(pixels_across, pixels_down,
 # above this called Stimulus that would be generic for n-dimentional feature spaces.
 class VisualStimulus(StimulusModel):
     
+    # the number of HRF-convolved stimuli kept by `convolved`
+    max_convolved_stimuli = 2
+    
     
     def __init__(self, stim_arr, viewing_distance, screen_width,
-                 scale_factor, tr_length, dtype, interp='nearest'):
+                 scale_factor, tr_length, dtype, interp='nearest', layout='native', ncpus=1):
         
         """
         
@@ -413,21 +699,56 @@ class VisualStimulus(StimulusModel):
             The downsampling rate for ball=parking a solution. The `stim_arr` is
             downsampled so as to speed up the fitting procedure.  The final model
             estimates will be derived using the non-downsampled stimulus.
+        
+        interp : str
+            How `stim_arr` is downsampled, see `resample_stimulus`. 'nearest'
+            keeps a binary aperture binary, 'area' averages the pixels so thin
+            bars are not lost. The averages are kept as float32 in `stim_arr0`,
+            since rounding them to `dtype` would lose those bars again. They
+            are not binary, so 'area' cannot be combined with the 'packed'
+            layout.
+        
+        layout : str
+            'native' keeps only the (x,y,time) `stim_arr`. 'pixels' also stores
+            the stimulus as a contiguous (pixels x time) float32 matrix,
+            `stim_mat`, so that `project` is a single BLAS call. 'packed' stores
+            a binary aperture stimulus as one bit per pixel and timepoint,
+            `stim_bits`, instead of `stim_arr`. It is packed straight from the
+            `stim_arr` given, with no full-size copy in shared memory. `project`
+            reads the bits directly, and `stim_arr` is only unpacked if
+            something else asks for it. A model that reads `stim_arr` itself
+            refuses a 'packed' stimulus, see `PopulationModel.packed_stimulus`.
+        
+        ncpus : int
+            The number of CPUs used to downsample the stimulus.
             
         """
         
-        StimulusModel.__init__(self, stim_arr, dtype, tr_length)
+        if layout not in ('native', 'pixels', 'packed'):
+            raise ValueError("Unknown stimulus layout '%s', use 'native', 'pixels' or 'packed'" %(layout))
+        
+        if layout == 'packed' and interp == 'area' and scale_factor != 1.0:
+            raise ValueError("An area-resampled stimulus is not binary, use the 'native' or 'pixels' layout.")
+        
+        # a packed stimulus is packed straight from `stim_arr`, without sharing it first
+        if layout == 'packed':
+            self.dtype = dtype
+            self.tr_length = tr_length
+        else:
+            StimulusModel.__init__(self, stim_arr, dtype, tr_length)
+            stim_arr = self.stim_arr
         
         # absorb the vars
         self.viewing_distance = viewing_distance
         self.screen_width = screen_width
         self.scale_factor = scale_factor
         self.interp = interp
+        self.layout = layout
         
         # ascertain stimulus features
-        self.pixels_across = self.stim_arr.shape[1]
-        self.pixels_down = self.stim_arr.shape[0]
-        self.run_length = self.stim_arr.shape[2]
+        self.pixels_across = stim_arr.shape[1]
+        self.pixels_down = stim_arr.shape[0]
+        self.run_length = stim_arr.shape[2]
         self.ppd = pixels_per_degree(self.pixels_across, self.screen_width, self.viewing_distance)
         
         # generate coordinate matrices
@@ -436,18 +757,20 @@ class VisualStimulus(StimulusModel):
         # share coordinate matrices
         self.deg_x = utils.generate_shared_array(deg_x, ctypes.c_double)
         self.deg_y = utils.generate_shared_array(deg_y, ctypes.c_double)
-        self.stim_arr = utils.generate_shared_array(stim_arr, dtype)
         
         if self.scale_factor == 1.0:
             
-            self.stim_arr0 = self.stim_arr
             self.deg_x0 = self.deg_x
             self.deg_y0 = self.deg_y
+            stim_arr0 = stim_arr
+            if self.layout != 'packed':
+                self.stim_arr0 = self.stim_arr
             
         else:
             
-            # create downsampled stimulus
-            stim_arr0 = resample_stimulus(self.stim_arr, self.scale_factor)
+            # create downsampled stimulus, unrounded until it is shared
+            stim_arr0 = resample_stimulus(stim_arr, self.scale_factor, dtype='float32',
+                                          interp=self.interp, ncpus=ncpus)
             
             # generate the coordinate matrices
             deg_x0, deg_y0 = generate_coordinate_matrices(self.pixels_across, self.pixels_down, self.ppd, self.scale_factor)
@@ -455,9 +778,345 @@ class VisualStimulus(StimulusModel):
             # share the arrays
             self.deg_x0 = utils.generate_shared_array(deg_x0, ctypes.c_double)
             self.deg_y0 = utils.generate_shared_array(deg_y0, ctypes.c_double)
-            self.stim_arr0 = utils.generate_shared_array(stim_arr0, dtype)
+            if self.interp == 'area':
+                self.stim_arr0 = utils.generate_shared_array(stim_arr0, ctypes.c_float)
+            elif self.layout == 'packed':
+                stim_arr0 = np.round(stim_arr0)
+            else:
+                self.stim_arr0 = utils.generate_shared_array(np.round(stim_arr0), dtype)
         
         # add ppd for the down-sampled stimulus
         self.ppd0 = pixels_per_degree(self.pixels_across*self.scale_factor, self.screen_width, self.viewing_distance)
         
+        # pixel-major copies for projecting with BLAS
+        if self.layout == 'pixels':
+            self.stim_mat = utils.generate_shared_array(pixel_matrix(self.stim_arr), ctypes.c_float)
+            self.stim_mat0 = utils.generate_shared_array(pixel_matrix(stim_arr0), ctypes.c_float)
+        
+        # or bits in place of the stimulus
+        elif self.layout == 'packed':
+            self.stim_bits = utils.generate_shared_array(pack_stimulus(stim_arr), ctypes.c_uint8)
+            if self.scale_factor == 1.0:
+                self.stim_bits0 = self.stim_bits
+            else:
+                self.stim_bits0 = utils.generate_shared_array(pack_stimulus(stim_arr0), ctypes.c_uint8)
+        
+        # HRF-convolved copies of the stimulus, see `convolved`
+        self.convolved_stimuli = OrderedDict()
+        
+        # the levels of the stimulus pyramid, see `resampled`
+        self.pyramid_levels = {}
+    
+    def resampled(self, scale_factor):
+        
+        r"""This stimulus resampled by `scale_factor`, as a `VisualStimulus` of its own.
+        
+        Together, the resampled stimuli form a pyramid between the coarse
+        `stim_arr0` of the grid-search and the native `stim_arr`, which
+        `PopulationModel.pyramid` has the finisher climb. Each level is
+        built once and kept. Since a resampled aperture is not necessarily
+        binary, a 'packed' stimulus has 'native' levels.
+        
+        """
+        
+        if scale_factor == 1.0:
+            return self
+        
+        if scale_factor not in self.pyramid_levels:
+            
+            if self.layout == 'packed':
+                layout = 'native'
+            else:
+                layout = self.layout
+            
+            # area averages stay float32, as in `stim_arr0`
+            if self.interp == 'area':
+                dtype = ctypes.c_float
+            else:
+                dtype = self.dtype
+            
+            # a packed stimulus that was never unpacked is unpacked just for this
+            if self.layout == 'packed' and 'stim_arr' not in self.__dict__:
+                stim_arr = unpack_stimulus(self.stim_bits, (self.pixels_down, self.pixels_across, self.run_length))
+            else:
+                stim_arr = self.stim_arr
+            
+            stim_arr = resample_stimulus(stim_arr, scale_factor, dtype=np.dtype(dtype), interp=self.interp)
+            self.pyramid_levels[scale_factor] = VisualStimulus(stim_arr, self.viewing_distance, self.screen_width,
+                                                               1.0, self.tr_length, dtype, self.interp, layout)
+        
+        return self.pyramid_levels[scale_factor]
+    
+    def pixel_block(self, start, stop, downsampled=False):
+        
+        r"""The time-series of pixels `start` to `stop`, whatever the layout."""
+        
+        if self.layout == 'packed':
+            stim_bits = self.stim_bits0 if downsampled else self.stim_bits
+            block = np.unpackbits(stim_bits[start:stop], axis=-1)[:, 0:self.run_length]
+        elif self.layout == 'pixels':
+            block = (self.stim_mat0 if downsampled else self.stim_mat)[start:stop]
+        else:
+            stim_arr = self.stim_arr0 if downsampled else self.stim_arr
+            block = stim_arr.reshape(-1, self.run_length)[start:stop]
+        
+        return np.asarray(block, dtype='double')
+    
+    def convolved(self, hrf, downsampled=False, chunk_size=10000):
+        
+        r"""The stimulus with every pixel's time-series convolved with `hrf`.
+        
+        Convolution is linear, so the prediction of a linear receptive field
+        is the same whether the HRF is applied after the weighted pixel sum
+        or to every pixel beforehand. The latter is done here, once per HRF
+        kernel, and kept in shared memory, so that a prediction no longer
+        needs an FFT. See `project_convolved`.
+        
+        Only the `max_convolved_stimuli` most recently used kernels are kept.
+        Build the matrix before forking the workers, so that it is shared.
+        
+        Returns
+        -------
+        
+        stim_mat : ndarray
+            The (pixels x time) float32 convolved stimulus.
+        
+        """
+        
+        key = (utils.fingerprint(hrf), downsampled)
+        
+        # a hit becomes the most recently used
+        if key in self.convolved_stimuli:
+            self.convolved_stimuli[key] = self.convolved_stimuli.pop(key)
+        
+        else:
+            
+            # make room, least recently used first
+            while len(self.convolved_stimuli) >= self.max_convolved_stimuli:
+                self.convolved_stimuli.popitem(last=False)
+            
+            # a block of pixels at a time, via the FFT
+            deg_x = self.deg_x0 if downsampled else self.deg_x
+            num_pixels = deg_x.shape[0] * deg_x.shape[1]
+            hrf_fft, nfft = utils.hrf_spectrum(hrf, self.run_length)
+            stim_mat = utils.generate_shared_array(np.zeros((num_pixels, self.run_length)), ctypes.c_float)
+            for start in range(0, num_pixels, chunk_size):
+                block = np.fft.rfft(self.pixel_block(start, start+chunk_size, downsampled), nfft, axis=-1)
+                stim_mat[start:start+chunk_size] = np.fft.irfft(block * hrf_fft, nfft, axis=-1)[:, 0:self.run_length]
+            
+            self.convolved_stimuli[key] = stim_mat
+        
+        return self.convolved_stimuli[key]
+    
+    def project_convolved(self, weights, hrf, pixels=None, downsampled=False):
+        
+        r"""Like `project`, but through the stimulus convolved with `hrf`.
+        
+        This equals convolving the output of `project` with `hrf` and
+        keeping its first `run_length` timepoints, without the FFT.
+        
+        """
+        
+        stim_mat = self.convolved(hrf, downsampled)
+        weights = np.asarray(weights, dtype='float32')
+        
+        if pixels is not None:
+            return np.dot(weights, stim_mat[pixels]).astype('double')
+        
+        response = np.dot(weights.reshape(-1, stim_mat.shape[0]), stim_mat).astype('double')
+        if weights.ndim == 2:
+            return response[0]
+        return response
+    
+    @auto_attr
+    def stim_arr(self):
+        
+        r"""The (x,y,time) stimulus of a packed layout, unpacked on first use."""
+        
+        shape = (self.pixels_down, self.pixels_across, self.run_length)
+        return utils.generate_shared_array(unpack_stimulus(self.stim_bits, shape), self.dtype)
+    
+    @auto_attr
+    def stim_arr0(self):
+        
+        r"""The downsampled (x,y,time) stimulus of a packed layout, unpacked on first use."""
+        
+        shape = self.deg_x0.shape + (self.run_length,)
+        return utils.generate_shared_array(unpack_stimulus(self.stim_bits0, shape), self.dtype)
+    
+    @auto_attr
+    def fingerprint(self):
+        
+        r"""A hash of the stimulus, used to tell whether a cached model is stale."""
+        
+        # hash the bits rather than unpacking the stimulus
+        if self.layout == 'packed':
+            settings = np.array([self.tr_length, self.scale_factor, self.run_length], dtype='double')
+            return utils.fingerprint(self.stim_bits, settings)
+        
+        return StimulusModel.fingerprint(self)
+    
+    def project(self, weights, pixels=None, downsampled=False, chunk_size=10000):
+        
+        r"""The stimulus time-series seen through one or more receptive fields.
+        
+        Paramaters
+        ----------
+        
+        weights : ndarray
+            A receptive field the shape of the display, or a stack of them
+            with the receptive field as the first dimension. If `pixels` is
+            given, the weights of just those pixels instead.
+        
+        pixels : ndarray
+            The flat index of each weight in the display, as returned by
+            `PopulationModel.sparse_receptive_field`.
+        
+        downsampled : bool
+            Project the downsampled stimulus, `stim_arr0`, instead.
+        
+        chunk_size : int
+            The number of pixels read at a time when projecting a stack onto
+            the native or packed layouts.
+        
+        Returns
+        -------
+        
+        response : ndarray
+            The weighted sum of the stimulus at each timepoint, one row per
+            receptive field when a stack was given.
+        
+        """
+        
+        with PROFILE.timer('project'):
+            
+            weights = np.asarray(weights, dtype='double')
+            
+            # a stack is one matrix product, a block of pixels at a time
+            if pixels is None and weights.ndim == 3 and self.layout != 'pixels':
+                rfs = weights.reshape(weights.shape[0], -1)
+                response = np.zeros((rfs.shape[0], self.run_length))
+                for start in range(0, rfs.shape[1], chunk_size):
+                    response += np.dot(rfs[:, start:start+chunk_size],
+                                       self.pixel_block(start, start+chunk_size, downsampled))
+                return response
+            
+            # straight from the bits
+            if self.layout == 'packed':
+            
+                if downsampled:
+                    stim_bits = self.stim_bits0
+                else:
+                    stim_bits = self.stim_bits
+            
+                if pixels is None:
+                    pixels = np.flatnonzero(weights)
+                    weights = weights.ravel()[pixels]
+            
+                PROFILE.count('kernel')
+                return generate_packed_rf_timeseries(stim_bits, np.asarray(pixels, dtype=np.intp), weights, self.run_length)
+            
+            # gemv/gemm on the pixel-major matrix
+            if self.layout == 'pixels':
+            
+                if downsampled:
+                    stim_mat = self.stim_mat0
+                else:
+                    stim_mat = self.stim_mat
+            
+                if pixels is not None:
+                    return np.dot(weights.astype('float32'), stim_mat[pixels]).astype('double')
+            
+                rfs = weights.reshape(-1, stim_mat.shape[0]).astype('float32')
+                response = np.dot(rfs, stim_mat).astype('double')
+                if weights.ndim == 2:
+                    return response[0]
+                return response
+            
+            # the spinach kernels on the native layout
+            if downsampled:
+                stim_arr = self.stim_arr0
+            else:
+                stim_arr = self.stim_arr
+            
+            if pixels is not None:
+                PROFILE.count('kernel')
+                return generate_sparse_rf_timeseries(stim_arr, pixels, weights)
+            PROFILE.count('kernel')
+            return generate_rf_timeseries_nomask(stim_arr, weights)
+    
+    def project_separable(self, row_weights, col_weights, row0=0, col0=0, downsampled=False, hrf=None):
+        
+        r"""The stimulus time-series seen through a separable receptive field.
+        
+        The receptive field is the outer product of `row_weights`, over the
+        rows from `row0`, and `col_weights`, over the columns from `col0`. It
+        is applied as two contractions of the stimulus, first along its
+        columns and then along its rows, so no receptive field the shape of
+        the display is formed.
+        
+        Paramaters
+        ----------
+        
+        row_weights : ndarray
+            The profile of the receptive field down the rows.
+        
+        col_weights : ndarray
+            The profile of the receptive field across the columns.
+        
+        row0, col0 : int
+            The first row and column the receptive field covers.
+        
+        downsampled : bool
+            Project the downsampled stimulus, `stim_arr0`, instead.
+        
+        hrf : ndarray
+            If given, project the stimulus convolved with `hrf` instead, see
+            `convolved`.
+        
+        Returns
+        -------
+        
+        response : ndarray
+            The weighted sum of the stimulus at each timepoint.
+        
+        """
+        
+        with PROFILE.timer('project'):
+            
+            row_weights = np.asarray(row_weights, dtype='double')
+            col_weights = np.asarray(col_weights, dtype='double')
+            row1 = row0 + len(row_weights)
+            col1 = col0 + len(col_weights)
+            
+            num_rows, num_cols = (self.deg_x0 if downsampled else self.deg_x).shape
+            
+            # the spinach kernel on the native layout
+            if hrf is None and self.layout == 'native':
+                
+                if downsampled:
+                    stim_arr = self.stim_arr0
+                else:
+                    stim_arr = self.stim_arr
+                
+                PROFILE.count('kernel')
+                return generate_separable_rf_timeseries(stim_arr, row_weights, col_weights, row0, col0)
+            
+            # a receptive field off the display sees nothing
+            if row1 <= row0 or col1 <= col0:
+                return np.zeros(self.run_length)
+            
+            # otherwise just the rows it covers, whose pixels are contiguous
+            if hrf is not None:
+                stim_mat = self.convolved(hrf, downsampled)
+                block = stim_mat[row0*num_cols:row1*num_cols]
+            else:
+                block = self.pixel_block(row0*num_cols, row1*num_cols, downsampled)
+            
+            block = block.reshape(row1-row0, num_cols, self.run_length)[:, col0:col1]
+            
+            # contract the columns, then the rows
+            row_sums = np.tensordot(block, col_weights, axes=([1],[0]))
+            return np.dot(row_weights, row_sums).astype('double')
+        
         
@@ -55,11 +55,19 @@ opts = dict(name=NAME,
 from distutils.extension import Extension
 from Cython.Distutils import build_ext as build_pyx_ext
 from numpy import get_include
+# the spinach kernels can split a prediction across OpenMP threads. apple's
+# clang doesn't ship OpenMP, so there they are built single-threaded
+if sys.platform == 'darwin':
+    openmp = []
+else:
+    openmp = ['-fopenmp']
+
 # add Cython extensions to the setup options
 exts = [Extension('popeye.spinach',
                   ['popeye/spinach.pyx'],
                    include_dirs=[get_include()],
-                   extra_compile_args=['-O3', '-march=native', '-mtune=native', '-funroll-loops',])
+                   extra_compile_args=['-O3', '-march=native', '-mtune=native', '-funroll-loops',] + openmp,
+                   extra_link_args=openmp)
                   ]
 opts['cmdclass'] = dict(build_ext=build_pyx_ext)
 opts['ext_modules'] = exts